@@ -0,0 +1,390 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import accumulate
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import typer
+from fastapi.encoders import jsonable_encoder
+
+from owntwitter.models.models import Comment, Post, User
+from owntwitter.models.settings import Settings
+from owntwitter.services.async_db import AsyncDatabaseConnector
+
+# Seeds a dataset with power-law (Zipf) distributed popularity, drives the api
+# with a mix of concurrent requests and reports latency percentiles and
+# throughput per endpoint. Results can be saved as a baseline and later runs
+# compared against it to catch regressions. The dataset lives in a dedicated
+# database that is dropped before and after each run.
+
+app = typer.Typer()
+
+DEFAULT_MIX = (
+    "feed=30,post=15,user_posts=10,comments=15,timeline=15,"
+    "likes=5,like=5,create_post=5"
+)
+
+
+class Dataset:
+    """Seeded ids, with the Zipf weights requests use to pick them."""
+
+    def __init__(self, usernames: List[str], post_ids: List[str], skew: float):
+        self.usernames = usernames
+        self.post_ids = post_ids
+        self._user_weights = zipf_cum_weights(len(usernames), skew)
+        self._post_weights = zipf_cum_weights(len(post_ids), skew)
+
+    def user(self) -> str:
+        return random.choices(self.usernames, cum_weights=self._user_weights)[0]
+
+    def post(self) -> str:
+        return random.choices(self.post_ids, cum_weights=self._post_weights)[0]
+
+
+def zipf_cum_weights(n: int, skew: float) -> List[float]:
+    # weight of the item of rank r is 1 / r^skew
+    return list(accumulate(1 / rank**skew for rank in range(1, n + 1)))
+
+
+def power_law(mean: float, limit: int) -> int:
+    # pareto distributed with the given mean (alpha 2), capped at limit
+    return min(limit, int(random.paretovariate(2.0) * mean / 2))
+
+
+def random_timestamp() -> datetime:
+    return datetime.now() - timedelta(seconds=random.randrange(30 * 24 * 3600))
+
+
+async def seed(
+    db: AsyncDatabaseConnector,
+    users: int,
+    follows_per_user: float,
+    posts_per_user: float,
+    comments_per_post: float,
+    likes_per_post: float,
+    skew: float,
+) -> Dataset:
+    """Seeds the dataset through the connector; returns the ids of the documents."""
+    usernames = [f"bench{idx}-{uuid.uuid4().hex[:8]}" for idx in range(users)]
+    await db.bulk_insert_users(
+        User.construct(username=u, email=f"{u}@example.com", password="secret")
+        for u in usernames
+    )
+    weights = zipf_cum_weights(users, skew)
+
+    # followers are drawn by popularity, so follower counts follow a power law
+    started = time.perf_counter()
+    for follower in usernames:
+        count = power_law(follows_per_user, users - 1)
+        for followee in set(random.choices(usernames, cum_weights=weights, k=count)):
+            if followee != follower:
+                await db.follow_user(follower, followee)
+    typer.echo(f"seeded follows in {time.perf_counter() - started:.1f}s")
+
+    posts = [
+        Post.construct(
+            post_id=uuid.uuid4().hex,
+            username=username,
+            timestamp=random_timestamp(),
+            content="benchmark post",
+            like_count=0,
+            number_of_comments=0,
+        )
+        for username in usernames
+        for _ in range(power_law(posts_per_user, 1000))
+    ]
+    await db.bulk_insert_posts(posts)
+    await db.bulk_insert_comments(
+        Comment.construct(
+            comment_id=uuid.uuid4().hex,
+            post_id=post.post_id,
+            username=random.choice(usernames),
+            timestamp=random_timestamp(),
+            content="benchmark comment",
+        )
+        for post in posts
+        for _ in range(power_law(comments_per_post, 1000))
+    )
+
+    started = time.perf_counter()
+    for post in posts:
+        for liker in random.sample(usernames, power_law(likes_per_post, users)):
+            await db.like_post(post.post_id, liker)
+    typer.echo(f"seeded likes in {time.perf_counter() - started:.1f}s")
+
+    typer.echo(f"seeded {users} users and {len(posts)} posts")
+
+    # the first posts get the largest weights; popularity is not tied to age
+    random.shuffle(posts)
+    return Dataset(usernames, [p.post_id for p in posts], skew)
+
+
+def request_factories(data: Dataset) -> Dict[str, Callable]:
+    """Builds one request of each kind: (method, path, params, json body)."""
+
+    def create_post():
+        post = Post.construct(
+            post_id=uuid.uuid4().hex,
+            username=data.user(),
+            timestamp=datetime.now(),
+            content="benchmark post",
+            like_count=0,
+            number_of_comments=0,
+        )
+        return "POST", "/api/create/post", None, jsonable_encoder(post)
+
+    return {
+        "feed": lambda: ("GET", "/api/feed", None, None),
+        "post": lambda: ("GET", f"/api/posts/{data.post()}", None, None),
+        "detail": lambda: ("GET", f"/api/posts/{data.post()}/detail", None, None),
+        "user_posts": lambda: ("GET", f"/api/users/{data.user()}/posts", None, None),
+        "comments": lambda: ("GET", f"/api/posts/{data.post()}/comments", None, None),
+        "timeline": lambda: ("GET", f"/api/users/{data.user()}/timeline", None, None),
+        "likes": lambda: ("GET", f"/api/posts/{data.post()}/likes", None, None),
+        "like": lambda: (
+            "POST",
+            f"/api/posts/{data.post()}/like",
+            {"username": data.user()},
+            None,
+        ),
+        "create_post": create_post,
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = int(weight or 1)
+    return weights
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    data: Dataset,
+    mix: Dict[str, int],
+    requests: int,
+    concurrency: int,
+):
+    """Sends the requests from concurrent workers; returns latencies and errors."""
+    factories = request_factories(data)
+    unknown = set(mix) - set(factories)
+    if unknown:
+        raise typer.BadParameter(f"unknown endpoints {sorted(unknown)}")
+
+    kinds = random.choices(list(mix), list(mix.values()), k=requests)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    async def worker():
+        while kinds:
+            kind = kinds.pop()
+            method, path, params, body = factories[kind]()
+
+            started = time.perf_counter()
+            response = await client.request(method, path, params=params, json=body)
+            latencies[kind].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[kind] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+    }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Endpoints whose p95 latency exceeds the baseline by more than tolerance."""
+    found = []
+    for kind, result in results.items():
+        if kind not in baseline:
+            continue
+        allowed = baseline[kind]["p95_ms"] * (1 + tolerance)
+        if result["p95_ms"] > allowed:
+            found.append(
+                f"{kind}: p95 {result['p95_ms']} ms, baseline "
+                f"{baseline[kind]['p95_ms']} ms"
+            )
+    return found
+
+
+def use_in_memory_mongo():
+    # stand-in for a local mongod; mongomock_motor is a development dependency
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise typer.BadParameter("--in-memory requires mongomock-motor")
+
+    from owntwitter import app as app_module
+    from owntwitter.services import async_db
+
+    client = AsyncMongoMockClient()
+    async_db.AsyncIOMotorClient = lambda *args, **kwargs: client
+    # indexes are not used by the stand-in
+    app_module.settings.mongo_migrate_on_startup = False
+
+
+async def benchmark(
+    url: Optional[str],
+    in_memory: bool,
+    database: str,
+    users: int,
+    follows_per_user: float,
+    posts_per_user: float,
+    comments_per_post: float,
+    likes_per_post: float,
+    skew: float,
+    mix: str,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    if in_memory:
+        use_in_memory_mongo()
+
+    from owntwitter import app as app_module
+
+    # seeds through its own connector into the benchmark database, never into
+    # the database of the application
+    settings = Settings(mongo_db_name=database)
+    app_module.settings.mongo_db_name = database
+    db = AsyncDatabaseConnector(settings)
+    await db.drop_database()
+
+    client = None
+    try:
+        data = await seed(
+            db,
+            users,
+            follows_per_user,
+            posts_per_user,
+            comments_per_post,
+            likes_per_post,
+            skew,
+        )
+
+        if url is None:
+            # in process, without network and server overhead
+            await app_module.app.router.startup()
+            client = httpx.AsyncClient(app=app_module.app, base_url="http://benchmark")
+        else:
+            client = httpx.AsyncClient(base_url=url)
+
+        latencies, errors, elapsed = await drive(
+            client, data, parse_mix(mix), requests, concurrency
+        )
+    finally:
+        if client is not None:
+            await client.aclose()
+            if url is None:
+                await app_module.app.router.shutdown()
+        await db.drop_database()
+        db.close()
+
+    results = {
+        kind: summarize(times, errors[kind], elapsed)
+        for kind, times in sorted(latencies.items())
+    }
+    results["all"] = summarize(
+        [t for times in latencies.values() for t in times],
+        sum(errors.values()),
+        elapsed,
+    )
+    return results
+
+
+@app.command()
+def run(
+    url: Optional[str] = typer.Option(
+        None, help="Base url of a running server; the app runs in process if unset"
+    ),
+    in_memory: bool = typer.Option(False, help="Use an in-memory mongo stand-in"),
+    database: str = typer.Option(
+        "twitter_benchmark",
+        help="Database seeded and dropped; a server at --url must use it too",
+    ),
+    users: int = 1000,
+    follows_per_user: float = 20,
+    posts_per_user: float = 10,
+    comments_per_post: float = 5,
+    likes_per_post: float = 5,
+    skew: float = typer.Option(1.1, help="Zipf exponent of user and post popularity"),
+    mix: str = typer.Option(DEFAULT_MIX, help="Weights of the requested endpoints"),
+    requests: int = 5000,
+    concurrency: int = 32,
+    seed_value: int = typer.Option(42, "--seed", help="Seed of the random numbers"),
+    baseline: Optional[Path] = typer.Option(None, help="Compare against a baseline"),
+    tolerance: float = typer.Option(0.2, help="Allowed p95 increase over baseline"),
+    save_baseline: Optional[Path] = typer.Option(None, help="Save the results"),
+):
+    """Seeds the database and measures latency and throughput per endpoint."""
+    if in_memory and url is not None:
+        raise typer.BadParameter("--in-memory only works with the in-process app")
+    if database == Settings().mongo_db_name:
+        raise typer.BadParameter("refusing to drop the database of the application")
+
+    random.seed(seed_value)
+    results = asyncio.run(
+        benchmark(
+            url,
+            in_memory,
+            database,
+            users,
+            follows_per_user,
+            posts_per_user,
+            comments_per_post,
+            likes_per_post,
+            skew,
+            mix,
+            requests,
+            concurrency,
+        )
+    )
+
+    typer.echo(
+        f"{'endpoint':<12}{'requests':>9}{'errors':>8}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+    )
+    for kind, r in results.items():
+        typer.echo(
+            f"{kind:<12}{r['requests']:>9}{r['errors']:>8}{r['p50_ms']:>10}"
+            f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['throughput']:>10}"
+        )
+
+    if save_baseline is not None:
+        save_baseline.write_text(json.dumps(results, indent=2) + "\n")
+        typer.echo(f"saved baseline to {save_baseline}")
+
+    if baseline is not None:
+        found = regressions(results, json.loads(baseline.read_text()), tolerance)
+        for regression in found:
+            typer.echo(f"REGRESSION {regression}", err=True)
+        if found:
+            raise typer.Exit(code=1)
+        typer.echo(f"no regressions against {baseline}")
+
+
+if __name__ == "__main__":
+    app()
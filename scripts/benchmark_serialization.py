@@ -0,0 +1,42 @@
+import timeit
+from typing import List
+
+import typer
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from owntwitter.models.factories import CommentFactory
+from owntwitter.models.models import Comment
+from owntwitter.services.db import comment_from_document
+from owntwitter.services.serialization import COMMENT_FIELDS, documents_to_json
+
+
+def model_path(documents: List[dict]) -> bytes:
+    # what a listing endpoint did before: build models, check them against the
+    # response model and encode them with the default json response
+    comments = [comment_from_document(d) for d in documents]
+    validated = parse_obj_as(List[Comment], comments)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def document_path(documents: List[dict]) -> bytes:
+    return documents_to_json(documents, COMMENT_FIELDS)
+
+
+def main(comments: int = 1000, repeat: int = 20):
+    """Time serializing a comment section of the given size both ways."""
+    documents = [jsonable_encoder(c) for c in CommentFactory.batch(comments)]
+
+    results = {}
+    for path in (model_path, document_path):
+        best = min(timeit.repeat(lambda: path(documents), number=1, repeat=repeat))
+        results[path.__name__] = best
+        typer.echo(f"{path.__name__:>14}: {best * 1000:8.2f} ms")
+
+    speedup = results["model_path"] / results["document_path"]
+    typer.echo(f"{'speedup':>14}: {speedup:8.1f}x for {comments} comments")
+
+
+if __name__ == "__main__":
+    typer.run(main)
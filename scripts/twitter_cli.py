@@ -1,38 +1,183 @@
+import gzip
 import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List
 
 import typer
 
-from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.models.exceptions import UserNotFoundException
+from owntwitter.models.models import Comment, Post, PrivateUser, User
+from owntwitter.models.settings import Settings
+from owntwitter.services.bulk import BULK_BATCH_SIZE
 from owntwitter.services.db import DatabaseConnector
+from owntwitter.services.export import EXPORT_BATCH_SIZE, USER_FIELDS, ndjson
+from owntwitter.services.serialization import COMMENT_FIELDS, POST_FIELDS
+from owntwitter.services.utils import chunked
 
+settings = Settings()
 
+app = typer.Typer()
+
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while mongo stores every post "
+    "and comment of this small twitter clone"
+).split()
+
+
+def random_timestamp() -> datetime:
+    return datetime.now() - timedelta(seconds=random.randrange(365 * 24 * 3600))
+
+
+def random_text(max_length: int) -> str:
+    return " ".join(random.choices(WORDS, k=random.randint(3, 20)))[:max_length]
+
+
+# models are built with construct(); validating millions of them costs more
+# than inserting them
+
+
+def generate_users(number_of_users: int) -> Iterator[User]:
+    for idx in range(number_of_users):
+        username = f"user{idx}-{uuid.uuid4().hex[:8]}"
+        yield User.construct(
+            username=username,
+            email=f"{username}@example.com",
+            password=uuid.uuid4().hex,
+        )
+
+
+def generate_posts(usernames: List[str], posts_per_user: int) -> Iterator[Post]:
+    for username in usernames:
+        for _ in range(posts_per_user):
+            yield Post.construct(
+                post_id=uuid.uuid4().hex,
+                username=username,
+                timestamp=random_timestamp(),
+                content=random_text(settings.max_content_length),
+                like_count=0,
+                number_of_comments=0,  # counted by bulk_insert_comments
+            )
+
+
+def generate_comments(
+    posts: List[Post], usernames: List[str], comments_per_post: int
+) -> Iterator[Comment]:
+    for post in posts:
+        for _ in range(comments_per_post):
+            yield Comment.construct(
+                comment_id=uuid.uuid4().hex,
+                post_id=post.post_id,
+                username=random.choice(usernames),
+                timestamp=random_timestamp(),
+                content=random_text(settings.max_comment_length),
+            )
+
+
+class Progress:
+    """Prints the number of inserted documents and the insert rate."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.inserted = 0
+        self.start = time.perf_counter()
+
+    def add(self, inserted: int):
+        self.inserted += inserted
+        elapsed = time.perf_counter() - self.start
+        typer.echo(
+            f"{self.kind}: {self.inserted} inserted, "
+            f"{self.inserted / elapsed:.0f} documents/s"
+        )
+
+
+@app.command()
 def fill_db(
-    number_of_users: int = 100, posts_per_user: int = 10, comments_per_post: int = 50
+    number_of_users: int = 100,
+    posts_per_user: int = 10,
+    comments_per_post: int = 50,
+    batch_size: int = BULK_BATCH_SIZE,
 ):
     db = DatabaseConnector()
 
-    users = UserFactory.batch(number_of_users)
-    [db.create_new_user(u) for u in users]
-    typer.echo(f"added all {number_of_users} users")
+    users = Progress("users")
+    usernames = []
+    for chunk in chunked(generate_users(number_of_users), batch_size):
+        users.add(db.bulk_insert_users(chunk, batch_size))
+        usernames.extend(u.username for u in chunk)
 
-    for idx, u in enumerate(users):
+    # comments are generated for one batch of posts at a time, so memory use
+    # does not grow with the size of the load
+    posts, comments = Progress("posts"), Progress("comments")
+    for chunk in chunked(generate_posts(usernames, posts_per_user), batch_size):
+        posts.add(db.bulk_insert_posts(chunk, batch_size))
 
-        typer.echo(f"adding posts and comments for user {idx + 1} of {len(users)}")
+        chunk_comments = generate_comments(chunk, usernames, comments_per_post)
+        for comment_chunk in chunked(chunk_comments, batch_size):
+            comments.add(db.bulk_insert_comments(comment_chunk, batch_size))
 
-        users_posts = PostFactory.batch(posts_per_user)
+    typer.echo("job completed")
 
-        for p in users_posts:
-            p.username = u.username
-            db.create_new_post(p)
 
-            comments_of_post = CommentFactory.batch(comments_per_post)
-            for c in comments_of_post:
-                c.username = random.choice(users).username
-                c.post_id = p.post_id
-                db.create_new_comment(c)
+@app.command()
+def export_user(
+    username: str,
+    output: Path = typer.Option(..., help="NDJSON file, gzipped if it ends in .gz"),
+    batch_size: int = EXPORT_BATCH_SIZE,
+):
+    """Writes the account, its posts and the comments on them to a file."""
+    db = DatabaseConnector()
 
-    typer.echo("job completed")
+    try:
+        user = db.read_user(username, view=PrivateUser)
+    except UserNotFoundException:
+        raise typer.BadParameter(f"unknown user {username}")
+
+    opener = gzip.open if output.suffix == ".gz" else open
+    posts = comments = 0
+    with opener(output, "wb") as f:
+        f.write(ndjson([user.dict(by_alias=True)], USER_FIELDS, "user"))
+        for batch in db.export_posts_of_user(username, batch_size):
+            f.write(ndjson(batch, POST_FIELDS, "post"))
+            posts += len(batch)
+
+            post_ids = [post["_id"] for post in batch]
+            for comment_batch in db.export_comments_of_posts(post_ids, batch_size):
+                f.write(ndjson(comment_batch, COMMENT_FIELDS, "comment"))
+                comments += len(comment_batch)
+
+    typer.echo(f"exported {posts} posts and {comments} comments to {output}")
+
+
+@app.command()
+def migrate():
+    db = DatabaseConnector()
+
+    applied = db.migrate()
+    if applied:
+        typer.echo(f"applied migrations {applied}")
+    else:
+        typer.echo("database is up to date")
+
+
+@app.command()
+def explain():
+    db = DatabaseConnector()
+
+    for query, indexes in db.explain_queries().items():
+        typer.echo(f"{query}: {', '.join(indexes) or 'COLLECTION SCAN'}")
+
+
+@app.command()
+def reconcile():
+    db = DatabaseConnector()
+
+    for counter, corrected in db.reconcile_counters().items():
+        typer.echo(f"{counter}: corrected {corrected} posts")
 
 
 if __name__ == "__main__":
-    typer.run(fill_db)
+    app()
@@ -1,22 +1,135 @@
 import functools
-from typing import List, Optional
-
-from fastapi import APIRouter, Depends, HTTPException
+from typing import AsyncIterator, List, Literal, Optional, Union
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import conlist
 from pymongo.errors import DuplicateKeyError
 
 from owntwitter.models.exceptions import (
     CommentNotFoundException,
+    FollowNotFoundException,
+    InvalidCursorException,
+    JobNotFoundException,
     PostNotFoundException,
     UserNotFoundException,
+    WriteBehindQueueFullException,
+)
+from owntwitter.models.models import (
+    Comment,
+    Job,
+    Post,
+    PostDetail,
+    PrivateUser,
+    PublicUser,
+    User,
+)
+from owntwitter.models.settings import Settings
+from owntwitter.services.async_db import AsyncDatabaseConnector
+from owntwitter.services.detail import DETAIL_COMMENTS_LIMIT, post_detail_to_json
+from owntwitter.services.events import (
+    FEED_TOPIC,
+    EventBus,
+    comments_topic,
+    event_stream,
+)
+from owntwitter.services.export import (
+    NDJSON_MEDIA_TYPE,
+    USER_FIELDS,
+    gzip_stream,
+    ndjson,
+)
+from owntwitter.services.feed_cache import FeedCache, FeedPage
+from owntwitter.services.pagination import encode_cursor
+from owntwitter.services.serialization import (
+    COMMENT_FIELDS,
+    POST_FIELDS,
+    document_cursor,
+    documents_to_json,
 )
-from owntwitter.models.models import Comment, Post, User
-from owntwitter.services.db import DatabaseConnector
+from owntwitter.services.write_behind import WriteBehindQueue, merge_pending
 
+settings = Settings()
 router = APIRouter(prefix="/api")
 
+MAX_PAGE_SIZE = 100
+MAX_BULK_SIZE = 10000
+# only the first feed page of the default size is cached
+FEED_PAGE_SIZE = 20
+
+# the cursor of the next page is handed out in this header; pass it as "after"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def get_db_service(request: Request) -> AsyncDatabaseConnector:
+    # shared connector, opened and closed by the application lifecycle hooks
+    return request.app.state.db
+
+
+def get_feed_cache(request: Request) -> Optional[FeedCache]:
+    return request.app.state.feed_cache
+
+
+def get_event_bus(request: Request) -> Optional[EventBus]:
+    return request.app.state.events
+
+
+def get_write_behind(request: Request) -> Optional[WriteBehindQueue]:
+    return request.app.state.write_behind
+
+
+def queue_full() -> HTTPException:
+    # backpressure of the write-behind queue
+    return HTTPException(
+        status_code=503, detail="Too many pending writes", headers={"Retry-After": "1"}
+    )
+
+
+def set_next_cursor(response: Response, page: list, limit: int, id_field: str):
+    # a short page is the last one
+    if len(page) == limit:
+        last = page[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            last.timestamp, getattr(last, id_field)
+        )
+
+
+def json_page(documents: list, fields: dict, limit: int) -> Response:
+    # raw documents are written as is, skipping the response model
+    headers = {}
+    cursor = document_cursor(documents, limit)
+    if cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = cursor
+
+    body = documents_to_json(documents, fields)
+    return Response(body, media_type="application/json", headers=headers)
 
-def get_db_service():
-    return DatabaseConnector()
+
+async def load_feed_page(db: AsyncDatabaseConnector, limit: int) -> FeedPage:
+    try:
+        posts = await db.read_recent_posts(limit, raw=True)
+    except PostNotFoundException:
+        posts = []
+
+    body = documents_to_json(posts, POST_FIELDS)
+    return FeedPage.create(body, document_cursor(posts, limit))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
 
 
 ###### READ ######
@@ -28,85 +141,273 @@ async def read_root():
 
 
 @router.get("/feed", response_model=List[Post])
-async def get_recent_posts(db: DatabaseConnector = Depends(get_db_service)):
-    return db.read_recent_posts(20)
+async def get_recent_posts(
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    feed_cache: Optional[FeedCache] = Depends(get_feed_cache),
+    if_none_match: Optional[str] = Header(None),
+):
+    if feed_cache is not None and after is None and limit == FEED_PAGE_SIZE:
+        # the cached page is sent as is, without validating or encoding posts
+        page = await feed_cache.get(functools.partial(load_feed_page, db, limit))
+        headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+        if page.next_cursor:
+            headers[NEXT_CURSOR_HEADER] = page.next_cursor
+
+        if etag_matches(if_none_match, page.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(page.body, media_type="application/json", headers=headers)
+
+    try:
+        posts = await db.read_recent_posts(limit, after=after, raw=True)
+    except PostNotFoundException:
+        return []
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return json_page(posts, POST_FIELDS, limit)
 
 
 @router.get("/posts/{post_id}", response_model=Optional[Post])
-async def get_post(post_id, db: DatabaseConnector = Depends(get_db_service)):
+async def get_post(post_id, db: AsyncDatabaseConnector = Depends(get_db_service)):
     try:
-        return db.read_post(post_id)
+        return await db.read_post(post_id)
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
 
 
-@router.get("/users/{username}", response_model=Optional[User])
-async def get_user(username, db: DatabaseConnector = Depends(get_db_service)):
+@router.get("/posts/{post_id}/detail", response_model=PostDetail)
+async def get_post_detail(
+    post_id,
+    comments_limit: int = Query(DETAIL_COMMENTS_LIMIT, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    """The post, its counters and the first page of its comments.
+
+    The next comment page is read from /posts/{post_id}/comments with the
+    cursor in the X-Next-Cursor header.
+    """
     try:
-        return db.read_user(username)
+        detail = await db.read_post_detail(
+            post_id, comments_limit=comments_limit, raw=True
+        )
+    except PostNotFoundException:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    headers = {}
+    cursor = document_cursor(detail["comments"], comments_limit)
+    if cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = cursor
+    body = post_detail_to_json(detail)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/users/{username}", response_model=Optional[PrivateUser])
+async def get_user(username, db: AsyncDatabaseConnector = Depends(get_db_service)):
+    try:
+        return await db.read_user(username, view=PrivateUser)
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
 
 
 @router.get("/users/{username}/posts", response_model=List[Post])
-async def get_user_posts(username, db: DatabaseConnector = Depends(get_db_service)):
+async def get_user_posts(
+    username,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
     try:
-        return db.read_posts_of_user(username)
+        posts = await db.read_posts_of_user(
+            username, limit=limit, after=after, raw=True
+        )
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return json_page(posts, POST_FIELDS, limit)
+
+
+@router.get("/users/{username}/timeline", response_model=List[Post])
+async def get_user_timeline(
+    username,
+    response: Response,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    try:
+        posts = await db.read_timeline(username, limit=limit, after=after)
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    set_next_cursor(response, posts, limit, "post_id")
+    return posts
 
 
 @router.get("/posts/{post_id}/comments", response_model=List[Comment])
 async def get_comments_of_post(
-    post_id, db: DatabaseConnector = Depends(get_db_service)
+    post_id,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
+):
+    try:
+        comments = await db.read_comments_of_post(
+            post_id, limit=limit, after=after, raw=True
+        )
+        if write_behind is not None:
+            # read your writes: comments accepted but not yet written
+            pending = write_behind.pending_comments(post_id)
+            comments = merge_pending(comments, pending, after, limit)
+    except PostNotFoundException:
+        raise HTTPException(status_code=404, detail="Post not found")
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return json_page(comments, COMMENT_FIELDS, limit)
+
+
+@router.get("/posts/{post_id}/likes", response_model=List[PublicUser])
+async def get_likes_of_post(
+    post_id,
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
 ):
     try:
-        return db.read_comments_of_post(post_id)
+        likes = await db.read_likes_of_post(post_id, limit=limit, after=after)
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
+    set_next_cursor(response, likes, limit, "like_id")
 
-@router.get("/posts/{post_id}/likes", response_model=List[User])
-async def get_likes_of_post(post_id, db: DatabaseConnector = Depends(get_db_service)):
+    # deleted accounts are left out of the page
+    return await db.read_users([like.username for like in likes], view=PublicUser)
+
+
+@router.get("/search", response_model=Union[List[Post], List[Comment]])
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    scope: Literal["posts", "comments"] = "posts",
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    # "#tag" and "@user" terms match exactly, other words by relevance
     try:
-        post = db.read_post(post_id)
-        usernames_of_likes = post.likes
-        return [db.read_user(u) for u in usernames_of_likes]
+        if scope == "posts":
+            posts = await db.search_posts(q, limit=limit, after=after, raw=True)
+            return json_page(posts, POST_FIELDS, limit)
+
+        comments = await db.search_comments(q, limit=limit, after=after, raw=True)
+        return json_page(comments, COMMENT_FIELDS, limit)
+    except InvalidCursorException:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, db: AsyncDatabaseConnector = Depends(get_db_service)):
+    try:
+        return await db.read_job(job_id)
+    except JobNotFoundException:
+        raise HTTPException(status_code=404, detail="Job not found")
+
 
+##### STREAMS #####
+
+# Server-sent events (text/event-stream) replacing the polling of the feed and
+# of comment sections: an "event: post" or "event: comment" message carries the
+# new document as json.
+
+
+def event_stream_response(events: Optional[EventBus], topic: str):
+    if events is None:
+        raise HTTPException(status_code=404, detail="Streams are disabled")
+
+    stream = event_stream(events, topic, settings.events_keepalive_seconds)
+    # no buffering by proxies such as nginx
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream, media_type="text/event-stream", headers=headers)
+
+
+@router.get("/stream/feed")
+async def stream_feed(events: Optional[EventBus] = Depends(get_event_bus)):
+    """New posts, as they are created."""
+    return event_stream_response(events, FEED_TOPIC)
+
+
+@router.get("/stream/posts/{post_id}/comments")
+async def stream_comments_of_post(
+    post_id: str,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
+    """New comments of a post, as they are created."""
+    try:
+        await db.check_post_exists(post_id)
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
-    except UserNotFoundException:
-        raise HTTPException(status_code=404, detail="User not found")
+
+    return event_stream_response(events, comments_topic(post_id))
 
 
 ##### CREATE #####
 
 
 @router.post("/create/user", status_code=201)
-async def create_user(user: User, db: DatabaseConnector = Depends(get_db_service)):
+async def create_user(user: User, db: AsyncDatabaseConnector = Depends(get_db_service)):
     try:
-        db.create_new_user(user)
+        await db.create_new_user(user)
 
     except DuplicateKeyError:
         raise HTTPException(status_code=404, detail="User already exists")
 
 
 @router.post("/create/post", status_code=201)
-async def create_post(post: Post, db: DatabaseConnector = Depends(get_db_service)):
+async def create_post(
+    post: Post,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    feed_cache: Optional[FeedCache] = Depends(get_feed_cache),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
     try:
-        db.create_new_post(post)
+        await db.create_new_post(post)
     except DuplicateKeyError:
         raise HTTPException(status_code=404, detail="Post already exists")
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
 
+    if events is not None:
+        events.publish_write("posts", jsonable_encoder(post))
+    if feed_cache is not None:
+        await feed_cache.refresh(functools.partial(load_feed_page, db, FEED_PAGE_SIZE))
+
 
 @router.post("/create/comment", status_code=201)
 async def create_comment(
-    comment: Comment, db: DatabaseConnector = Depends(get_db_service)
+    comment: Comment,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
+    events: Optional[EventBus] = Depends(get_event_bus),
 ):
     try:
-        db.create_new_comment(comment)
+        if write_behind is not None:
+            # acknowledged once the references are checked, written in a batch
+            await db.check_references(comment.username, comment.post_id)
+            write_behind.add_comment(comment)
+        else:
+            await db.create_new_comment(comment)
+    except WriteBehindQueueFullException:
+        raise queue_full()
     except DuplicateKeyError:
         raise HTTPException(status_code=404, detail="Comment already exists")
     except UserNotFoundException:
@@ -114,34 +415,198 @@ async def create_comment(
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
 
+    if events is not None:
+        events.publish_write("comments", jsonable_encoder(comment))
+    if write_behind is not None:
+        return Response(status_code=202)
+
+
+@router.post("/users/{username}/follow/{followee}", status_code=201)
+async def follow_user(
+    username: str, followee: str, db: AsyncDatabaseConnector = Depends(get_db_service)
+):
+    if username == followee:
+        raise HTTPException(status_code=400, detail="Users cannot follow themselves")
+
+    try:
+        await db.follow_user(username, followee)
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+##### BULK #####
+
+# Ingest of many documents at once: the references of a batch are checked with
+# one count per collection; documents with an existing id are skipped and the
+# number of inserted documents is returned.
+
+
+@router.post("/bulk/users", status_code=201)
+async def bulk_create_users(
+    users: conlist(User, max_items=MAX_BULK_SIZE),
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    return {"inserted": await db.bulk_insert_users(users)}
+
+
+@router.post("/bulk/posts", status_code=201)
+async def bulk_create_posts(
+    posts: conlist(Post, max_items=MAX_BULK_SIZE),
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    feed_cache: Optional[FeedCache] = Depends(get_feed_cache),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
+    try:
+        await db.check_all_references({p.username for p in posts})
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    inserted = await db.bulk_insert_posts(posts)
+
+    # skipped duplicates are announced again; subscribers know them by id
+    if events is not None and inserted:
+        for post in posts:
+            events.publish_write("posts", jsonable_encoder(post))
+    if feed_cache is not None and inserted:
+        await feed_cache.refresh(functools.partial(load_feed_page, db, FEED_PAGE_SIZE))
+    return {"inserted": inserted}
+
+
+@router.post("/bulk/comments", status_code=201)
+async def bulk_create_comments(
+    comments: conlist(Comment, max_items=MAX_BULK_SIZE),
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    events: Optional[EventBus] = Depends(get_event_bus),
+):
+    try:
+        await db.check_all_references(
+            {c.username for c in comments}, {c.post_id for c in comments}
+        )
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+    except PostNotFoundException:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    inserted = await db.bulk_insert_comments(comments)
+
+    if events is not None and inserted:
+        for comment in comments:
+            events.publish_write("comments", jsonable_encoder(comment))
+    return {"inserted": inserted}
+
+
+##### EXPORT #####
+
+# Streamed as newline delimited json, one cursor batch at a time; gzip=true
+# compresses the stream on the fly (Content-Encoding: gzip).
+
+
+def ndjson_response(
+    chunks: AsyncIterator[bytes], gzip: bool, filename: str
+) -> StreamingResponse:
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.ndjson"'}
+    if gzip:
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+@router.get("/export/users/{username}")
+async def export_user(
+    username: str,
+    gzip: bool = False,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    """The account, its posts and the comments on them."""
+    try:
+        user = await db.read_user(username, view=PrivateUser)
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    async def archive():
+        yield ndjson([user.dict(by_alias=True)], USER_FIELDS, "user")
+        async for posts in db.export_posts_of_user(username):
+            yield ndjson(posts, POST_FIELDS, "post")
+            post_ids = [post["_id"] for post in posts]
+            async for comments in db.export_comments_of_posts(post_ids):
+                yield ndjson(comments, COMMENT_FIELDS, "comment")
+
+    return ndjson_response(archive(), gzip, username)
+
+
+@router.get("/export/users/{username}/posts")
+async def export_user_posts(
+    username: str,
+    gzip: bool = False,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    try:
+        await db.check_user_exists(username)
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    async def posts():
+        async for batch in db.export_posts_of_user(username):
+            yield ndjson(batch, POST_FIELDS)
+
+    return ndjson_response(posts(), gzip, f"{username}-posts")
+
+
+@router.get("/export/posts/{post_id}/comments")
+async def export_comments_of_post(
+    post_id: str,
+    gzip: bool = False,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+):
+    try:
+        await db.check_post_exists(post_id)
+    except PostNotFoundException:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    async def comments():
+        async for batch in db.export_comments_of_posts([post_id]):
+            yield ndjson(batch, COMMENT_FIELDS)
+
+    return ndjson_response(comments(), gzip, f"{post_id}-comments")
+
 
 ##### UPDATE ENDPOINTS ######
 
 
 @router.put("/update/user", status_code=202)
-async def update_user(new_user: User, db: DatabaseConnector = Depends(get_db_service)):
+async def update_user(
+    new_user: User, db: AsyncDatabaseConnector = Depends(get_db_service)
+):
     try:
-        db.update_user(new_user)
+        await db.update_user(new_user)
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
 
 
 @router.put("/update/post", status_code=202)
-async def update_post(new_post: Post, db: DatabaseConnector = Depends(get_db_service)):
+async def update_post(
+    new_post: Post,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    feed_cache: Optional[FeedCache] = Depends(get_feed_cache),
+):
     try:
-        db.update_post(new_post)
+        await db.update_post(new_post)
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
 
+    # the edited post may be on the cached first page of the feed
+    if feed_cache is not None:
+        await feed_cache.refresh(functools.partial(load_feed_page, db, FEED_PAGE_SIZE))
+
 
 @router.put("/update/comment", status_code=202)
 async def update_comment(
-    new_comment: Comment, db: DatabaseConnector = Depends(get_db_service)
+    new_comment: Comment, db: AsyncDatabaseConnector = Depends(get_db_service)
 ):
     try:
-        db.update_comment(new_comment)
+        await db.update_comment(new_comment)
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
     except PostNotFoundException:
@@ -150,36 +615,133 @@ async def update_comment(
         raise HTTPException(status_code=404, detail="Comment not found")
 
 
+@router.post("/posts/{post_id}/like", status_code=202)
+async def like_post(
+    post_id: str,
+    username: str,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
+):
+    try:
+        if write_behind is not None:
+            await db.check_references(username, post_id)
+            write_behind.add_like(post_id, username)
+        else:
+            await db.like_post(post_id, username)
+    except WriteBehindQueueFullException:
+        raise queue_full()
+    except UserNotFoundException:
+        raise HTTPException(status_code=404, detail="User not found")
+    except PostNotFoundException:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+
+@router.post("/posts/{post_id}/unlike", status_code=202)
+async def unlike_post(
+    post_id: str,
+    username: str,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
+):
+    if write_behind is not None and write_behind.has_like(post_id, username):
+        # the like has to be written before it can be removed
+        await write_behind.flush()
+
+    try:
+        await db.unlike_post(post_id, username)
+    except PostNotFoundException:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+
 ##### DELETE ENDPOINTS #####
 
 
 @router.post("/delete/user/{username}", status_code=203)
-async def delete_user(username: str, db: DatabaseConnector = Depends(get_db_service)):
+async def delete_user(
+    username: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    feed_cache: Optional[FeedCache] = Depends(get_feed_cache),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
+):
+    if write_behind is not None:
+        write_behind.discard_user(username)
+
+    # the posts of the user may be on the cached first page of the feed
+    refresh_feed = None
+    if feed_cache is not None:
+        refresh_feed = functools.partial(
+            feed_cache.refresh, functools.partial(load_feed_page, db, FEED_PAGE_SIZE)
+        )
+
     try:
-        db.delete_user(username)
+        size = await db.count_user_documents(username)
+        if size < settings.background_delete_threshold:
+            await db.delete_user(username)
+            if refresh_feed is not None:
+                await refresh_feed()
+            return
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
 
+    # large accounts are deleted after responding; poll the job for progress
+    job = await db.create_job("delete_user", username)
+    background_tasks.add_task(db.run_job, job.job_id, db.delete_user, username)
+    if refresh_feed is not None:
+        # background tasks run in order, i.e. once the job is done
+        background_tasks.add_task(refresh_feed)
+
+    response.status_code = 202
+    return job
+
 
 @router.post("/delete/post/{post_id}", status_code=203)
-async def delete_post(post_id: str, db: DatabaseConnector = Depends(get_db_service)):
+async def delete_post(
+    post_id: str,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    feed_cache: Optional[FeedCache] = Depends(get_feed_cache),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
+):
+    if write_behind is not None:
+        write_behind.discard_post(post_id)
+
     try:
-        db.delete_post(post_id)
+        await db.delete_post(post_id)
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
 
+    if feed_cache is not None:
+        await feed_cache.refresh(functools.partial(load_feed_page, db, FEED_PAGE_SIZE))
+
 
 @router.post("/delete/comment/{comment_id}", status_code=203)
 async def delete_comment(
-    comment_id: str, db: DatabaseConnector = Depends(get_db_service)
+    comment_id: str,
+    db: AsyncDatabaseConnector = Depends(get_db_service),
+    write_behind: Optional[WriteBehindQueue] = Depends(get_write_behind),
 ):
+    if write_behind is not None and write_behind.has_comment(comment_id):
+        # the comment has to be written before it can be removed
+        await write_behind.flush()
+
     try:
-        db.delete_comment(comment_id)
+        await db.delete_comment(comment_id)
     except UserNotFoundException:
         raise HTTPException(status_code=404, detail="User not found")
     except PostNotFoundException:
         raise HTTPException(status_code=404, detail="Post not found")
     except CommentNotFoundException:
         raise HTTPException(status_code=404, detail="Comment not found")
+
+
+@router.post("/users/{username}/unfollow/{followee}", status_code=203)
+async def unfollow_user(
+    username: str, followee: str, db: AsyncDatabaseConnector = Depends(get_db_service)
+):
+    try:
+        await db.unfollow_user(username, followee)
+    except FollowNotFoundException:
+        raise HTTPException(status_code=404, detail="Not following user")
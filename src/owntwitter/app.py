@@ -1,12 +1,153 @@
-from fastapi import FastAPI
+import logging
+import random
+import threading
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 
 from owntwitter.api.endpoints import router
 from owntwitter.models.settings import Settings
+from owntwitter.services.async_db import AsyncDatabaseConnector
+from owntwitter.services.cache import CachedAsyncDatabaseConnector
+from owntwitter.services.db import DatabaseConnector
+from owntwitter.services.events import ChangeStreamPublisher, EventBus
+from owntwitter.services.feed_cache import (
+    FeedCache,
+    InMemoryCacheBackend,
+    RedisCacheBackend,
+)
+from owntwitter.services.instrumentation import prometheus_text
+from owntwitter.services.profiling import (
+    RequestTimings,
+    SamplingProfiler,
+    TimedJSONResponse,
+    current_timings,
+    request_metrics,
+    write_folded_stacks,
+)
+from owntwitter.services.write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
 
 settings = Settings()
-app = FastAPI()
+app = FastAPI(default_response_class=TimedJSONResponse)
 app.include_router(router)
 
+PROFILE_HEADER = "X-Profile"
+
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    if not settings.request_timing_enabled:
+        return await call_next(request)
+
+    profiler = None
+    if random.random() < settings.profile_sample_rate or (
+        settings.profile_header_enabled and PROFILE_HEADER in request.headers
+    ):
+        # samples the event loop thread, which runs this request
+        profiler = SamplingProfiler(
+            threading.get_ident(), settings.profile_interval_ms / 1000
+        )
+        profiler.start()
+
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        total = time.perf_counter() - started
+        current_timings.reset(token)
+        stacks = profiler.stop() if profiler is not None else None
+
+    # the path template, so that metrics are not split by ids
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    request_metrics.record(route, timings, total)
+
+    if stacks is not None:
+        name = f"{route.strip('/').replace('/', '_')}-{uuid.uuid4().hex[:8]}"
+        path = write_folded_stacks(stacks, settings.profile_dir, name)
+        logger.info("profile of %s %s written to %s", request.method, route, path)
+
+    return response
+
+
+@app.on_event("startup")
+def open_database_connection():
+    if settings.mongo_migrate_on_startup:
+        # one-off blocking index bootstrap before the first request is served
+        migration_db = DatabaseConnector(settings)
+        migration_db.migrate()
+        migration_db.close()
+
+    # one connector (and connection pool) for the lifetime of the application
+    if settings.cache_enabled:
+        app.state.db = CachedAsyncDatabaseConnector(settings)
+    else:
+        app.state.db = AsyncDatabaseConnector(settings)
+
+    app.state.feed_cache = None
+    if settings.feed_cache_enabled:
+        if settings.feed_cache_redis_url:
+            backend = RedisCacheBackend(settings.feed_cache_redis_url)
+        else:
+            backend = InMemoryCacheBackend()
+        app.state.feed_cache = FeedCache(backend, settings.feed_cache_ttl_seconds)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # need the event loop, hence not part of open_database_connection
+    app.state.events = None
+    app.state.change_stream = None
+    if settings.events_enabled:
+        app.state.events = EventBus(settings.events_queue_size)
+        if settings.events_change_stream:
+            app.state.change_stream = ChangeStreamPublisher(
+                app.state.db, app.state.events
+            )
+            app.state.change_stream.start()
+
+    app.state.write_behind = None
+    if settings.write_behind_enabled:
+        app.state.write_behind = WriteBehindQueue(
+            app.state.db,
+            settings.write_behind_batch_size,
+            settings.write_behind_flush_interval_seconds,
+            settings.write_behind_max_pending,
+        )
+        app.state.write_behind.start()
+
+
+@app.on_event("shutdown")
+async def close_database_connection():
+    try:
+        if app.state.write_behind is not None:
+            # pending writes are flushed before the connections are closed
+            await app.state.write_behind.close()
+        if app.state.change_stream is not None:
+            await app.state.change_stream.close()
+    finally:
+        app.state.db.close()
+        if app.state.feed_cache is not None:
+            await app.state.feed_cache.close()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    # totals of this worker process
+    cache_stats = None
+    if isinstance(app.state.db, CachedAsyncDatabaseConnector):
+        cache_stats = app.state.db.cache_stats()
+    return prometheus_text(cache_stats) + request_metrics.to_prometheus()
+
+
 if __name__ == "__main__":
 
     import uvicorn
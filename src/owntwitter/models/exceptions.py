@@ -8,3 +8,19 @@ class PostNotFoundException(Exception):
 
 class CommentNotFoundException(Exception):
     pass
+
+
+class InvalidCursorException(Exception):
+    pass
+
+
+class FollowNotFoundException(Exception):
+    pass
+
+
+class JobNotFoundException(Exception):
+    pass
+
+
+class WriteBehindQueueFullException(Exception):
+    pass
@@ -1,6 +1,6 @@
 from pydantic_factories import ModelFactory
 
-from owntwitter.models.models import Comment, Post, User
+from owntwitter.models.models import Comment, Job, Like, Post, User
 
 
 class UserFactory(ModelFactory):
@@ -13,3 +13,11 @@ class PostFactory(ModelFactory):
 
 class CommentFactory(ModelFactory):
     __model__ = Comment
+
+
+class LikeFactory(ModelFactory):
+    __model__ = Like
+
+
+class JobFactory(ModelFactory):
+    __model__ = Job
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, EmailStr, Field, constr
 
@@ -8,21 +8,31 @@ from owntwitter.models.settings import Settings
 settings = Settings()
 
 
-class User(BaseModel):
+class PublicUser(BaseModel):
+    """What everyone may see of a user, e.g. in the likes of a post."""
+
     username: str = Field(alias="_id")
-    email: EmailStr
-    password: str
 
     class Config:
         allow_population_by_field_name = True
 
 
+class PrivateUser(PublicUser):
+    """A user without the password."""
+
+    email: EmailStr
+
+
+class User(PrivateUser):
+    password: str
+
+
 class Post(BaseModel):
     post_id: str = Field(alias="_id")
     username: str
     timestamp: datetime
     content: Optional[constr(max_length=settings.max_content_length)]
-    likes: List[str]
+    like_count: int = 0  # likes are stored in their own collection
     number_of_comments: int
 
     class Config:
@@ -38,3 +48,33 @@ class Comment(BaseModel):
 
     class Config:
         allow_population_by_field_name = True
+
+
+class PostDetail(BaseModel):
+    """A post with the first page of its comment section."""
+
+    post: Post
+    comments: List[Comment]
+
+
+class Like(BaseModel):
+    like_id: str = Field(alias="_id")
+    post_id: str
+    username: str
+    timestamp: datetime
+
+    class Config:
+        allow_population_by_field_name = True
+
+
+class Job(BaseModel):
+    job_id: str = Field(alias="_id")
+    kind: str
+    target: str
+    status: str  # running, done or failed
+    progress: Dict[str, int] = {}
+    created: datetime
+    finished: Optional[datetime]
+
+    class Config:
+        allow_population_by_field_name = True
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Optional
 
 from pydantic import BaseSettings
 
@@ -10,8 +11,66 @@ class Settings(BaseSettings):
     max_comment_length: int
     mongo_db_url: str
     mongo_db_port: int
+    mongo_db_name: str = "twitter"
     uvicorn_port: int
     root_path: str = str(ROOT_PATH)
 
+    # connection pool of the shared mongo client
+    mongo_min_pool_size: int = 0
+    mongo_max_pool_size: int = 100
+    mongo_max_idle_time_ms: int = 60000
+    mongo_wait_queue_timeout_ms: int = 5000
+    mongo_migrate_on_startup: bool = True
+    # cascading deletes in one transaction; requires a replica set
+    mongo_use_transactions: bool = False
+
+    # followers above which posts are merged into timelines on read
+    timeline_fan_out_limit: int = 10000
+
+    # in-process read-through cache for users and posts
+    cache_enabled: bool = True
+    cache_max_size: int = 10000
+    cache_ttl_seconds: float = 5.0
+
+    # first feed page, shared by all workers when a redis url is configured
+    feed_cache_enabled: bool = True
+    feed_cache_redis_url: Optional[str] = None
+    feed_cache_ttl_seconds: float = 30.0
+
+    # timing of mongo commands, exported at /metrics
+    instrumentation_enabled: bool = True
+    # commands taking longer are logged, with their plan if explain is enabled
+    slow_query_ms: float = 100.0
+    slow_query_explain: bool = True
+    # encodes every reply again to count its bytes, hence opt-in
+    reply_bytes_enabled: bool = False
+
+    # Server-Timing header and per route totals at /metrics
+    request_timing_enabled: bool = True
+    # share of requests profiled, and whether an X-Profile header requests it
+    profile_sample_rate: float = 0.0
+    profile_header_enabled: bool = False
+    profile_interval_ms: float = 1.0
+    profile_dir: str = f"{ROOT_PATH}/profiles"
+
+    # comments and likes acknowledged with 202 and written in batches, once
+    # batch_size writes are pending or after flush_interval_seconds
+    write_behind_enabled: bool = False
+    write_behind_batch_size: int = 500
+    write_behind_flush_interval_seconds: float = 0.05
+    # pending writes above which new ones are rejected with 503
+    write_behind_max_pending: int = 10000
+
+    # server-sent events of new posts and comments; a change stream (needs a
+    # replica set) pushes the writes of all workers, not only the own ones
+    events_enabled: bool = True
+    events_change_stream: bool = False
+    # events buffered per client; slow clients lose the oldest ones
+    events_queue_size: int = 100
+    events_keepalive_seconds: float = 15.0
+
+    # users owning more posts and comments are deleted in a background job
+    background_delete_threshold: int = 10000
+
     class Config:
         env_file = f"{ROOT_PATH}/.env"
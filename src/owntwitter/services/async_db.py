@@ -0,0 +1,850 @@
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+
+from owntwitter.models.exceptions import (
+    CommentNotFoundException,
+    FollowNotFoundException,
+    JobNotFoundException,
+    PostNotFoundException,
+    UserNotFoundException,
+)
+from owntwitter.models.models import (
+    Comment,
+    Job,
+    Like,
+    Post,
+    PostDetail,
+    PublicUser,
+    User,
+)
+from owntwitter.models.settings import Settings
+from owntwitter.services.bulk import (
+    BULK_BATCH_SIZE,
+    count_by_post_pipeline,
+    increment_comment_counters,
+    increment_like_counters,
+    inserted_documents,
+    set_counters,
+    timeline_entries,
+)
+from owntwitter.services.cascade import (
+    CASCADE_BATCH_SIZE,
+    counts_per_post_pipeline,
+    decrement_counters,
+    reactions_to_posts_pipeline,
+)
+from owntwitter.services.db import (
+    comment_from_document,
+    mongo_client_options,
+    post_from_document,
+    user_from_document,
+)
+from owntwitter.services.detail import DETAIL_COMMENTS_LIMIT, post_detail_pipeline
+from owntwitter.services.export import EXPORT_BATCH_SIZE
+from owntwitter.services.instrumentation import instrumented
+from owntwitter.services.pagination import keyset_filter, keyset_sort
+from owntwitter.services.search import (
+    content_with_tags,
+    encode_with_tags,
+    parse_query,
+    tag_filter,
+    text_search_pipeline,
+)
+from owntwitter.services.serialization import (
+    COMMENT_FIELDS,
+    POST_FIELDS,
+    model_projection,
+    projection,
+)
+from owntwitter.services.timeline import (
+    BACKFILL_SIZE,
+    FAN_OUT_BATCH_SIZE,
+    TIMELINE_ENTRY_PROJECTION,
+    merge_timeline,
+    timeline_entry,
+)
+from owntwitter.services.utils import chunked
+
+
+async def _chunked_ids(cursor, size: int):
+    chunk = []
+    async for document in cursor:
+        chunk.append(document["_id"])
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@instrumented
+class AsyncDatabaseConnector:
+    """asyncio counterpart of DatabaseConnector, built on motor.
+
+    Offers the same methods as DatabaseConnector as coroutines, so that the
+    api endpoints never block the event loop while waiting for mongo.
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        if settings is None:
+            settings = Settings()
+
+        self._fan_out_limit = settings.timeline_fan_out_limit
+        self._use_transactions = settings.mongo_use_transactions
+        self._background_delete_threshold = settings.background_delete_threshold
+        self._client = AsyncIOMotorClient(**mongo_client_options(settings))
+
+        # Database
+        self._db = self._client[settings.mongo_db_name]
+
+        # Collections
+        self._users = self._db.users
+        self._posts = self._db.posts
+        self._comments = self._db.comments
+        self._follows = self._db.follows
+        self._timelines = self._db.timelines
+        self._likes = self._db.likes
+        self._jobs = self._db.jobs
+
+    def close(self):
+        # closes all pooled connections of the client
+        self._client.close()
+
+    async def drop_database(self):
+        # for throwaway databases, e.g. of benchmarks
+        await self._client.drop_database(self._db.name)
+
+    @asynccontextmanager
+    async def _transaction(self):
+        # multi document transactions need a replica set, hence opt-in
+        if not self._use_transactions:
+            yield None
+            return
+
+        async with await self._client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+
+    # =====================# JOBS #=====================#
+
+    async def create_job(self, kind: str, target: str) -> Job:
+        job = Job(
+            job_id=uuid.uuid4().hex,
+            kind=kind,
+            target=target,
+            status="running",
+            created=datetime.utcnow(),
+        )
+        await self._jobs.insert_one(jsonable_encoder(job))
+        return job
+
+    async def read_job(self, job_id: str) -> Job:
+        job = await self._jobs.find_one({"_id": job_id})
+
+        if job is None:
+            raise JobNotFoundException()
+
+        return Job(**job)
+
+    async def run_job(self, job_id: str, operation, *args):
+        # runs operation(*args, job_id=job_id) and records how it ended
+        try:
+            await operation(*args, job_id=job_id)
+        except Exception:
+            await self._finish_job(job_id, "failed")
+            raise
+
+        await self._finish_job(job_id, "done")
+
+    async def _finish_job(self, job_id: str, status: str):
+        await self._jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": status, "finished": datetime.utcnow()}},
+        )
+
+    async def _report_progress(self, job_id: Optional[str], step: str, count: int):
+        if job_id is None:
+            return
+
+        await self._jobs.update_one(
+            {"_id": job_id}, {"$set": {f"progress.{step}": count}}
+        )
+
+    # =====================# USERS #=====================#
+
+    async def create_new_user(self, user: User):
+        # raises duplicate key error, if user already in database
+        user_json = jsonable_encoder(user)
+        return await self._users.insert_one(user_json)
+
+    async def read_user(self, username: str, view: Type[PublicUser] = User):
+        # only the fields of the view are read, e.g. no password for PrivateUser
+        user = await self._users.find_one({"_id": username}, model_projection(view))
+
+        if user is None:
+            raise UserNotFoundException()
+
+        return user_from_document(user, view)
+
+    async def read_users(
+        self, usernames: List[str], view: Type[PublicUser] = User
+    ) -> List[PublicUser]:
+        # one round trip; order is preserved and unknown (deleted) users skipped
+        cursor = self._users.find({"_id": {"$in": usernames}}, model_projection(view))
+        found = {u["_id"]: u async for u in cursor}
+        return [
+            user_from_document(found[name], view) for name in usernames if name in found
+        ]
+
+    async def update_user(self, new_user):
+        response = await self._users.replace_one(
+            {"_id": new_user.username}, jsonable_encoder(new_user)
+        )
+        if response.matched_count == 0:
+            raise UserNotFoundException()
+
+        return response
+
+    async def count_user_documents(self, username: str) -> int:
+        # documents deleted with the user: its posts, comments and likes and the
+        # comments and likes on its posts, counted up to the background threshold
+        await self._check_users_exist(username)
+
+        limit = self._background_delete_threshold
+        count = 0
+        for collection in (self._posts, self._comments, self._likes):
+            count += await collection.count_documents(
+                {"username": username}, limit=limit
+            )
+            if count >= limit:
+                return limit
+
+        reactions = await self._posts.aggregate(
+            reactions_to_posts_pipeline(username, limit)
+        ).to_list(None)
+        if reactions:
+            count += reactions[0]["count"]
+        return min(count, limit)
+
+    async def delete_user(self, username, job_id: Optional[str] = None):
+
+        # check if user in db; possibly throws user not found exception
+        await self._check_users_exist(username)
+
+        async with self._transaction() as session:
+            # trigger to update counters of posts the user commented on or liked
+            for collection, counter in (
+                (self._comments, "number_of_comments"),
+                (self._likes, "like_count"),
+            ):
+                counts = collection.aggregate(
+                    counts_per_post_pipeline(username), session=session
+                )
+                ops = decrement_counters(username, await counts.to_list(None), counter)
+                for chunk in chunked(ops, CASCADE_BATCH_SIZE):
+                    await self._posts.bulk_write(chunk, ordered=False, session=session)
+                await self._report_progress(job_id, counter, len(ops))
+
+            # trigger to delete all comments and likes of user and on posts of user
+            response = await self._comments.delete_many(
+                {"username": username}, session=session
+            )
+            await self._report_progress(job_id, "comments", response.deleted_count)
+            response = await self._likes.delete_many(
+                {"username": username}, session=session
+            )
+            await self._report_progress(job_id, "likes", response.deleted_count)
+
+            cursor = self._posts.find(
+                {"username": username}, {"_id": 1}, session=session
+            )
+            deleted = 0
+            async for chunk in _chunked_ids(cursor, CASCADE_BATCH_SIZE):
+                response = await self._comments.delete_many(
+                    {"post_id": {"$in": chunk}}, session=session
+                )
+                await self._likes.delete_many(
+                    {"post_id": {"$in": chunk}}, session=session
+                )
+                deleted += response.deleted_count
+                await self._report_progress(job_id, "comments_on_posts", deleted)
+
+            # trigger to remove user from the follow graph and all timelines
+            await self._follows.delete_many(
+                {"$or": [{"follower": username}, {"followee": username}]},
+                session=session,
+            )
+            await self._timelines.delete_many({"owner": username}, session=session)
+            await self._timelines.delete_many({"author": username}, session=session)
+
+            # trigger to delete all posts of user
+            response = await self._posts.delete_many(
+                {"username": username}, session=session
+            )
+            await self._report_progress(job_id, "posts", response.deleted_count)
+
+            return await self._users.delete_one({"_id": username}, session=session)
+
+    # =====================# POSTS #=====================#
+
+    async def create_new_post(self, post: Post):
+
+        # check if user in db
+        await self._check_users_exist(post.username)
+
+        post_json = encode_with_tags(post)
+        response = await self._posts.insert_one(post_json)
+
+        await self._fan_out(post_json)
+        return response
+
+    async def read_posts_of_user(
+        self,
+        username: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        raw: bool = False,
+    ):
+        # newest first; without a limit all posts of the user are returned
+        query = keyset_filter({"username": username}, after, descending=True)
+        cursor = self._posts.find(query, projection(POST_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=True))
+        posts = await cursor.limit(limit or 0).to_list(None)
+        if not posts:
+            # only an empty page tells apart unknown users; possibly throws
+            # user not found exception
+            await self._check_users_exist(username)
+
+        if raw:
+            return posts
+        return [post_from_document(r) for r in posts]
+
+    async def read_post(self, post_id: str):
+        post = await self._posts.find_one({"_id": post_id}, projection(POST_FIELDS))
+
+        if post is None:
+            raise PostNotFoundException()
+
+        return post_from_document(post)
+
+    async def read_post_detail(
+        self,
+        post_id: str,
+        comments_limit: int = DETAIL_COMMENTS_LIMIT,
+        raw: bool = False,
+    ):
+        # post and first comment page in one round trip, see services/detail.py
+        pipeline = post_detail_pipeline(post_id, comments_limit)
+        documents = await self._posts.aggregate(pipeline).to_list(None)
+        if not documents:
+            raise PostNotFoundException()
+
+        detail = documents[0]
+        if raw:
+            return detail
+        return PostDetail(
+            post=post_from_document(detail),
+            comments=[comment_from_document(c) for c in detail["comments"]],
+        )
+
+    async def read_recent_posts(
+        self, count=10, after: Optional[str] = None, raw: bool = False
+    ) -> List[Post]:
+        query = keyset_filter({}, after, descending=True)
+        cursor = self._posts.find(query, projection(POST_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=True)).limit(count)
+        posts = await cursor.to_list(None)
+        if not posts:
+            raise PostNotFoundException()
+
+        # raw returns the documents themselves, for serialization.documents_to_json
+        if raw:
+            return posts
+        return [post_from_document(post) for post in posts]
+
+    async def update_post(self, new_post):
+        # only the content is editable; a replace would reset the counters
+        # maintained by concurrent $inc updates
+        return await self._posts.update_one(
+            {"_id": new_post.post_id}, {"$set": content_with_tags(new_post)}
+        )
+
+    async def delete_post(self, post_id):
+        async with self._transaction() as session:
+            # trigger to delete all comments and likes of post
+            await self._comments.delete_many({"post_id": post_id}, session=session)
+            await self._likes.delete_many({"post_id": post_id}, session=session)
+
+            # trigger to remove post from all timelines
+            await self._timelines.delete_many({"post_id": post_id}, session=session)
+
+            # the cascade is a no-op for unknown posts; aborted with a transaction
+            response = await self._posts.delete_one({"_id": post_id}, session=session)
+            if response.deleted_count == 0:
+                raise PostNotFoundException()
+
+            return response
+
+    async def like_post(self, post_id: str, username: str):
+        # check if user in db; possibly throws user not found exception
+        await self._check_users_exist(username)
+
+        async with self._transaction() as session:
+            # a repeated like matches the existing document and inserts nothing
+            response = await self._likes.update_one(
+                {"post_id": post_id, "username": username},
+                {
+                    "$setOnInsert": {
+                        "_id": uuid.uuid4().hex,
+                        "timestamp": jsonable_encoder(datetime.utcnow()),
+                    }
+                },
+                upsert=True,
+                session=session,
+            )
+            if response.upserted_id is None:
+                return response
+
+            # the counter update doubles as the existence check of the post
+            updated = await self._posts.update_one(
+                {"_id": post_id}, {"$inc": {"like_count": 1}}, session=session
+            )
+            if updated.matched_count == 0:
+                if session is None:
+                    await self._likes.delete_one({"_id": response.upserted_id})
+                raise PostNotFoundException()
+
+        return response
+
+    async def unlike_post(self, post_id: str, username: str):
+        async with self._transaction() as session:
+            response = await self._likes.delete_one(
+                {"post_id": post_id, "username": username}, session=session
+            )
+            if response.deleted_count:
+                await self._posts.update_one(
+                    {"_id": post_id}, {"$inc": {"like_count": -1}}, session=session
+                )
+
+        if response.deleted_count == 0:
+            # possibly throws post_not_found exception
+            await self._check_posts_exist(post_id)
+
+        return response
+
+    async def read_likes_of_post(
+        self, post_id: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> List[Like]:
+        # oldest first, like comment sections
+        query = keyset_filter({"post_id": post_id}, after, descending=False)
+        cursor = self._likes.find(query, model_projection(Like))
+        cursor = cursor.sort(keyset_sort(descending=False))
+        likes = await cursor.limit(limit or 0).to_list(None)
+        if not likes:
+            # possibly throws post_not_found exception
+            await self._check_posts_exist(post_id)
+
+        return [Like(**like) for like in likes]
+
+    # Existence checks read the _id index only. Listing reads skip them unless
+    # the page is empty, and writes use the result of the write where possible.
+
+    async def check_references(self, username: str, post_id: str):
+        """Raises like create_new_comment and like_post, without writing."""
+        await self._check_users_exist(username)
+        await self._check_posts_exist(post_id)
+
+    async def check_user_exists(self, username: str):
+        """Raises UserNotFoundException, without reading the user."""
+        await self._check_users_exist(username)
+
+    async def check_post_exists(self, post_id: str):
+        """Raises PostNotFoundException, without reading the post."""
+        await self._check_posts_exist(post_id)
+
+    async def check_all_references(
+        self, usernames: Iterable[str], post_ids: Iterable[str] = ()
+    ):
+        """Raises like check_references, for the documents of a bulk insert.
+
+        One count per collection, however many documents reference them.
+        """
+        await self._check_users_exist(*usernames)
+        if post_ids:
+            await self._check_posts_exist(*post_ids)
+
+    async def _check_users_exist(self, *usernames: str):
+        usernames = set(usernames)
+        query = {"_id": {"$in": list(usernames)}}
+        if await self._users.count_documents(query) < len(usernames):
+            raise UserNotFoundException()
+
+    async def _check_posts_exist(self, *post_ids: str):
+        post_ids = set(post_ids)
+        query = {"_id": {"$in": list(post_ids)}}
+        if await self._posts.count_documents(query) < len(post_ids):
+            raise PostNotFoundException()
+
+    # =====================# COMMENTS #=====================#
+
+    async def create_new_comment(self, comment: Comment):
+        # check if user in db; possibly throws user not found exception
+        await self._check_users_exist(comment.username)
+
+        comment_json = encode_with_tags(comment)
+        async with self._transaction() as session:
+            response = await self._comments.insert_one(comment_json, session=session)
+
+            # the counter update doubles as the existence check of the post
+            updated = await self._posts.update_one(
+                {"_id": comment.post_id},
+                {"$inc": {"number_of_comments": 1}},
+                session=session,
+            )
+            if updated.matched_count == 0:
+                if session is None:
+                    await self._comments.delete_one({"_id": comment.comment_id})
+                raise PostNotFoundException()
+
+        return response
+
+    async def read_comment(self, comment_id: str):
+        comment = await self._comments.find_one(
+            {"_id": comment_id}, projection(COMMENT_FIELDS)
+        )
+
+        if comment is None:
+            raise CommentNotFoundException()
+
+        return comment_from_document(comment)
+
+    async def read_comments_of_post(
+        self,
+        post_id: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        raw: bool = False,
+    ):
+        # oldest first; without a limit the whole comment section is returned
+        query = keyset_filter({"post_id": post_id}, after, descending=False)
+        cursor = self._comments.find(query, projection(COMMENT_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=False))
+        comments = await cursor.limit(limit or 0).to_list(None)
+        if not comments:
+            # possibly throws post_not_found exception
+            await self._check_posts_exist(post_id)
+
+        if raw:
+            return comments
+        return [comment_from_document(r) for r in comments]
+
+    async def read_comments_of_user(self, username: str):
+        cursor = self._comments.find({"username": username}, projection(COMMENT_FIELDS))
+        response = await cursor.to_list(None)
+        return [comment_from_document(r) for r in response]
+
+    async def update_comment(self, new_comment):
+        return await self._comments.replace_one(
+            {"_id": new_comment.comment_id}, encode_with_tags(new_comment)
+        )
+
+    async def delete_comment(self, comment_id):
+        # check if comment exists; the post is needed to update its counter
+        comment = await self._comments.find_one({"_id": comment_id}, {"post_id": 1})
+        if comment is None:
+            raise CommentNotFoundException()
+
+        return await self._delete_comment_of_post(comment_id, comment["post_id"])
+
+    async def _delete_comment_of_post(self, comment_id: str, post_id: str):
+        async with self._transaction() as session:
+            response = await self._comments.delete_one(
+                {"_id": comment_id}, session=session
+            )
+            if response.deleted_count:
+                await self._posts.update_one(
+                    {"_id": post_id},
+                    {"$inc": {"number_of_comments": -1}},
+                    session=session,
+                )
+
+        return response
+
+    # =====================# FOLLOWS #=====================#
+
+    async def follow_user(self, follower: str, followee: str):
+        # check if both users in db; possibly throws user not found exception
+        await self._check_users_exist(follower, followee)
+
+        response = await self._follows.update_one(
+            {"follower": follower, "followee": followee},
+            {"$setOnInsert": {"timestamp": datetime.utcnow(), "pull": False}},
+            upsert=True,
+        )
+        if response.upserted_id is None:
+            return response  # already following
+
+        followers = await self._follows.count_documents(
+            {"followee": followee}, limit=self._fan_out_limit + 1
+        )
+        if followers > self._fan_out_limit:
+            # posts of followee are merged into timelines on read from now on
+            await self._follows.update_many(
+                {"followee": followee, "pull": False}, {"$set": {"pull": True}}
+            )
+        else:
+            cursor = (
+                self._posts.find({"username": followee})
+                .sort(keyset_sort(descending=True))
+                .limit(BACKFILL_SIZE)
+            )
+            await self._insert_timeline_entries(
+                [timeline_entry(follower, p) async for p in cursor]
+            )
+
+        return response
+
+    async def unfollow_user(self, follower: str, followee: str):
+        response = await self._follows.delete_one(
+            {"follower": follower, "followee": followee}
+        )
+        if response.deleted_count == 0:
+            raise FollowNotFoundException()
+
+        await self._timelines.delete_many({"owner": follower, "author": followee})
+        return response
+
+    async def read_timeline(
+        self, username: str, limit: int = 20, after: Optional[str] = None
+    ) -> List[Post]:
+        query = keyset_filter({"owner": username}, after, True, id_field="post_id")
+        cursor = self._timelines.find(query, TIMELINE_ENTRY_PROJECTION).sort(
+            keyset_sort(descending=True, id_field="post_id")
+        )
+        entries = await cursor.limit(limit).to_list(None)
+
+        # accounts with too many followers to fan out are merged in on read
+        cursor = self._follows.find(
+            {"follower": username, "pull": True}, {"followee": 1}
+        )
+        pulled = [f["followee"] async for f in cursor]
+        pulled_posts = []
+        if pulled:
+            query = keyset_filter({"username": {"$in": pulled}}, after, True)
+            cursor = self._posts.find(query, projection(POST_FIELDS))
+            cursor = cursor.sort(keyset_sort(descending=True))
+            pulled_posts = await cursor.limit(limit).to_list(None)
+
+        if not entries and not pulled_posts:
+            # possibly throws user not found exception
+            await self._check_users_exist(username)
+
+        post_ids = merge_timeline(entries, pulled_posts, limit)
+        posts = {p["_id"]: p for p in pulled_posts}
+        missing = [post_id for post_id in post_ids if post_id not in posts]
+        if missing:
+            cursor = self._posts.find(
+                {"_id": {"$in": missing}}, projection(POST_FIELDS)
+            )
+            posts.update([(p["_id"], p) async for p in cursor])
+
+        return [post_from_document(posts[i]) for i in post_ids if i in posts]
+
+    async def _fan_out(self, post: dict):
+        # author and all followers which are not served by fan-out on read
+        followers = self._follows.find(
+            {"followee": post["username"], "pull": False}, {"follower": 1}
+        )
+
+        entries = [timeline_entry(post["username"], post)]
+        async for f in followers:
+            entries.append(timeline_entry(f["follower"], post))
+            if len(entries) == FAN_OUT_BATCH_SIZE:
+                await self._insert_timeline_entries(entries)
+                entries = []
+
+        await self._insert_timeline_entries(entries)
+
+    async def _insert_timeline_entries(self, entries: List[dict]):
+        if entries:
+            # entries already in the timeline (e.g. backfilled) are skipped
+            await self._insert_unordered(self._timelines, entries)
+
+    async def _insert_unordered(self, collection, documents: List[dict]) -> List[dict]:
+        # returns the inserted documents; duplicates are skipped
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            return inserted_documents(documents, e)
+        return documents
+
+    # =====================# SEARCH #=====================#
+
+    async def search_posts(
+        self, q: str, limit: int = 20, after: Optional[str] = None, raw: bool = False
+    ):
+        posts = await self._search(self._posts, POST_FIELDS, q, limit, after)
+        if raw:
+            return posts
+        return [post_from_document(post) for post in posts]
+
+    async def search_comments(
+        self, q: str, limit: int = 20, after: Optional[str] = None, raw: bool = False
+    ):
+        comments = await self._search(self._comments, COMMENT_FIELDS, q, limit, after)
+        if raw:
+            return comments
+        return [comment_from_document(comment) for comment in comments]
+
+    async def _search(
+        self, collection, fields, q: str, limit: int, after: Optional[str]
+    ):
+        query = parse_query(q)
+        if query.text:
+            # ranked by relevance; the documents carry their text score
+            pipeline = text_search_pipeline(query, projection(fields), limit, after)
+            return await collection.aggregate(pipeline).to_list(None)
+
+        conditions = tag_filter(query)
+        if not conditions:
+            return []
+
+        # tags only: exact matches on the tag indexes, newest first
+        query = keyset_filter(conditions, after, descending=True)
+        cursor = collection.find(query, projection(fields))
+        cursor = cursor.sort(keyset_sort(descending=True)).limit(limit)
+        return await cursor.to_list(None)
+
+    # =====================# EVENTS #=====================#
+
+    async def watch_inserts(
+        self,
+        resume_after: Optional[dict] = None,
+        on_open: Optional[Callable[[], None]] = None,
+    ):
+        """Yields the change events of new posts and comments.
+
+        One change stream on the database serves both collections; it needs a
+        replica set. on_open is called once the server has accepted the stream.
+        """
+        pipeline = [
+            {
+                "$match": {
+                    "operationType": "insert",
+                    "ns.coll": {"$in": ["posts", "comments"]},
+                }
+            }
+        ]
+        async with self._db.watch(pipeline, resume_after=resume_after) as stream:
+            if on_open is not None:
+                on_open()
+            async for change in stream:
+                yield change
+
+    # =====================# EXPORT #=====================#
+
+    async def export_posts_of_user(
+        self, username: str, batch_size: int = EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[List[dict]]:
+        """Yields all posts of a user in batches, newest first."""
+        cursor = self._posts.find({"username": username}, projection(POST_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=True)).batch_size(batch_size)
+        while batch := await cursor.to_list(batch_size):
+            yield batch
+
+    async def export_comments_of_posts(
+        self, post_ids: List[str], batch_size: int = EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[List[dict]]:
+        """Yields the comment sections of the posts in batches, oldest first."""
+        query = {"post_id": {"$in": post_ids}}
+        cursor = self._comments.find(query, projection(COMMENT_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=False)).batch_size(batch_size)
+        while batch := await cursor.to_list(batch_size):
+            yield batch
+
+    # =====================# BULK #=====================#
+
+    async def bulk_insert_users(
+        self, users: Iterable[User], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        inserted = 0
+        for chunk in chunked(map(jsonable_encoder, users), batch_size):
+            inserted += len(await self._insert_unordered(self._users, chunk))
+        return inserted
+
+    async def bulk_insert_posts(
+        self, posts: Iterable[Post], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        # the authors are not checked; see services.bulk
+        inserted = 0
+        for chunk in chunked(map(encode_with_tags, posts), batch_size):
+            documents = await self._insert_unordered(self._posts, chunk)
+            await self._bulk_fan_out(documents)
+            inserted += len(documents)
+        return inserted
+
+    async def bulk_insert_comments(
+        self, comments: Iterable[Comment], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        # neither authors nor posts are checked; see services.bulk
+        inserted = 0
+        for chunk in chunked(map(encode_with_tags, comments), batch_size):
+            documents = await self._insert_unordered(self._comments, chunk)
+            if documents:
+                await self._posts.bulk_write(
+                    increment_comment_counters(documents), ordered=False
+                )
+            inserted += len(documents)
+        return inserted
+
+    async def bulk_insert_likes(
+        self, likes: Iterable[Like], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        # neither users nor posts are checked; see services.bulk
+        inserted = 0
+        for chunk in chunked(map(jsonable_encoder, likes), batch_size):
+            documents = await self._insert_unordered(self._likes, chunk)
+            if documents:
+                await self._posts.bulk_write(
+                    increment_like_counters(documents), ordered=False
+                )
+            inserted += len(documents)
+        return inserted
+
+    async def recount_post_counters(self, post_ids: Iterable[str]):
+        """Sets the comment and like counters of posts to the stored counts.
+
+        Repairs counters after a bulk insert whose counter updates failed;
+        increments that run concurrently with the recount may be lost.
+        """
+        post_ids = list(post_ids)
+        if not post_ids:
+            return
+
+        pipeline = count_by_post_pipeline(post_ids)
+        comment_counts = await self._comments.aggregate(pipeline).to_list(None)
+        like_counts = await self._likes.aggregate(pipeline).to_list(None)
+        await self._posts.bulk_write(
+            set_counters(post_ids, comment_counts, like_counts), ordered=False
+        )
+
+    async def _bulk_fan_out(self, posts: List[dict]):
+        authors = list({p["username"] for p in posts})
+        cursor = self._follows.find(
+            {"followee": {"$in": authors}, "pull": False},
+            {"_id": 0, "follower": 1, "followee": 1},
+        )
+        followers = defaultdict(list)
+        async for f in cursor:
+            followers[f["followee"]].append(f["follower"])
+
+        entries = timeline_entries(posts, followers)
+        for chunk in chunked(entries, FAN_OUT_BATCH_SIZE):
+            await self._insert_timeline_entries(chunk)
@@ -0,0 +1,80 @@
+from collections import Counter
+from typing import Dict, Iterable, List
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from owntwitter.services.timeline import timeline_entry
+
+# Bulk inserts skip the existence checks of the single document writes and
+# send unordered insert_many batches; documents whose _id already exists are
+# skipped, so an interrupted load can simply be repeated. Comment and like
+# counters and timelines are still kept up to date, once per batch. Likes are
+# unique per post and user, so repeated likes are skipped the same way.
+
+BULK_BATCH_SIZE = 1000
+
+
+def inserted_documents(documents: List[dict], error: BulkWriteError) -> List[dict]:
+    # only duplicates are expected; they are left out of the result
+    if any(err["code"] != 11000 for err in error.details["writeErrors"]):
+        raise error
+
+    failed = {err["index"] for err in error.details["writeErrors"]}
+    return [d for i, d in enumerate(documents) if i not in failed]
+
+
+def increment_comment_counters(comments: Iterable[dict]) -> List[UpdateOne]:
+    return _increment_counters(comments, "number_of_comments")
+
+
+def increment_like_counters(likes: Iterable[dict]) -> List[UpdateOne]:
+    return _increment_counters(likes, "like_count")
+
+
+def _increment_counters(documents: Iterable[dict], counter: str) -> List[UpdateOne]:
+    counts = Counter(d["post_id"] for d in documents)
+    return [
+        UpdateOne({"_id": post_id}, {"$inc": {counter: count}})
+        for post_id, count in counts.items()
+    ]
+
+
+def count_by_post_pipeline(post_ids: List[str]) -> List[dict]:
+    return [
+        {"$match": {"post_id": {"$in": post_ids}}},
+        {"$group": {"_id": "$post_id", "count": {"$sum": 1}}},
+    ]
+
+
+def set_counters(
+    post_ids: Iterable[str],
+    comment_counts: Iterable[dict],
+    like_counts: Iterable[dict],
+) -> List[UpdateOne]:
+    # counts are the results of count_by_post_pipeline; posts without any
+    # comments or likes are missing from them
+    comments = {c["_id"]: c["count"] for c in comment_counts}
+    likes = {c["_id"]: c["count"] for c in like_counts}
+    return [
+        UpdateOne(
+            {"_id": post_id},
+            {
+                "$set": {
+                    "number_of_comments": comments.get(post_id, 0),
+                    "like_count": likes.get(post_id, 0),
+                }
+            },
+        )
+        for post_id in post_ids
+    ]
+
+
+def timeline_entries(
+    posts: Iterable[dict], followers: Dict[str, List[str]]
+) -> Iterable[dict]:
+    # followers maps authors to their followers served by fan-out on write
+    for post in posts:
+        yield timeline_entry(post["username"], post)
+        for follower in followers.get(post["username"], []):
+            yield timeline_entry(follower, post)
@@ -0,0 +1,198 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Type
+
+from owntwitter.models.models import PublicUser, User
+from owntwitter.models.settings import Settings
+from owntwitter.services.async_db import AsyncDatabaseConnector
+from owntwitter.services.bulk import BULK_BATCH_SIZE
+
+
+class TTLCache:
+    """Bounded least recently used cache whose entries expire after ttl seconds."""
+
+    def __init__(
+        self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()
+
+        # bumped by every invalidation, see put
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < self._clock():
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value, generation: Optional[int] = None):
+        # a value read before an invalidation could be outdated already
+        if generation is not None and generation != self.generation:
+            return
+
+        self._entries[key] = (self._clock() + self._ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self.generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class CachedAsyncDatabaseConnector(AsyncDatabaseConnector):
+    """AsyncDatabaseConnector serving users and posts from a read-through cache.
+
+    Every write going through this connector invalidates the affected entries.
+    Writes of other workers are only picked up after cache_ttl_seconds.
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        if settings is None:
+            settings = Settings()
+
+        super().__init__(settings)
+
+        self._user_cache = TTLCache(settings.cache_max_size, settings.cache_ttl_seconds)
+        self._post_cache = TTLCache(settings.cache_max_size, settings.cache_ttl_seconds)
+
+    def cache_stats(self) -> dict:
+        return {"users": self._user_cache.stats(), "posts": self._post_cache.stats()}
+
+    async def _cached(self, cache: TTLCache, key: str, read):
+        value = cache.get(key)
+        if value is None:
+            generation = cache.generation
+            value = await read(key)
+            cache.put(key, value, generation)
+
+        # callers must not be able to change the cached model
+        return value.copy()
+
+    # =====================# USERS #=====================#
+
+    async def read_user(self, username: str, view: Type[PublicUser] = User):
+        # the whole user is cached; views are cut from it
+        user = await self._cached(self._user_cache, username, super().read_user)
+        if view is User:
+            return user
+        return view.parse_obj(user.dict(by_alias=True, include=set(view.__fields__)))
+
+    async def _check_users_exist(self, *usernames: str):
+        # cached users exist (up to cache_ttl_seconds), like for read_user
+        missing = [u for u in usernames if self._user_cache.get(u) is None]
+        if missing:
+            await super()._check_users_exist(*missing)
+
+    async def update_user(self, new_user):
+        try:
+            return await super().update_user(new_user)
+        finally:
+            # after the write, so a concurrent read cannot cache the old user
+            self._user_cache.invalidate(new_user.username)
+
+    async def delete_user(self, username, job_id: Optional[str] = None):
+        try:
+            return await super().delete_user(username, job_id=job_id)
+        finally:
+            # posts of the user are gone and counters of other posts changed
+            self._user_cache.invalidate(username)
+            self._post_cache.clear()
+
+    # =====================# POSTS #=====================#
+
+    async def read_post(self, post_id: str):
+        return await self._cached(self._post_cache, post_id, super().read_post)
+
+    async def _check_posts_exist(self, *post_ids: str):
+        missing = [p for p in post_ids if self._post_cache.get(p) is None]
+        if missing:
+            await super()._check_posts_exist(*missing)
+
+    async def update_post(self, new_post):
+        try:
+            return await super().update_post(new_post)
+        finally:
+            self._post_cache.invalidate(new_post.post_id)
+
+    async def delete_post(self, post_id):
+        try:
+            return await super().delete_post(post_id)
+        finally:
+            self._post_cache.invalidate(post_id)
+
+    async def like_post(self, post_id: str, username: str):
+        try:
+            return await super().like_post(post_id, username)
+        finally:
+            self._post_cache.invalidate(post_id)
+
+    async def unlike_post(self, post_id: str, username: str):
+        try:
+            return await super().unlike_post(post_id, username)
+        finally:
+            self._post_cache.invalidate(post_id)
+
+    # =====================# COMMENTS #=====================#
+
+    async def create_new_comment(self, comment):
+        try:
+            return await super().create_new_comment(comment)
+        finally:
+            self._post_cache.invalidate(comment.post_id)
+
+    async def bulk_insert_comments(self, comments, batch_size=BULK_BATCH_SIZE):
+        comments = list(comments)
+        try:
+            return await super().bulk_insert_comments(comments, batch_size)
+        finally:
+            for post_id in {c.post_id for c in comments}:
+                self._post_cache.invalidate(post_id)
+
+    async def bulk_insert_likes(self, likes, batch_size=BULK_BATCH_SIZE):
+        likes = list(likes)
+        try:
+            return await super().bulk_insert_likes(likes, batch_size)
+        finally:
+            for post_id in {like.post_id for like in likes}:
+                self._post_cache.invalidate(post_id)
+
+    async def recount_post_counters(self, post_ids):
+        post_ids = list(post_ids)
+        try:
+            return await super().recount_post_counters(post_ids)
+        finally:
+            for post_id in post_ids:
+                self._post_cache.invalidate(post_id)
+
+    async def _delete_comment_of_post(self, comment_id: str, post_id: str):
+        # the post is known once delete_comment looked up the comment
+        try:
+            return await super()._delete_comment_of_post(comment_id, post_id)
+        finally:
+            self._post_cache.invalidate(post_id)
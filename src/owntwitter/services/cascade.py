@@ -0,0 +1,43 @@
+from typing import Iterable, List
+
+from pymongo import UpdateOne
+
+# Deleting a user or post removes everything that references it with a few
+# delete_many calls instead of one round trip per document.
+
+CASCADE_BATCH_SIZE = 1000
+
+
+def counts_per_post_pipeline(username: str) -> List[dict]:
+    # number of documents (comments or likes) of the user per post
+    return [
+        {"$match": {"username": username}},
+        {"$group": {"_id": "$post_id", "count": {"$sum": 1}}},
+    ]
+
+
+def reactions_to_posts_pipeline(username: str, limit: int) -> List[dict]:
+    # comments and likes on the first posts of the user, from their counters
+    return [
+        {"$match": {"username": username}},
+        {"$limit": limit},
+        {
+            "$group": {
+                "_id": None,
+                "count": {"$sum": {"$add": ["$number_of_comments", "$like_count"]}},
+            }
+        },
+    ]
+
+
+def decrement_counters(
+    username: str, counts: Iterable[dict], counter: str
+) -> List[UpdateOne]:
+    # posts of the user itself are deleted anyway
+    return [
+        UpdateOne(
+            {"_id": c["_id"], "username": {"$ne": username}},
+            {"$inc": {counter: -c["count"]}},
+        )
+        for c in counts
+    ]
@@ -0,0 +1,43 @@
+from typing import Dict, List
+
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+from owntwitter.services.bulk import count_by_post_pipeline
+from owntwitter.services.utils import chunked
+
+# counter on the post -> collection holding the counted documents
+COUNTERS = {"number_of_comments": "comments", "like_count": "likes"}
+
+
+def _corrections(db: Database, posts: List[dict]) -> Dict[str, List[UpdateOne]]:
+    # counts only the comments and likes of this batch, on their post_id indexes
+    pipeline = count_by_post_pipeline([post["_id"] for post in posts])
+    corrections = {}
+    for counter, collection in COUNTERS.items():
+        counts = {c["_id"]: c["count"] for c in db[collection].aggregate(pipeline)}
+        corrections[counter] = [
+            UpdateOne(
+                {"_id": post["_id"]}, {"$set": {counter: counts.get(post["_id"], 0)}}
+            )
+            for post in posts
+            if post.get(counter) != counts.get(post["_id"], 0)
+        ]
+    return corrections
+
+
+def reconcile_counters(db: Database, batch_size: int = 1000) -> Dict[str, int]:
+    """Recomputes the denormalized counters of all posts.
+
+    Posts are streamed in batches, so memory stays bounded by the batch size.
+    Returns the number of corrected posts per counter.
+    """
+    corrected = dict.fromkeys(COUNTERS, 0)
+    posts = db.posts.find({}, dict.fromkeys(COUNTERS, 1)).batch_size(batch_size)
+    for batch in chunked(posts, batch_size):
+        for counter, ops in _corrections(db, batch).items():
+            if ops:
+                db.posts.bulk_write(ops, ordered=False)
+                corrected[counter] += len(ops)
+
+    return corrected
@@ -1,32 +1,165 @@
-from typing import List
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Type
 
 from fastapi.encoders import jsonable_encoder
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 
 from owntwitter.models.exceptions import (
     CommentNotFoundException,
+    FollowNotFoundException,
     PostNotFoundException,
     UserNotFoundException,
 )
-from owntwitter.models.models import Comment, Post, User
+from owntwitter.models.models import Comment, Like, Post, PostDetail, PublicUser, User
 from owntwitter.models.settings import Settings
+from owntwitter.services import counters, migrations
+from owntwitter.services.bulk import (
+    BULK_BATCH_SIZE,
+    increment_comment_counters,
+    increment_like_counters,
+    inserted_documents,
+    timeline_entries,
+)
+from owntwitter.services.cascade import (
+    CASCADE_BATCH_SIZE,
+    counts_per_post_pipeline,
+    decrement_counters,
+)
+from owntwitter.services.detail import DETAIL_COMMENTS_LIMIT, post_detail_pipeline
+from owntwitter.services.export import EXPORT_BATCH_SIZE
+from owntwitter.services.instrumentation import (
+    CommandInstrumentation,
+    instrumented,
+    query_metrics,
+)
+from owntwitter.services.pagination import keyset_filter, keyset_sort
+from owntwitter.services.profiling import timed
+from owntwitter.services.search import (
+    content_with_tags,
+    encode_with_tags,
+    parse_query,
+    tag_filter,
+    text_search_pipeline,
+)
+from owntwitter.services.serialization import (
+    COMMENT_FIELDS,
+    POST_FIELDS,
+    model_projection,
+    projection,
+)
+from owntwitter.services.timeline import (
+    BACKFILL_SIZE,
+    FAN_OUT_BATCH_SIZE,
+    TIMELINE_ENTRY_PROJECTION,
+    merge_timeline,
+    timeline_entry,
+)
+from owntwitter.services.utils import chunked
+
+
+def mongo_client_options(settings: Settings) -> dict:
+    # connection pool options shared by the sync and async client
+    host = f"mongodb://{settings.mongo_db_url}:{settings.mongo_db_port}"
+    options = dict(
+        host=host,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxPoolSize=settings.mongo_max_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms,
+    )
+
+    if settings.instrumentation_enabled:
+        explain_host = host if settings.slow_query_explain else None
+        options["event_listeners"] = [
+            CommandInstrumentation(
+                query_metrics,
+                settings.slow_query_ms,
+                explain_host,
+                reply_bytes=settings.reply_bytes_enabled,
+            )
+        ]
+    return options
+
+
+@timed("validation")
+def user_from_document(user: dict, view: Type[PublicUser] = User) -> PublicUser:
+    return view.parse_obj(user)
+
+
+@timed("validation")
+def post_from_document(post: dict) -> Post:
+    return Post(
+        post_id=post["_id"],
+        username=post["username"],
+        timestamp=post["timestamp"],
+        content=post["content"],
+        like_count=post["like_count"],
+        number_of_comments=post["number_of_comments"],
+    )
+
+
+@timed("validation")
+def comment_from_document(comment: dict) -> Comment:
+    return Comment(
+        comment_id=comment["_id"],
+        post_id=comment["post_id"],
+        username=comment["username"],
+        timestamp=comment["timestamp"],
+        content=comment["content"],
+    )
 
 
+@instrumented
 class DatabaseConnector:
-    def __init__(self):
-        settings = Settings()
+    def __init__(self, settings: Optional[Settings] = None):
+        if settings is None:
+            settings = Settings()
 
-        self._client = MongoClient(
-            f"mongodb://{settings.mongo_db_url}:{settings.mongo_db_port}"
-        )
+        self._fan_out_limit = settings.timeline_fan_out_limit
+        self._use_transactions = settings.mongo_use_transactions
+        self._client = MongoClient(**mongo_client_options(settings))
 
         # Database
-        self._db = self._client.twitter
+        self._db = self._client[settings.mongo_db_name]
 
         # Collections
         self._users = self._db.users
         self._posts = self._db.posts
         self._comments = self._db.comments
+        self._follows = self._db.follows
+        self._timelines = self._db.timelines
+        self._likes = self._db.likes
+
+    def close(self):
+        # closes all pooled connections of the client
+        self._client.close()
+
+    @contextmanager
+    def _transaction(self):
+        # multi document transactions need a replica set, hence opt-in
+        if not self._use_transactions:
+            yield None
+            return
+
+        with self._client.start_session() as session:
+            with session.start_transaction():
+                yield session
+
+    def migrate(self):
+        # creates missing indexes; safe to call on every startup
+        return migrations.migrate(self._db)
+
+    def explain_queries(self):
+        return migrations.explain_queries(self._db)
+
+    def reconcile_counters(self):
+        # repairs drifted number_of_comments and like_count counters
+        return counters.reconcile_counters(self._db)
 
     # =====================# USERS #=====================#
 
@@ -36,197 +169,553 @@ class DatabaseConnector:
         response = self._users.insert_one(user_json)
         return response
 
-    def read_user(self, username: str):
-        # read without password, more inheritance user models (personalview and publicview)
-        user = self._users.find_one({"_id": username})
+    def read_user(self, username: str, view: Type[PublicUser] = User):
+        # only the fields of the view are read, e.g. no password for PrivateUser
+        user = self._users.find_one({"_id": username}, model_projection(view))
 
         if user is None:
             raise UserNotFoundException()
 
-        pydantic_user = User(
-            username=user["_id"], email=user["email"], password=user["password"]
-        )
+        return user_from_document(user, view)
 
-        return pydantic_user
+    def read_users(
+        self, usernames: List[str], view: Type[PublicUser] = User
+    ) -> List[PublicUser]:
+        # one round trip; order is preserved and unknown (deleted) users skipped
+        cursor = self._users.find({"_id": {"$in": usernames}}, model_projection(view))
+        found = {u["_id"]: u for u in cursor}
+        return [
+            user_from_document(found[name], view) for name in usernames if name in found
+        ]
 
     def update_user(self, new_user):
-
-        # check if user in db; potentially throws UserNotFoundException
-        self.read_user(new_user.username)
-
-        return self._users.replace_one(
+        response = self._users.replace_one(
             {"_id": new_user.username}, jsonable_encoder(new_user)
         )
+        if response.matched_count == 0:
+            raise UserNotFoundException()
 
-    def delete_user(self, username):
-
-        # trigger to delete all posts of user
-        posts = self.read_posts_of_user(username)
+        return response
 
-        for p in posts:
-            self._posts.delete_one({"_id": p.post_id})
+    def delete_user(self, username):
 
-        # trigger to delete all comments of user
-        comments = self.read_comments_of_user(username)
+        # check if user in db; possibly throws user not found exception
+        self._check_users_exist(username)
+
+        with self._transaction() as session:
+            # trigger to update counters of posts the user commented on or liked
+            for collection, counter in (
+                (self._comments, "number_of_comments"),
+                (self._likes, "like_count"),
+            ):
+                counts = collection.aggregate(
+                    counts_per_post_pipeline(username), session=session
+                )
+                for ops in chunked(
+                    decrement_counters(username, counts, counter), CASCADE_BATCH_SIZE
+                ):
+                    self._posts.bulk_write(ops, ordered=False, session=session)
+
+            # trigger to delete all comments and likes of user and on posts of user
+            self._comments.delete_many({"username": username}, session=session)
+            self._likes.delete_many({"username": username}, session=session)
+
+            post_ids = (
+                p["_id"]
+                for p in self._posts.find(
+                    {"username": username}, {"_id": 1}, session=session
+                )
+            )
+            for chunk in chunked(post_ids, CASCADE_BATCH_SIZE):
+                self._comments.delete_many({"post_id": {"$in": chunk}}, session=session)
+                self._likes.delete_many({"post_id": {"$in": chunk}}, session=session)
+
+            # trigger to remove user from the follow graph and all timelines
+            self._follows.delete_many(
+                {"$or": [{"follower": username}, {"followee": username}]},
+                session=session,
+            )
+            self._timelines.delete_many({"owner": username}, session=session)
+            self._timelines.delete_many({"author": username}, session=session)
 
-        for c in comments:
-            self._comments.delete_one({"_id": c.comment_id})
+            # trigger to delete all posts of user
+            self._posts.delete_many({"username": username}, session=session)
 
-        response = self._users.delete_one({"_id": username})
-
-        return response
+            return self._users.delete_one({"_id": username}, session=session)
 
     # =====================# POSTS #=====================#
 
     def create_new_post(self, post: Post):
 
         # check if user in db
-        self.read_user(post.username)
+        self._check_users_exist(post.username)
 
-        post_json = jsonable_encoder(post)
-        return self._posts.insert_one(post_json)
+        post_json = encode_with_tags(post)
+        response = self._posts.insert_one(post_json)
 
-    def read_posts_of_user(self, username: str):
-        # check if user in db; possibly throws user not found exception
-        self.read_user(username)
-
-        all_posts = list(self._posts.find({"username": username}))
-        post_list = [
-            Post(
-                post_id=r["_id"],
-                username=r["username"],
-                timestamp=r["timestamp"],
-                content=r["content"],
-                likes=r["likes"],
-                number_of_comments=r["number_of_comments"],
-            )
-            for r in all_posts
-        ]
-        return post_list
+        self._fan_out(post_json)
+        return response
+
+    def read_posts_of_user(
+        self,
+        username: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        raw: bool = False,
+    ):
+        # newest first; without a limit all posts of the user are returned
+        query = keyset_filter({"username": username}, after, descending=True)
+        cursor = self._posts.find(query, projection(POST_FIELDS))
+        posts = list(cursor.sort(keyset_sort(descending=True)).limit(limit or 0))
+        if not posts:
+            # only an empty page tells apart unknown users; possibly throws
+            # user not found exception
+            self._check_users_exist(username)
+
+        if raw:
+            return posts
+        return [post_from_document(r) for r in posts]
 
     def read_post(self, post_id: str):
-        post = self._posts.find_one({"_id": post_id})
+        post = self._posts.find_one({"_id": post_id}, projection(POST_FIELDS))
 
         if post is None:
             raise PostNotFoundException()
 
-        pydantic_post = Post(
-            post_id=post["_id"],
-            username=post["username"],
-            timestamp=post["timestamp"],
-            content=post["content"],
-            likes=post["likes"],
-            number_of_comments=post["number_of_comments"],
-        )
+        return post_from_document(post)
+
+    def read_post_detail(
+        self,
+        post_id: str,
+        comments_limit: int = DETAIL_COMMENTS_LIMIT,
+        raw: bool = False,
+    ):
+        # post and first comment page in one round trip, see services/detail.py
+        pipeline = post_detail_pipeline(post_id, comments_limit)
+        documents = list(self._posts.aggregate(pipeline))
+        if not documents:
+            raise PostNotFoundException()
 
-        return pydantic_post
+        detail = documents[0]
+        if raw:
+            return detail
+        return PostDetail(
+            post=post_from_document(detail),
+            comments=[comment_from_document(c) for c in detail["comments"]],
+        )
 
-    def read_recent_posts(self, count=10) -> List[Post]:
-        posts = list(self._posts.find().sort("timestamp", -1).limit(count))
+    def read_recent_posts(
+        self, count=10, after: Optional[str] = None, raw: bool = False
+    ) -> List[Post]:
+        # https://stackoverflow.com/questions/24501756/sort-mongodb-documents-by-timestamp-in-desc-order
+        query = keyset_filter({}, after, descending=True)
+        cursor = self._posts.find(query, projection(POST_FIELDS))
+        posts = list(cursor.sort(keyset_sort(descending=True)).limit(count))
         if not posts:
             raise PostNotFoundException()
 
-        pydantic_posts = [
-            Post(
-                post_id=post["_id"],
-                username=post["username"],
-                timestamp=post["timestamp"],
-                content=post["content"],
-                likes=post["likes"],
-                number_of_comments=post["number_of_comments"],
-            )
-            for post in posts
-        ]
-
-        return pydantic_posts
-
-        # https://stackoverflow.com/questions/24501756/sort-mongodb-documents-by-timestamp-in-desc-order
+        # raw returns the documents themselves, for serialization.documents_to_json
+        if raw:
+            return posts
+        return [post_from_document(post) for post in posts]
 
     def update_post(self, new_post):
-        # verify that username does not change
-        return self._posts.replace_one(
-            {"_id": new_post.post_id}, jsonable_encoder(new_post)
+        # only the content is editable; a replace would reset the counters
+        # maintained by concurrent $inc updates
+        return self._posts.update_one(
+            {"_id": new_post.post_id}, {"$set": content_with_tags(new_post)}
         )
 
     def delete_post(self, post_id):
+        with self._transaction() as session:
+            # trigger to delete all comments and likes of post
+            self._comments.delete_many({"post_id": post_id}, session=session)
+            self._likes.delete_many({"post_id": post_id}, session=session)
 
-        # trigger to delete all comments of post
-        comments = self.read_comments_of_post(post_id)
+            # trigger to remove post from all timelines
+            self._timelines.delete_many({"post_id": post_id}, session=session)
 
-        for c in comments:
-            self._comments.delete_one({"_id": c.comment_id})
+            # the cascade is a no-op for unknown posts; aborted with a transaction
+            response = self._posts.delete_one({"_id": post_id}, session=session)
+            if response.deleted_count == 0:
+                raise PostNotFoundException()
 
-        response = self._posts.delete_one({"_id": post_id})
+            return response
+
+    def like_post(self, post_id: str, username: str):
+        # check if user in db; possibly throws user not found exception
+        self._check_users_exist(username)
+
+        with self._transaction() as session:
+            # a repeated like matches the existing document and inserts nothing
+            response = self._likes.update_one(
+                {"post_id": post_id, "username": username},
+                {
+                    "$setOnInsert": {
+                        "_id": uuid.uuid4().hex,
+                        "timestamp": jsonable_encoder(datetime.utcnow()),
+                    }
+                },
+                upsert=True,
+                session=session,
+            )
+            if response.upserted_id is None:
+                return response
+
+            # the counter update doubles as the existence check of the post
+            updated = self._posts.update_one(
+                {"_id": post_id}, {"$inc": {"like_count": 1}}, session=session
+            )
+            if updated.matched_count == 0:
+                if session is None:
+                    self._likes.delete_one({"_id": response.upserted_id})
+                raise PostNotFoundException()
 
         return response
 
+    def unlike_post(self, post_id: str, username: str):
+        with self._transaction() as session:
+            response = self._likes.delete_one(
+                {"post_id": post_id, "username": username}, session=session
+            )
+            if response.deleted_count:
+                self._posts.update_one(
+                    {"_id": post_id}, {"$inc": {"like_count": -1}}, session=session
+                )
+
+        if response.deleted_count == 0:
+            # possibly throws post_not_found exception
+            self._check_posts_exist(post_id)
+
+        return response
+
+    def read_likes_of_post(
+        self, post_id: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> List[Like]:
+        # oldest first, like comment sections
+        query = keyset_filter({"post_id": post_id}, after, descending=False)
+        cursor = self._likes.find(query, model_projection(Like))
+        cursor = cursor.sort(keyset_sort(descending=False))
+        likes = list(cursor.limit(limit or 0))
+        if not likes:
+            # possibly throws post_not_found exception
+            self._check_posts_exist(post_id)
+
+        return [Like(**like) for like in likes]
+
+    # Existence checks read the _id index only. Listing reads skip them unless
+    # the page is empty, and writes use the result of the write where possible.
+
+    def _check_users_exist(self, *usernames: str):
+        usernames = set(usernames)
+        query = {"_id": {"$in": list(usernames)}}
+        if self._users.count_documents(query) < len(usernames):
+            raise UserNotFoundException()
+
+    def _check_posts_exist(self, *post_ids: str):
+        post_ids = set(post_ids)
+        query = {"_id": {"$in": list(post_ids)}}
+        if self._posts.count_documents(query) < len(post_ids):
+            raise PostNotFoundException()
+
     # =====================# COMMENTS #=====================#
 
     def create_new_comment(self, comment: Comment):
-        # add that post and user must exist
+        # check if user in db; possibly throws user not found exception
+        self._check_users_exist(comment.username)
 
-        # check if user and post in db
-        self.read_user(comment.username)
-        self.read_post(comment.post_id)
+        comment_json = encode_with_tags(comment)
+        with self._transaction() as session:
+            response = self._comments.insert_one(comment_json, session=session)
 
-        comment_json = jsonable_encoder(comment)
-        return self._comments.insert_one(comment_json)
+            # the counter update doubles as the existence check of the post
+            updated = self._posts.update_one(
+                {"_id": comment.post_id},
+                {"$inc": {"number_of_comments": 1}},
+                session=session,
+            )
+            if updated.matched_count == 0:
+                if session is None:
+                    self._comments.delete_one({"_id": comment.comment_id})
+                raise PostNotFoundException()
+
+        return response
 
     def read_comment(self, comment_id: str):
-        response = list(self._comments.find({"_id": comment_id}))
+        response = list(
+            self._comments.find({"_id": comment_id}, projection(COMMENT_FIELDS))
+        )
 
         if not response:
             raise CommentNotFoundException()
 
-        r = response.pop()
+        return comment_from_document(response.pop())
+
+    def read_comments_of_post(
+        self,
+        post_id: str,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        raw: bool = False,
+    ):
+        # oldest first; without a limit the whole comment section is returned
+        query = keyset_filter({"post_id": post_id}, after, descending=False)
+        cursor = self._comments.find(query, projection(COMMENT_FIELDS))
+        comments = list(cursor.sort(keyset_sort(descending=False)).limit(limit or 0))
+        if not comments:
+            # possibly throws post_not_found exception
+            self._check_posts_exist(post_id)
+
+        if raw:
+            return comments
+        return [comment_from_document(r) for r in comments]
+
+    def read_comments_of_user(self, username: str):
+        response = list(
+            self._comments.find({"username": username}, projection(COMMENT_FIELDS))
+        )
+
+        return [comment_from_document(r) for r in response]
+
+    def update_comment(self, new_comment):
+        return self._comments.replace_one(
+            {"_id": new_comment.comment_id}, encode_with_tags(new_comment)
+        )
+
+    def delete_comment(self, comment_id):
+        # check if comment exists; the post is needed to update its counter
+        comment = self._comments.find_one({"_id": comment_id}, {"post_id": 1})
+        if comment is None:
+            raise CommentNotFoundException()
+
+        with self._transaction() as session:
+            response = self._comments.delete_one({"_id": comment_id}, session=session)
+            if response.deleted_count:
+                self._posts.update_one(
+                    {"_id": comment["post_id"]},
+                    {"$inc": {"number_of_comments": -1}},
+                    session=session,
+                )
+
+        return response
+
+    # =====================# FOLLOWS #=====================#
+
+    def follow_user(self, follower: str, followee: str):
+        # check if both users in db; possibly throws user not found exception
+        self._check_users_exist(follower, followee)
 
-        return Comment(
-            comment_id=r["_id"],
-            post_id=r["post_id"],
-            username=r["username"],
-            timestamp=r["timestamp"],
-            content=r["content"],
+        response = self._follows.update_one(
+            {"follower": follower, "followee": followee},
+            {"$setOnInsert": {"timestamp": datetime.utcnow(), "pull": False}},
+            upsert=True,
         )
+        if response.upserted_id is None:
+            return response  # already following
 
-    def read_comments_of_post(self, post_id: str):
-        # check if post exists; possibly throws post_not_found exception
-        self.read_post(post_id)
-
-        response = list(self._comments.find({"post_id": post_id}))
-        comment_list = [
-            Comment(
-                comment_id=r["_id"],
-                post_id=r["post_id"],
-                username=r["username"],
-                timestamp=r["timestamp"],
-                content=r["content"],
+        followers = self._follows.count_documents(
+            {"followee": followee}, limit=self._fan_out_limit + 1
+        )
+        if followers > self._fan_out_limit:
+            # posts of followee are merged into timelines on read from now on
+            self._follows.update_many(
+                {"followee": followee, "pull": False}, {"$set": {"pull": True}}
+            )
+        else:
+            recent_posts = (
+                self._posts.find({"username": followee})
+                .sort(keyset_sort(descending=True))
+                .limit(BACKFILL_SIZE)
+            )
+            self._insert_timeline_entries(
+                [timeline_entry(follower, p) for p in recent_posts]
             )
-            for r in response
-        ]
-        return comment_list
 
-    def read_comments_of_user(self, username: str):
-        response = list(self._comments.find({"username": username}))
-
-        comment_list = [
-            Comment(
-                comment_id=r["_id"],
-                post_id=r["post_id"],
-                username=r["username"],
-                timestamp=r["timestamp"],
-                content=r["content"],
+        return response
+
+    def unfollow_user(self, follower: str, followee: str):
+        response = self._follows.delete_one(
+            {"follower": follower, "followee": followee}
+        )
+        if response.deleted_count == 0:
+            raise FollowNotFoundException()
+
+        self._timelines.delete_many({"owner": follower, "author": followee})
+        return response
+
+    def read_timeline(
+        self, username: str, limit: int = 20, after: Optional[str] = None
+    ) -> List[Post]:
+        query = keyset_filter({"owner": username}, after, True, id_field="post_id")
+        entries = list(
+            self._timelines.find(query, TIMELINE_ENTRY_PROJECTION)
+            .sort(keyset_sort(descending=True, id_field="post_id"))
+            .limit(limit)
+        )
+
+        # accounts with too many followers to fan out are merged in on read
+        pulled = [
+            f["followee"]
+            for f in self._follows.find(
+                {"follower": username, "pull": True}, {"followee": 1}
             )
-            for r in response
         ]
+        pulled_posts = []
+        if pulled:
+            query = keyset_filter({"username": {"$in": pulled}}, after, True)
+            cursor = self._posts.find(query, projection(POST_FIELDS))
+            pulled_posts = list(cursor.sort(keyset_sort(descending=True)).limit(limit))
+
+        if not entries and not pulled_posts:
+            # possibly throws user not found exception
+            self._check_users_exist(username)
+
+        post_ids = merge_timeline(entries, pulled_posts, limit)
+        posts = {p["_id"]: p for p in pulled_posts}
+        missing = [post_id for post_id in post_ids if post_id not in posts]
+        if missing:
+            cursor = self._posts.find(
+                {"_id": {"$in": missing}}, projection(POST_FIELDS)
+            )
+            posts.update((p["_id"], p) for p in cursor)
 
-        return comment_list
+        return [post_from_document(posts[i]) for i in post_ids if i in posts]
 
-    def update_comment(self, new_comment):
-        return self._comments.replace_one(
-            {"_id": new_comment.comment_id}, jsonable_encoder(new_comment)
+    def _fan_out(self, post: dict):
+        # author and all followers which are not served by fan-out on read
+        followers = self._follows.find(
+            {"followee": post["username"], "pull": False}, {"follower": 1}
         )
+        owners = chain([post["username"]], (f["follower"] for f in followers))
+
+        for chunk in chunked(owners, FAN_OUT_BATCH_SIZE):
+            self._insert_timeline_entries([timeline_entry(o, post) for o in chunk])
+
+    def _insert_timeline_entries(self, entries: List[dict]):
+        if entries:
+            # entries already in the timeline (e.g. backfilled) are skipped
+            self._insert_unordered(self._timelines, entries)
+
+    def _insert_unordered(self, collection, documents: List[dict]) -> List[dict]:
+        # returns the inserted documents; duplicates are skipped
+        try:
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            return inserted_documents(documents, e)
+        return documents
+
+    # =====================# SEARCH #=====================#
+
+    def search_posts(
+        self, q: str, limit: int = 20, after: Optional[str] = None, raw: bool = False
+    ):
+        posts = self._search(self._posts, POST_FIELDS, q, limit, after)
+        if raw:
+            return posts
+        return [post_from_document(post) for post in posts]
+
+    def search_comments(
+        self, q: str, limit: int = 20, after: Optional[str] = None, raw: bool = False
+    ):
+        comments = self._search(self._comments, COMMENT_FIELDS, q, limit, after)
+        if raw:
+            return comments
+        return [comment_from_document(comment) for comment in comments]
+
+    def _search(self, collection, fields, q: str, limit: int, after: Optional[str]):
+        query = parse_query(q)
+        if query.text:
+            # ranked by relevance; the documents carry their text score
+            pipeline = text_search_pipeline(query, projection(fields), limit, after)
+            return list(collection.aggregate(pipeline))
+
+        conditions = tag_filter(query)
+        if not conditions:
+            return []
+
+        # tags only: exact matches on the tag indexes, newest first
+        query = keyset_filter(conditions, after, descending=True)
+        cursor = collection.find(query, projection(fields))
+        return list(cursor.sort(keyset_sort(descending=True)).limit(limit))
+
+    # =====================# EXPORT #=====================#
+
+    def export_posts_of_user(
+        self, username: str, batch_size: int = EXPORT_BATCH_SIZE
+    ) -> Iterator[List[dict]]:
+        """Yields all posts of a user in batches, newest first."""
+        cursor = self._posts.find({"username": username}, projection(POST_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=True)).batch_size(batch_size)
+        return chunked(cursor, batch_size)
+
+    def export_comments_of_posts(
+        self, post_ids: List[str], batch_size: int = EXPORT_BATCH_SIZE
+    ) -> Iterator[List[dict]]:
+        """Yields the comment sections of the posts in batches, oldest first."""
+        query = {"post_id": {"$in": post_ids}}
+        cursor = self._comments.find(query, projection(COMMENT_FIELDS))
+        cursor = cursor.sort(keyset_sort(descending=False)).batch_size(batch_size)
+        return chunked(cursor, batch_size)
+
+    # =====================# BULK #=====================#
+
+    def bulk_insert_users(
+        self, users: Iterable[User], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        inserted = 0
+        for chunk in chunked(map(jsonable_encoder, users), batch_size):
+            inserted += len(self._insert_unordered(self._users, chunk))
+        return inserted
+
+    def bulk_insert_posts(
+        self, posts: Iterable[Post], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        # the authors are not checked; see services.bulk
+        inserted = 0
+        for chunk in chunked(map(encode_with_tags, posts), batch_size):
+            documents = self._insert_unordered(self._posts, chunk)
+            self._bulk_fan_out(documents)
+            inserted += len(documents)
+        return inserted
+
+    def bulk_insert_comments(
+        self, comments: Iterable[Comment], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        # neither authors nor posts are checked; see services.bulk
+        inserted = 0
+        for chunk in chunked(map(encode_with_tags, comments), batch_size):
+            documents = self._insert_unordered(self._comments, chunk)
+            if documents:
+                self._posts.bulk_write(
+                    increment_comment_counters(documents), ordered=False
+                )
+            inserted += len(documents)
+        return inserted
+
+    def bulk_insert_likes(
+        self, likes: Iterable[Like], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        # neither users nor posts are checked; see services.bulk
+        inserted = 0
+        for chunk in chunked(map(jsonable_encoder, likes), batch_size):
+            documents = self._insert_unordered(self._likes, chunk)
+            if documents:
+                self._posts.bulk_write(
+                    increment_like_counters(documents), ordered=False
+                )
+            inserted += len(documents)
+        return inserted
+
+    def _bulk_fan_out(self, posts: List[dict]):
+        authors = list({p["username"] for p in posts})
+        cursor = self._follows.find(
+            {"followee": {"$in": authors}, "pull": False},
+            {"_id": 0, "follower": 1, "followee": 1},
+        )
+        followers = defaultdict(list)
+        for f in cursor:
+            followers[f["followee"]].append(f["follower"])
 
-    def delete_comment(self, comment_id):
-        self.read_comment(comment_id)  # check if comment exists
-
-        return self._comments.delete_one({"_id": comment_id})
+        entries = timeline_entries(posts, followers)
+        for chunk in chunked(entries, FAN_OUT_BATCH_SIZE):
+            self._insert_timeline_entries(chunk)
@@ -0,0 +1,45 @@
+from typing import List
+
+import orjson
+
+from owntwitter.services.profiling import timed
+from owntwitter.services.serialization import COMMENT_FIELDS, POST_FIELDS, projection
+
+# The detail of a post, i.e. the post with its counters and the first page of
+# its comment section, is read with a single aggregation instead of one query
+# per part. A missing post yields no document at all.
+
+DETAIL_COMMENTS_LIMIT = 20
+
+
+def post_detail_pipeline(post_id: str, comments_limit: int) -> List[dict]:
+    return [
+        {"$match": {"_id": post_id}},
+        {"$project": projection(POST_FIELDS)},
+        {
+            "$lookup": {
+                "from": "comments",
+                "let": {"post_id": "$_id"},
+                # oldest first, as read_comments_of_post; uses the
+                # (post_id, timestamp, _id) index
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$post_id", "$$post_id"]}}},
+                    {"$sort": {"timestamp": 1, "_id": 1}},
+                    {"$limit": comments_limit},
+                    {"$project": projection(COMMENT_FIELDS)},
+                ],
+                "as": "comments",
+            }
+        },
+    ]
+
+
+@timed("serialization")
+def post_detail_to_json(detail: dict) -> bytes:
+    # detail is the document returned by post_detail_pipeline
+    post = {name: detail.get(name, default) for name, default in POST_FIELDS.items()}
+    comments = [
+        {name: c.get(name, default) for name, default in COMMENT_FIELDS.items()}
+        for c in detail["comments"]
+    ]
+    return orjson.dumps({"post": post, "comments": comments})
@@ -0,0 +1,153 @@
+import asyncio
+import contextlib
+import logging
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterator, Optional, Set
+
+import orjson
+from pymongo.errors import OperationFailure, PyMongoError
+
+from owntwitter.services.async_db import AsyncDatabaseConnector
+from owntwitter.services.serialization import COMMENT_FIELDS, POST_FIELDS
+
+# New posts and comments are pushed to clients as server-sent events instead
+# of being polled. Every worker broadcasts to its subscribers through an
+# EventBus. With a change stream (which needs a replica set) the inserts of all
+# workers and tools reach the bus; otherwise the endpoints publish their own
+# writes, and subscribers only see the writes of the worker they are
+# connected to.
+
+logger = logging.getLogger(__name__)
+
+FEED_TOPIC = "feed"
+
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+# the oplog no longer holds the resume token, e.g. after a long outage
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+def comments_topic(post_id: str) -> str:
+    return f"comments:{post_id}"
+
+
+def sse_message(event: str, data: dict) -> bytes:
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), orjson.dumps(data))
+
+
+class EventBus:
+    """Broadcasts encoded events to the subscribers of a topic."""
+
+    def __init__(self, queue_size: int = 100, from_writes: bool = True):
+        self._queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        # whether endpoints publish their writes, i.e. there is no change stream
+        self.from_writes = from_writes
+
+    @contextlib.contextmanager
+    def subscribe(self, topic: str) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(self._queue_size)
+        self._subscribers[topic].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[topic].discard(queue)
+            if not self._subscribers[topic]:
+                del self._subscribers[topic]
+
+    def subscribers(self, topic: str) -> int:
+        return len(self._subscribers.get(topic, ()))
+
+    def publish(self, topic: str, message: bytes):
+        # encoded once, whatever the number of subscribers
+        for queue in self._subscribers.get(topic, ()):
+            if queue.full():
+                # slow clients miss their oldest events instead of blocking others
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def publish_document(self, collection: str, document: dict):
+        if collection == "posts":
+            post = {name: document.get(name, d) for name, d in POST_FIELDS.items()}
+            self.publish(FEED_TOPIC, sse_message("post", post))
+        elif collection == "comments":
+            comment = {
+                name: document.get(name, d) for name, d in COMMENT_FIELDS.items()
+            }
+            topic = comments_topic(comment["post_id"])
+            self.publish(topic, sse_message("comment", comment))
+
+    def publish_write(self, collection: str, document: dict):
+        """Publishes a write of an endpoint, unless a change stream does."""
+        if self.from_writes:
+            self.publish_document(collection, document)
+
+
+async def event_stream(
+    bus: EventBus, topic: str, keepalive: float
+) -> AsyncIterator[bytes]:
+    """The body of a text/event-stream response; ends when the client leaves."""
+    with bus.subscribe(topic) as queue:
+        # sent right away, so that clients know they are subscribed
+        yield b": subscribed\n\n"
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                # keeps proxies from closing idle connections
+                yield b": keepalive\n\n"
+
+
+class ChangeStreamPublisher:
+    """Publishes the posts and comments inserted by any worker."""
+
+    def __init__(
+        self, db: AsyncDatabaseConnector, bus: EventBus, retry_seconds: float = 1.0
+    ):
+        self._db = db
+        self._bus = bus
+        self._retry_seconds = retry_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        # writes stay published by the request until the stream is confirmed
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            # a failed publisher must not keep the rest of the app from closing
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception("change stream publisher failed")
+
+    def _opened(self):
+        self._bus.from_writes = False
+
+    async def _run(self):
+        resume_after = None
+        while True:
+            try:
+                async for change in self._db.watch_inserts(
+                    resume_after, on_open=self._opened
+                ):
+                    resume_after = change["_id"]
+                    self._bus.publish_document(
+                        change["ns"]["coll"], change["fullDocument"]
+                    )
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("change streams unavailable; publishing writes")
+                    self._bus.from_writes = True
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    # the missed inserts are lost; restart from the present
+                    resume_after = None
+                logger.exception("change stream failed; restarting")
+                await asyncio.sleep(self._retry_seconds)
+            except PyMongoError:
+                logger.exception("change stream interrupted; resuming")
+                await asyncio.sleep(self._retry_seconds)
@@ -0,0 +1,41 @@
+import zlib
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Optional
+
+import orjson
+
+from owntwitter.models.models import PrivateUser
+from owntwitter.services.profiling import timed
+from owntwitter.services.serialization import model_projection
+
+# Exports are newline delimited json, one document per line, and are produced
+# one cursor batch at a time, so memory use does not grow with the size of an
+# account. Archives mix several kinds of documents; there every line names its
+# kind in "type".
+
+EXPORT_BATCH_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+USER_FIELDS = dict.fromkeys(model_projection(PrivateUser))
+
+
+@timed("serialization")
+def ndjson(
+    documents: Iterable[dict], fields: Dict[str, object], kind: Optional[str] = None
+) -> bytes:
+    lines = []
+    for document in documents:
+        record = {"type": kind} if kind is not None else {}
+        for name, default in fields.items():
+            record[name] = document.get(name, default)
+        lines.append(orjson.dumps(record) + b"\n")
+    return b"".join(lines)
+
+
+async def gzip_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Compresses a stream on the fly into a single gzip member."""
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+
+class FeedPage(NamedTuple):
+    """A serialized feed page as stored in the cache."""
+
+    body: bytes  # json encoded list of posts
+    next_cursor: Optional[str]
+    etag: str
+
+    @classmethod
+    def create(cls, body: bytes, next_cursor: Optional[str]) -> "FeedPage":
+        # hashed once when the page is loaded, not on every request
+        return cls(
+            body, next_cursor, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        )
+
+    def encode(self) -> bytes:
+        # etags and cursors (url safe base64) never contain a newline
+        return b"\n".join(
+            [self.etag.encode(), (self.next_cursor or "").encode(), self.body]
+        )
+
+    @classmethod
+    def decode(cls, value: bytes) -> "FeedPage":
+        etag, next_cursor, body = value.split(b"\n", 2)
+        return cls(body, next_cursor.decode() or None, etag.decode())
+
+
+# Values written with set_if_newer start with their version and a newline; a
+# value only replaces one with a lower version.
+SET_IF_NEWER_SCRIPT = """
+local current = redis.call("GET", KEYS[1])
+if current and tonumber(string.match(current, "^%d+")) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[2], "PX", ARGV[3])
+return 1
+"""
+
+
+def _version(value: bytes) -> int:
+    return int(value.split(b"\n", 1)[0])
+
+
+class InMemoryCacheBackend:
+    """Cache backend of a single process; also the stand-in for redis in tests."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._values: Dict[str, Tuple[float, bytes]] = {}
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._values.get(key)
+        if entry is None or entry[0] < self._clock():
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._values[key] = (self._clock() + ttl, value)
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def set_if_newer(self, key: str, value: bytes, ttl: float) -> bool:
+        current = await self.get(key)
+        if current is not None and _version(current) >= _version(value):
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        self._counters[key] = self._counters.get(key, 0) + amount
+        return self._counters[key]
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def close(self):
+        self._values.clear()
+        self._counters.clear()
+
+
+class RedisCacheBackend:
+    """Cache backend shared by all workers, talking to any redis compatible server."""
+
+    def __init__(self, url: str):
+        # optional dependency, only needed when a shared cache is configured
+        from redis.asyncio import Redis
+
+        self._redis = Redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._redis.set(key, value, px=int(ttl * 1000))
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self._redis.set(key, value, px=int(ttl * 1000), nx=True))
+
+    async def set_if_newer(self, key: str, value: bytes, ttl: float) -> bool:
+        stored = await self._redis.eval(
+            SET_IF_NEWER_SCRIPT, 1, key, _version(value), value, int(ttl * 1000)
+        )
+        return bool(stored)
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        return await self._redis.incrby(key, amount)
+
+    async def delete(self, key: str):
+        await self._redis.delete(key)
+
+    async def close(self):
+        await self._redis.close()
+
+
+class FeedCache:
+    """Caches the first feed page and coalesces concurrent misses.
+
+    Within a worker, concurrent misses wait for one load. Across workers, the
+    worker holding the lock key loads the page while the others poll the
+    backend for it, so a miss under load costs one mongo query.
+    """
+
+    KEY = "feed:first-page"
+    LOCK_KEY = "feed:first-page:lock"
+    # bumped by every refresh; a page loaded earlier never replaces a later one
+    VERSION_KEY = "feed:first-page:version"
+
+    def __init__(
+        self,
+        backend,
+        ttl: float,
+        lock_timeout: float = 2.0,
+        poll_interval: float = 0.05,
+    ):
+        self._backend = backend
+        self._ttl = ttl
+        self._lock_timeout = lock_timeout
+        self._poll_interval = poll_interval
+        self._loading: Optional[asyncio.Future] = None
+
+    async def get(self, load: Callable[[], Awaitable[FeedPage]]) -> FeedPage:
+        value = await self._backend.get(self.KEY)
+        if value is not None:
+            return _decode(value)
+
+        if self._loading is not None:
+            return await asyncio.shield(self._loading)
+
+        loading = self._loading = asyncio.get_running_loop().create_future()
+        try:
+            page = await self._load_once(load)
+            loading.set_result(page)
+            return page
+        except Exception as e:
+            loading.set_exception(e)
+            loading.exception()  # raised by the waiters; not left unretrieved
+            raise
+        finally:
+            self._loading = None
+
+    async def close(self):
+        await self._backend.close()
+
+    async def refresh(self, load: Callable[[], Awaitable[FeedPage]]) -> FeedPage:
+        # after a write; must not reuse a load which may have started before it
+        version = await self._backend.incr(self.VERSION_KEY)
+        return await self._store(load, version)
+
+    async def _store(self, load, version: int) -> FeedPage:
+        # the version is taken before loading; a concurrent refresh that
+        # started later and finished first keeps its (newer) page
+        page = await load()
+        value = b"%d\n" % version + page.encode()
+        await self._backend.set_if_newer(self.KEY, value, self._ttl)
+        return page
+
+    async def _load_once(self, load) -> FeedPage:
+        if await self._backend.set_if_absent(self.LOCK_KEY, b"1", self._lock_timeout):
+            try:
+                version = await self._backend.incr(self.VERSION_KEY, 0)
+                return await self._store(load, version)
+            finally:
+                await self._backend.delete(self.LOCK_KEY)
+
+        # another worker is loading the page
+        deadline = time.monotonic() + self._lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self._poll_interval)
+            value = await self._backend.get(self.KEY)
+            if value is not None:
+                return _decode(value)
+
+        return await self.refresh(load)
+
+
+def _decode(value: bytes) -> FeedPage:
+    # strips the version, see set_if_newer
+    return FeedPage.decode(value.split(b"\n", 1)[1])
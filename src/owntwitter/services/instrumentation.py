@@ -0,0 +1,377 @@
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Dict, Optional, Set, Tuple
+
+import bson
+from pymongo import MongoClient, monitoring
+
+from owntwitter.services import profiling
+from owntwitter.services.migrations import winning_plan_indexes
+
+# Every command sent by the sync or async connector is timed by a pymongo
+# command listener and attributed to the (outermost) connector method that
+# issued it. The totals are exported in the prometheus text format, and
+# commands slower than Settings.slow_query_ms are logged with the shape of
+# their filter and the indexes of their winning plan.
+
+logger = logging.getLogger(__name__)
+
+# connector method currently running in this task or thread
+current_method: ContextVar[Optional[str]] = ContextVar("current_method", default=None)
+
+# upper bounds of the duration histogram, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete"}
+
+# fields the driver adds to commands, removed before explaining them
+DRIVER_FIELDS = {"$db", "lsid", "$clusterTime", "txnNumber", "$readPreference"}
+
+# slow queries of one shape are explained once per interval, and at most a few
+# explains wait at a time, so a latency spike does not pile up explains
+EXPLAIN_TTL_SECONDS = 300.0
+MAX_PENDING_EXPLAINS = 4
+
+
+def instrumented(cls):
+    """Class decorator attributing the commands of public methods to them."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not callable(method):
+            continue
+        setattr(cls, name, _attributed(name, method))
+    return cls
+
+
+def _attributed(name: str, method):
+    if asyncio.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            if current_method.get() is not None:
+                return await method(*args, **kwargs)
+            token = current_method.set(name)
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                current_method.reset(token)
+
+        return async_wrapper
+
+    if inspect.isasyncgenfunction(method):
+
+        @functools.wraps(method)
+        async def async_generator_wrapper(*args, **kwargs):
+            # the generator runs in the context of its consumer, so the method
+            # is only set while a batch is being produced
+            generator = method(*args, **kwargs)
+            try:
+                while True:
+                    token = None
+                    if current_method.get() is None:
+                        token = current_method.set(name)
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        if token is not None:
+                            current_method.reset(token)
+                    yield item
+            finally:
+                await generator.aclose()
+
+        return async_generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if current_method.get() is not None:
+            return method(*args, **kwargs)
+        token = current_method.set(name)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            current_method.reset(token)
+
+    return wrapper
+
+
+def query_shape(value):
+    """The filter with its values replaced, e.g. {"post_id": {"$in": "?"}}."""
+    if isinstance(value, dict):
+        return {key: query_shape(v) for key, v in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [query_shape(v) for v in value]
+    return "?"
+
+
+def command_filter(command_name: str, command: dict):
+    if command_name == "aggregate":
+        return [stage for stage in command.get("pipeline", []) if "$match" in stage]
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        return statements[0].get("q")
+    return command.get("filter", command.get("query"))
+
+
+def returned_documents(reply: dict) -> int:
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    return reply.get("n", 0)
+
+
+class CommandStats:
+    __slots__ = ("count", "failures", "seconds", "documents", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.documents = 0
+        self.bytes = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class QueryMetrics:
+    """Totals per connector method, command and collection of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str, str], CommandStats] = defaultdict(
+            CommandStats
+        )
+
+    def record(
+        self,
+        key: Tuple[str, str, str],
+        seconds: float,
+        documents: int = 0,
+        size: int = 0,
+        failed: bool = False,
+    ):
+        with self._lock:
+            stats = self._stats[key]
+            stats.count += 1
+            stats.failures += failed
+            stats.seconds += seconds
+            stats.documents += documents
+            stats.bytes += size
+            for idx, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[idx] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, str, str], CommandStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP mongo_command_duration_seconds Duration of mongo commands.",
+            "# TYPE mongo_command_duration_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        for key, stats in snapshot.items():
+            labels = _labels(key)
+            for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                lines.append(
+                    f'mongo_command_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                    f"{count}"
+                )
+            lines.append(
+                f'mongo_command_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                f"{stats.count}"
+            )
+            lines.append(
+                f"mongo_command_duration_seconds_sum{{{labels}}} {stats.seconds}"
+            )
+            lines.append(
+                f"mongo_command_duration_seconds_count{{{labels}}} {stats.count}"
+            )
+
+        for name, attribute, help_text in (
+            ("mongo_command_failures_total", "failures", "Failed mongo commands."),
+            (
+                "mongo_documents_returned_total",
+                "documents",
+                "Documents returned or written by mongo commands.",
+            ),
+            (
+                "mongo_reply_bytes_total",
+                "bytes",
+                "Size of the replies in bytes, if reply_bytes_enabled.",
+            ),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, stats in snapshot.items():
+                lines.append(f"{name}{{{_labels(key)}}} {getattr(stats, attribute)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Tuple[str, str, str]) -> str:
+    method, command, collection = key
+    return f'method="{method}",command="{command}",collection="{collection}"'
+
+
+class CommandInstrumentation(monitoring.CommandListener):
+    """Records the commands of a client in QueryMetrics and logs slow ones."""
+
+    def __init__(
+        self,
+        metrics: QueryMetrics,
+        slow_query_ms: float,
+        explain_host: Optional[str] = None,
+        reply_bytes: bool = False,
+    ):
+        self._metrics = metrics
+        self._slow_query_ms = slow_query_ms
+        self._explain_host = explain_host
+        # the size of a reply is only known by encoding it again
+        self._reply_bytes = reply_bytes
+        self._explain_client: Optional[MongoClient] = None
+        self._explainer = ThreadPoolExecutor(max_workers=1)
+        # plan summaries by query shape, with their expiry, and shapes queued
+        self._plans: Dict[tuple, Tuple[str, float]] = {}
+        self._pending_explains: Set[tuple] = set()
+        self._explain_lock = threading.Lock()
+
+        # commands in flight, by request id and connection
+        self._started: Dict[tuple, tuple] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        command = event.command
+        collection = command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = command.get("collection")
+        if not isinstance(collection, str):
+            collection = ""
+
+        self._started[(event.request_id, event.connection_id)] = (
+            current_method.get() or "",
+            collection,
+            command if event.command_name in EXPLAINABLE_COMMANDS else None,
+            # only the started event names the database
+            event.database_name,
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        started = self._started.pop((event.request_id, event.connection_id), None)
+        if started is None:
+            return
+        method, collection, command, database = started
+
+        seconds = event.duration_micros / 1e6
+        profiling.record("db", seconds)
+        self._metrics.record(
+            (method, event.command_name, collection),
+            seconds,
+            returned_documents(event.reply),
+            len(bson.encode(event.reply)) if self._reply_bytes else 0,
+        )
+
+        if seconds * 1000 >= self._slow_query_ms:
+            self._log_slow_query(event, method, collection, command, database, seconds)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        started = self._started.pop((event.request_id, event.connection_id), None)
+        if started is None:
+            return
+        method, collection, _, _ = started
+
+        seconds = event.duration_micros / 1e6
+        profiling.record("db", seconds)
+        self._metrics.record(
+            (method, event.command_name, collection), seconds, failed=True
+        )
+
+    def _log_slow_query(self, event, method, collection, command, database, seconds):
+        message = "slow query: %s %s.%s filter=%s took %.1f ms"
+        args = (
+            method or "-",
+            event.command_name,
+            collection,
+            query_shape(command_filter(event.command_name, command or {})),
+            seconds * 1000,
+        )
+        if command is None or self._explain_host is None:
+            logger.warning(message, *args)
+            return
+
+        shape = (database, event.command_name, collection, repr(args[3]))
+        with self._explain_lock:
+            plan, expires = self._plans.get(shape, (None, 0.0))
+            if plan is not None and expires > time.monotonic():
+                logger.warning(message + " plan=%s", *args, plan)
+                return
+            if (
+                shape in self._pending_explains
+                or len(self._pending_explains) >= MAX_PENDING_EXPLAINS
+            ):
+                logger.warning(message, *args)
+                return
+            self._pending_explains.add(shape)
+
+        # listeners must not run commands themselves; explain in the background
+        self._explainer.submit(self._explain, shape, database, command, message, args)
+
+    def _explain(
+        self, shape: tuple, database: str, command: dict, message: str, args: tuple
+    ):
+        try:
+            if self._explain_client is None:
+                self._explain_client = MongoClient(self._explain_host)
+            explained = {k: v for k, v in command.items() if k not in DRIVER_FIELDS}
+            output = self._explain_client[database].command(
+                {"explain": explained, "verbosity": "queryPlanner"}
+            )
+            indexes = winning_plan_indexes(output)
+            plan = ", ".join(indexes) if indexes else "COLLECTION SCAN"
+        except Exception as e:
+            plan = f"explain failed: {e}"
+
+        now = time.monotonic()
+        with self._explain_lock:
+            self._plans = {k: v for k, v in self._plans.items() if v[1] > now}
+            self._plans[shape] = (plan, now + EXPLAIN_TTL_SECONDS)
+            self._pending_explains.discard(shape)
+
+        logger.warning(message + " plan=%s", *args, plan)
+
+
+# shared by all clients of the process and exported at /metrics
+query_metrics = QueryMetrics()
+
+
+def cache_stats_to_prometheus(stats: Dict[str, dict]) -> str:
+    """Exports CachedAsyncDatabaseConnector.cache_stats()."""
+    lines = []
+    for name, kind in (
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+        ("size", "gauge"),
+    ):
+        metric = f"cache_{name}_total" if kind == "counter" else f"cache_{name}"
+        lines.append(f"# TYPE {metric} {kind}")
+        for cache, values in stats.items():
+            lines.append(f'{metric}{{cache="{cache}"}} {values[name]}')
+    return "\n".join(lines) + "\n"
+
+
+def prometheus_text(cache_stats: Optional[Dict[str, dict]] = None) -> str:
+    text = query_metrics.to_prometheus()
+    if cache_stats is not None:
+        text += cache_stats_to_prometheus(cache_stats)
+    return text
@@ -0,0 +1,272 @@
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, NamedTuple
+
+from pymongo import ASCENDING, DESCENDING, TEXT, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+
+from owntwitter.services.pagination import keyset_sort
+from owntwitter.services.search import content_tags
+from owntwitter.services.utils import chunked
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Database], None]
+
+
+def _create_query_indexes(db: Database):
+    # posts of a user and the feed, both newest first
+    db.posts.create_index([("username", ASCENDING), ("timestamp", DESCENDING)])
+    db.posts.create_index([("timestamp", DESCENDING)])
+
+    # comment section of a post (oldest first) and comments of a user
+    db.comments.create_index([("post_id", ASCENDING), ("timestamp", ASCENDING)])
+    db.comments.create_index([("username", ASCENDING), ("timestamp", DESCENDING)])
+
+
+def _drop_index_if_exists(collection: Collection, name: str):
+    if name in collection.index_information():
+        collection.drop_index(name)
+
+
+def _add_id_to_query_indexes(db: Database):
+    # pages are sorted by (timestamp, _id), see services/pagination.py
+    db.posts.create_index(
+        [("username", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]
+    )
+    db.posts.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+    db.comments.create_index(
+        [("post_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]
+    )
+
+    # superseded by the indexes above; an interrupted run may have dropped some
+    _drop_index_if_exists(db.posts, "username_1_timestamp_-1")
+    _drop_index_if_exists(db.posts, "timestamp_-1")
+    _drop_index_if_exists(db.comments, "post_id_1_timestamp_1")
+
+
+def _create_timeline_indexes(db: Database):
+    # follow graph; the pull flag marks edges to accounts that are not fanned out
+    db.follows.create_index(
+        [("follower", ASCENDING), ("followee", ASCENDING)], unique=True
+    )
+    db.follows.create_index([("followee", ASCENDING), ("pull", ASCENDING)])
+    db.follows.create_index([("follower", ASCENDING), ("pull", ASCENDING)])
+
+    # materialized timelines, read newest first
+    db.timelines.create_index(
+        [("owner", ASCENDING), ("timestamp", DESCENDING), ("post_id", DESCENDING)]
+    )
+    db.timelines.create_index(
+        [("owner", ASCENDING), ("post_id", ASCENDING)], unique=True
+    )
+    db.timelines.create_index([("post_id", ASCENDING)])
+    db.timelines.create_index([("author", ASCENDING)])
+
+
+def _add_like_count_to_posts(db: Database):
+    db.posts.update_many(
+        {"like_count": {"$exists": False}},
+        [{"$set": {"like_count": {"$size": "$likes"}}}],
+    )
+
+
+def _move_likes_to_collection(db: Database):
+    db.likes.create_index(
+        [("post_id", ASCENDING), ("username", ASCENDING)], unique=True
+    )
+    db.likes.create_index(
+        [("post_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]
+    )
+    db.likes.create_index([("username", ASCENDING)])
+
+    # the time of embedded likes is unknown, the post timestamp is used instead;
+    # upserts keyed like the unique index make an interrupted run restartable
+    posts = db.posts.find({"likes": {"$exists": True}}, {"likes": 1, "timestamp": 1})
+    for post in posts:
+        likes = [
+            UpdateOne(
+                {"post_id": post["_id"], "username": username},
+                {
+                    "$setOnInsert": {
+                        "_id": uuid.uuid4().hex,
+                        "timestamp": post["timestamp"],
+                    }
+                },
+                upsert=True,
+            )
+            for username in set(post["likes"])
+        ]
+        for chunk in chunked(likes, 1000):
+            db.likes.bulk_write(chunk, ordered=False)
+        db.posts.update_one(
+            {"_id": post["_id"]},
+            {"$set": {"like_count": len(likes)}, "$unset": {"likes": ""}},
+        )
+
+
+def _create_search_indexes(db: Database):
+    for collection in (db.posts, db.comments):
+        # full text search, see services/search.py
+        collection.create_index([("content", TEXT)])
+
+        # tag searches, newest first
+        for field in ("hashtags", "mentions"):
+            collection.create_index(
+                [(field, ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]
+            )
+
+        # tags of existing documents; new ones are tagged on every write
+        documents = collection.find({"hashtags": {"$exists": False}}, {"content": 1})
+        for chunk in chunked(documents, 1000):
+            collection.bulk_write(
+                [
+                    # content is optional and may be null or missing
+                    UpdateOne(
+                        {"_id": d["_id"]},
+                        {"$set": content_tags(d.get("content") or "")},
+                    )
+                    for d in chunk
+                ],
+                ordered=False,
+            )
+
+
+# append only; the version of an applied migration must never change
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create query indexes", _create_query_indexes),
+    Migration(2, "add _id to query indexes", _add_id_to_query_indexes),
+    Migration(3, "create follow graph and timeline indexes", _create_timeline_indexes),
+    Migration(4, "add like_count to posts", _add_like_count_to_posts),
+    Migration(5, "move embedded likes to likes collection", _move_likes_to_collection),
+    Migration(
+        6, "create search indexes and tag posts and comments", _create_search_indexes
+    ),
+]
+
+
+@contextmanager
+def _migration_lock(
+    db: Database, lease: timedelta, poll_seconds: float
+) -> Iterator[None]:
+    # a lease instead of a plain lock, so a worker that dies while migrating
+    # does not block the startup of all other workers forever
+    owner = uuid.uuid4().hex
+    while True:
+        now = datetime.utcnow()
+        try:
+            # the upsert of a held lock collides with the existing document
+            db.migration_lock.update_one(
+                {"_id": "migrations", "expires_at": {"$lt": now}},
+                {"$set": {"owner": owner, "expires_at": now + lease}},
+                upsert=True,
+            )
+            break
+        except DuplicateKeyError:
+            time.sleep(poll_seconds)
+
+    try:
+        yield
+    finally:
+        db.migration_lock.delete_one({"_id": "migrations", "owner": owner})
+
+
+def migrate(
+    db: Database,
+    lease: timedelta = timedelta(minutes=10),
+    poll_seconds: float = 1.0,
+) -> List[int]:
+    """Applies all pending migrations in order and returns their versions.
+
+    Applied migrations are recorded in the migrations collection, so calling
+    this repeatedly (e.g. on every startup) is cheap and idempotent. Workers
+    starting concurrently take turns; those that find the migrations already
+    applied by another worker return an empty list.
+    """
+    with _migration_lock(db, lease, poll_seconds):
+        applied = {m["_id"] for m in db.migrations.find({}, {"_id": 1})}
+
+        newly_applied = []
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+
+            migration.apply(db)
+            # an upsert, in case the lease expired and another worker took over
+            db.migrations.update_one(
+                {"_id": migration.version},
+                {
+                    "$setOnInsert": {
+                        "name": migration.name,
+                        "applied_at": datetime.utcnow(),
+                    }
+                },
+                upsert=True,
+            )
+            newly_applied.append(migration.version)
+
+    return newly_applied
+
+
+def _index_names(plan: dict) -> List[str]:
+    # walks the plan tree and collects the indexes of all index scans
+    names = [plan["indexName"]] if "indexName" in plan else []
+
+    for key in ("inputStage", "innerStage", "outerStage"):
+        if key in plan:
+            names += _index_names(plan[key])
+    for stage in plan.get("inputStages", []):
+        names += _index_names(stage)
+
+    return names
+
+
+def winning_plan_indexes(explain: dict) -> List[str]:
+    """The indexes of the winning plan in the output of an explain command."""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # aggregations report the plan of their initial $match in the first stage
+        stages = explain.get("stages") or [{}]
+        planner = stages[0].get("$cursor", {}).get("queryPlanner", {})
+
+    plan = planner.get("winningPlan", {})
+    # the slot based engine (mongo >= 5.1) nests the classic plan
+    return _index_names(plan.get("queryPlan", plan))
+
+
+def explain_queries(db: Database) -> Dict[str, List[str]]:
+    """Reports the indexes the winning plan of each DatabaseConnector query uses.
+
+    An empty list means that the query is answered by a collection scan.
+    """
+    queries = {
+        "read_posts_of_user": db.posts.find({"username": ""}).sort(
+            keyset_sort(descending=True)
+        ),
+        "read_recent_posts": db.posts.find().sort(keyset_sort(descending=True)),
+        "read_comments_of_post": db.comments.find({"post_id": ""}).sort(
+            keyset_sort(descending=False)
+        ),
+        "read_comments_of_user": db.comments.find({"username": ""}),
+        "read_likes_of_post": db.likes.find({"post_id": ""}).sort(
+            keyset_sort(descending=False)
+        ),
+        "search_posts": db.posts.find({"hashtags": {"$all": [""]}}).sort(
+            keyset_sort(descending=True)
+        ),
+        "read_timeline": db.timelines.find({"owner": ""}).sort(
+            keyset_sort(descending=True, id_field="post_id")
+        ),
+    }
+
+    report = {}
+    for name, cursor in queries.items():
+        report[name] = winning_plan_indexes(cursor.explain())
+
+    return report
@@ -0,0 +1,74 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from pymongo import ASCENDING, DESCENDING
+
+from owntwitter.models.exceptions import InvalidCursorException
+
+# Pages are ordered by (timestamp, _id); the _id breaks ties between documents
+# created at the same time, so every page boundary is unambiguous. Collections
+# referencing posts (e.g. timelines) use the post_id instead of their own _id.
+
+
+def encode_cursor(timestamp: datetime, _id: str) -> str:
+    # timestamps are stored the way jsonable_encoder renders them
+    raw = json.dumps([jsonable_encoder(timestamp), _id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, _id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursorException()
+
+    if not isinstance(timestamp, str) or not isinstance(_id, str):
+        raise InvalidCursorException()
+
+    return timestamp, _id
+
+
+def encode_rank_cursor(score: float, _id: str) -> str:
+    # pages ordered by relevance (e.g. text search) continue after a score
+    raw = json.dumps([score, _id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_rank_cursor(cursor: str):
+    try:
+        score, _id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursorException()
+
+    if not isinstance(score, (int, float)) or not isinstance(_id, str):
+        raise InvalidCursorException()
+
+    return score, _id
+
+
+def keyset_filter(
+    query: dict, after: Optional[str], descending: bool, id_field: str = "_id"
+) -> dict:
+    """Restricts query to the documents following the cursor after."""
+    if after is None:
+        return query
+
+    timestamp, _id = decode_cursor(after)
+    op = "$lt" if descending else "$gt"
+
+    return {
+        **query,
+        "$or": [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, id_field: {op: _id}},
+        ],
+    }
+
+
+def keyset_sort(descending: bool, id_field: str = "_id"):
+    direction = DESCENDING if descending else ASCENDING
+    return [("timestamp", direction), (id_field, direction)]
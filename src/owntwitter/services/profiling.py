@@ -0,0 +1,156 @@
+import functools
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+# Wall time of a request is split into the time spent waiting for mongo
+# (reported by the command listener), building models from documents and
+# encoding responses; "other" is the rest, e.g. routing, request and response
+# model validation and the endpoint itself. Selected requests additionally get
+# a sampling profile, written in the folded stack format of flamegraph.pl and
+# speedscope.
+
+PHASES = ("db", "validation", "serialization")
+
+
+class RequestTimings:
+    """Seconds spent per phase by one request."""
+
+    def __init__(self):
+        # mongo commands of a request may finish on several driver threads
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.seconds[phase] += seconds
+
+    def server_timing(self, total: float) -> str:
+        """The value of a Server-Timing header, in milliseconds."""
+        parts = [f"{phase};dur={s * 1000:.3f}" for phase, s in self.seconds.items()]
+        parts.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(parts)
+
+
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "current_timings", default=None
+)
+
+
+def record(phase: str, seconds: float):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+def timed(phase: str):
+    """Decorator adding the time spent in a function to the current request."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            timings = current_timings.get()
+            if timings is None:
+                return function(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.add(phase, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedJSONResponse(JSONResponse):
+    @timed("serialization")
+    def render(self, content) -> bytes:
+        return super().render(content)
+
+
+class RequestMetrics:
+    """Totals per route of the requests of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = defaultdict(int)
+        self._seconds: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def record(self, route: str, timings: RequestTimings, total: float):
+        with self._lock:
+            self._requests[route] += 1
+            self._seconds[(route, "total")] += total
+            for phase, seconds in timings.seconds.items():
+                self._seconds[(route, phase)] += seconds
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            requests = dict(self._requests)
+            seconds = dict(self._seconds)
+
+        lines = ["# TYPE http_requests_total counter"]
+        for route, count in requests.items():
+            lines.append(f'http_requests_total{{route="{route}"}} {count}')
+        lines.append("# TYPE http_request_phase_seconds_total counter")
+        for (route, phase), total in seconds.items():
+            lines.append(
+                f'http_request_phase_seconds_total{{route="{route}",phase="{phase}"}}'
+                f" {total}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread, e.g. the one running the event loop.
+
+    On the event loop thread the samples include other requests served at
+    the same time; mongo i/o runs on driver threads and shows up as db time.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.stacks: Counter = Counter()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+
+def write_folded_stacks(stacks: Counter, directory: str, name: str) -> Path:
+    """Writes one "frame;frame;frame count" line per stack."""
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    path /= f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.folded"
+    path.write_text("".join(f"{stack} {count}\n" for stack, count in stacks.items()))
+    return path
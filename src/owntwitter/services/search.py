@@ -0,0 +1,87 @@
+import re
+from typing import List, NamedTuple, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from owntwitter.services.pagination import decode_rank_cursor
+
+# Posts and comments store the hashtags and mentions of their content, which
+# are extracted on every write. Queries made up of tags only are answered by
+# exact matches on the tag indexes, newest first; any other words go through
+# the text indexes and are ranked by relevance (text score).
+
+HASHTAG = re.compile(r"#(\w+)")
+MENTION = re.compile(r"@(\w+)")
+
+
+def content_tags(content: str) -> dict:
+    # hashtags are case insensitive, usernames are not
+    return {
+        "hashtags": sorted({tag.lower() for tag in HASHTAG.findall(content)}),
+        "mentions": sorted(set(MENTION.findall(content))),
+    }
+
+
+def encode_with_tags(model: BaseModel) -> dict:
+    """The document of a post or comment, with its hashtags and mentions."""
+    document = jsonable_encoder(model)
+    document.update(content_tags(document.get("content") or ""))
+    return document
+
+
+def content_with_tags(model: BaseModel) -> dict:
+    """The editable fields of a post, for a ``$set`` that keeps its counters."""
+    content = model.content
+    return {"content": content, **content_tags(content or "")}
+
+
+class SearchQuery(NamedTuple):
+    hashtags: List[str]
+    mentions: List[str]
+    text: str
+
+
+def parse_query(q: str) -> SearchQuery:
+    hashtags, mentions, words = [], [], []
+    for token in q.split():
+        if HASHTAG.fullmatch(token):
+            hashtags.append(token[1:].lower())
+        elif MENTION.fullmatch(token):
+            mentions.append(token[1:])
+        else:
+            words.append(token)
+    return SearchQuery(hashtags, mentions, " ".join(words))
+
+
+def tag_filter(query: SearchQuery) -> dict:
+    conditions = {}
+    if query.hashtags:
+        conditions["hashtags"] = {"$all": query.hashtags}
+    if query.mentions:
+        conditions["mentions"] = {"$all": query.mentions}
+    return conditions
+
+
+def text_search_pipeline(
+    query: SearchQuery, projection: dict, limit: int, after: Optional[str]
+) -> List[dict]:
+    """Most relevant first; ties and pages are broken by _id."""
+    pipeline = [
+        {"$match": {"$text": {"$search": query.text}, **tag_filter(query)}},
+        {"$project": {**projection, "score": {"$meta": "textScore"}}},
+    ]
+    if after is not None:
+        score, _id = decode_rank_cursor(after)
+        pipeline.append(
+            {
+                "$match": {
+                    "$or": [
+                        {"score": {"$lt": score}},
+                        {"score": score, "_id": {"$gt": _id}},
+                    ]
+                }
+            }
+        )
+    pipeline += [{"$sort": {"score": -1, "_id": 1}}, {"$limit": limit}]
+    return pipeline
@@ -0,0 +1,61 @@
+import functools
+from typing import Dict, Iterable, Optional, Type
+
+import orjson
+from pydantic import BaseModel
+
+from owntwitter.services.pagination import encode_cursor, encode_rank_cursor
+from owntwitter.services.profiling import timed
+
+# Documents are stored with jsonable_encoder and use the field aliases ("_id"),
+# so they already have the shape of the responses. Listing endpoints write the
+# projected documents straight to json instead of validating every document
+# into a model and again against the response model.
+
+# response fields and the default of fields missing in older documents
+POST_FIELDS = {
+    "_id": None,
+    "username": None,
+    "timestamp": None,
+    "content": None,
+    "like_count": 0,
+    "number_of_comments": 0,
+}
+COMMENT_FIELDS = {
+    "_id": None,
+    "post_id": None,
+    "username": None,
+    "timestamp": None,
+    "content": None,
+}
+
+
+def projection(fields: Dict[str, object]) -> dict:
+    return dict.fromkeys(fields, 1)
+
+
+@functools.lru_cache()
+def model_projection(model: Type[BaseModel]) -> dict:
+    # fields are stored under their alias
+    return {field.alias: 1 for field in model.__fields__.values()}
+
+
+@timed("serialization")
+def documents_to_json(documents: Iterable[dict], fields: Dict[str, object]) -> bytes:
+    return orjson.dumps(
+        [
+            {name: document.get(name, default) for name, default in fields.items()}
+            for document in documents
+        ]
+    )
+
+
+def document_cursor(documents: list, limit: int) -> Optional[str]:
+    # a short page is the last one
+    if len(documents) < limit:
+        return None
+    last = documents[-1]
+    if "score" in last:
+        # ranked by relevance, see services/search.py
+        return encode_rank_cursor(last["score"], last["_id"])
+    return encode_cursor(last["timestamp"], last["_id"])
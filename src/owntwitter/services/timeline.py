@@ -0,0 +1,33 @@
+from typing import List
+
+# Personal timelines are materialized on write: a new post is copied (by
+# reference) into the timeline of its author and of every follower. Accounts
+# with more than Settings.timeline_fan_out_limit followers are not fanned out;
+# their follow edges are flagged with pull=True and their posts are merged
+# into the timeline on read instead.
+
+FAN_OUT_BATCH_SIZE = 1000
+
+# fields of an entry needed to page and merge a timeline
+TIMELINE_ENTRY_PROJECTION = {"_id": 0, "post_id": 1, "timestamp": 1}
+
+# number of recent posts copied into the timeline when following someone
+BACKFILL_SIZE = 20
+
+
+def timeline_entry(owner: str, post: dict) -> dict:
+    # post is the stored (json encoded) post document
+    return {
+        "owner": owner,
+        "post_id": post["_id"],
+        "author": post["username"],
+        "timestamp": post["timestamp"],
+    }
+
+
+def merge_timeline(entries: List[dict], pulled_posts: List[dict], limit: int):
+    """Merges fanned out entries and pulled posts into the ids of one page."""
+    keys = {(e["timestamp"], e["post_id"]) for e in entries}
+    keys |= {(p["timestamp"], p["_id"]) for p in pulled_posts}
+
+    return [post_id for _, post_id in sorted(keys, reverse=True)[:limit]]
@@ -0,0 +1,8 @@
+from itertools import islice
+from typing import Iterable, Iterator
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
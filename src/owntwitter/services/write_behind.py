@@ -0,0 +1,212 @@
+import asyncio
+import contextlib
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from owntwitter.models.exceptions import WriteBehindQueueFullException
+from owntwitter.models.models import Comment, Like
+from owntwitter.services.async_db import AsyncDatabaseConnector
+from owntwitter.services.pagination import decode_cursor
+
+# Under burst load comments and likes are acknowledged before they are
+# written: every worker buffers them and flushes them with the bulk inserts of
+# the connector, i.e. a few unordered insert_many and bulk_write calls per
+# batch instead of a transaction per write. Pending comments are merged into
+# the comment sections read through the same worker, so authors see their
+# comment right away.
+#
+# Writes are flushed on shutdown; those of a killed worker are lost. A flush
+# that fails is retried with exponential backoff. Bulk inserts skip documents
+# already written, but the counters of their posts may have been incremented
+# or not, so after a failed flush the counters of the affected posts are
+# recounted. Duplicate comment ids are skipped silently, unlike with
+# create_new_comment.
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        db: AsyncDatabaseConnector,
+        batch_size: int = 500,
+        flush_interval: float = 0.05,
+        max_pending: int = 10000,
+        max_backoff: float = 5.0,
+    ):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._max_backoff = max_backoff
+        # failed flushes in a row; retries back off exponentially
+        self._failures = 0
+
+        # comments by post and id, and likes by (post_id, username)
+        self._comments: Dict[str, Dict[str, Comment]] = {}
+        self._likes: Dict[Tuple[str, str], Like] = {}
+        self._pending_comments = 0
+        # posts whose counters a failed flush may have left wrong
+        self._recount: Set[str] = set()
+
+        self._full = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending_comments + len(self._likes)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+        await self.flush()
+        if self.pending:
+            logger.error("write-behind: %d writes lost on shutdown", self.pending)
+
+    def add_comment(self, comment: Comment):
+        if comment.comment_id in self._comments.get(comment.post_id, {}):
+            return
+
+        self._reserve()
+        self._comments.setdefault(comment.post_id, {})[comment.comment_id] = comment
+        self._pending_comments += 1
+        self._notify()
+
+    def add_like(self, post_id: str, username: str):
+        if (post_id, username) in self._likes:
+            return
+
+        self._reserve()
+        self._likes[(post_id, username)] = Like(
+            like_id=uuid.uuid4().hex,
+            post_id=post_id,
+            username=username,
+            timestamp=datetime.utcnow(),
+        )
+        self._notify()
+
+    def has_comment(self, comment_id: str) -> bool:
+        return any(comment_id in section for section in self._comments.values())
+
+    def has_like(self, post_id: str, username: str) -> bool:
+        return (post_id, username) in self._likes
+
+    def discard_post(self, post_id: str):
+        """Drops the pending comments and likes of a deleted post."""
+        self._pending_comments -= len(self._comments.pop(post_id, {}))
+        self._recount.discard(post_id)
+        for key in [key for key in self._likes if key[0] == post_id]:
+            del self._likes[key]
+
+    def discard_user(self, username: str):
+        """Drops the pending comments and likes of a deleted user."""
+        for post_id, section in list(self._comments.items()):
+            for comment_id in [i for i, c in section.items() if c.username == username]:
+                del section[comment_id]
+                self._pending_comments -= 1
+            if not section:
+                del self._comments[post_id]
+        for key in [key for key in self._likes if key[1] == username]:
+            del self._likes[key]
+
+    def pending_comments(self, post_id: str) -> List[dict]:
+        # encoded like the stored documents, see serialization.py
+        return [jsonable_encoder(c) for c in self._comments.get(post_id, {}).values()]
+
+    async def flush(self):
+        async with self._flushing:
+            comments = [c for s in self._comments.values() for c in s.values()]
+            likes = list(self._likes.values())
+            if not comments and not likes and not self._recount:
+                return
+
+            try:
+                await self._db.bulk_insert_comments(comments, self._batch_size)
+                await self._db.bulk_insert_likes(likes, self._batch_size)
+                if self._recount:
+                    await self._db.recount_post_counters(sorted(self._recount))
+                    self._recount.clear()
+            except Exception:
+                # logged once per outage, not on every retry
+                self._failures += 1
+                if self._failures == 1:
+                    logger.exception(
+                        "write-behind: flushing %d comments and %d likes failed",
+                        len(comments),
+                        len(likes),
+                    )
+                self._recount.update(c.post_id for c in comments)
+                self._recount.update(like.post_id for like in likes)
+                return
+
+            if self._failures:
+                logger.warning(
+                    "write-behind: flushed after %d failed attempts", self._failures
+                )
+                self._failures = 0
+
+            # writes added during the flush stay pending
+            for comment in comments:
+                section = self._comments.get(comment.post_id, {})
+                if section.pop(comment.comment_id, None) is not None:
+                    self._pending_comments -= 1
+                if not section:
+                    self._comments.pop(comment.post_id, None)
+            for like in likes:
+                if self._likes.get((like.post_id, like.username)) is like:
+                    del self._likes[(like.post_id, like.username)]
+
+    def _reserve(self):
+        # backpressure: callers are told to retry once a flush caught up
+        if self.pending >= self._max_pending:
+            raise WriteBehindQueueFullException()
+
+    def _notify(self):
+        if self.pending >= self._batch_size:
+            self._full.set()
+
+    def _backoff(self) -> float:
+        return min(self._max_backoff, self._flush_interval * 2**self._failures)
+
+    async def _run(self):
+        while True:
+            if self._failures:
+                # a full queue does not hurry a retry against a failing database
+                await asyncio.sleep(self._backoff())
+            else:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._full.wait(), self._flush_interval)
+            self._full.clear()
+            await self.flush()
+
+
+def merge_pending(
+    documents: List[dict], pending: List[dict], after: Optional[str], limit: int
+) -> List[dict]:
+    """Merges pending comments into a page of a comment section (oldest first).
+
+    Pending comments are usually the newest, so they end up on the last page.
+    """
+    if not pending:
+        return documents
+
+    if after is not None:
+        key = decode_cursor(after)
+        pending = [d for d in pending if (d["timestamp"], d["_id"]) > key]
+
+    # a comment may be both stored and pending while it is being flushed
+    ids = {d["_id"] for d in documents}
+    merged = documents + [d for d in pending if d["_id"] not in ids]
+    merged.sort(key=lambda d: (d["timestamp"], d["_id"]))
+    return merged[:limit]
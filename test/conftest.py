@@ -1,17 +1,90 @@
+import asyncio
+import inspect
 from unittest.mock import MagicMock
 
 import pytest
 from starlette.testclient import TestClient
 
-from owntwitter.api.endpoints import get_db_service
+from owntwitter.api.endpoints import (
+    get_db_service,
+    get_event_bus,
+    get_feed_cache,
+    get_write_behind,
+)
 from owntwitter.app import app
 from owntwitter.models.settings import Settings
+from owntwitter.services.async_db import AsyncDatabaseConnector
+from owntwitter.services.cache import CachedAsyncDatabaseConnector
 from owntwitter.services.db import DatabaseConnector
 
 settings = Settings()
 url = f"http://localhost:{settings.uvicorn_port}/api"
 
 
+class BlockingConnector:
+    """Runs the coroutines of an async connector (and its collections) to
+    completion, so the collection tests call both connectors the same way."""
+
+    def __init__(self, target, loop: asyncio.AbstractEventLoop):
+        self._target = target
+        self._loop = loop
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not (inspect.ismethod(value) or inspect.isfunction(value)):
+            # collections of the connector, e.g. get_db._posts
+            return BlockingConnector(value, self._loop) if name[0] == "_" else value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            if inspect.isasyncgen(result):
+                return self._loop.run_until_complete(_collect(result))
+            if inspect.isawaitable(result):
+                return self._loop.run_until_complete(result)
+            return result
+
+        return call
+
+
+async def _collect(generator):
+    return [item async for item in generator]
+
+
+def blocking(connector_class):
+    # a fresh event loop per test; the connector is closed with it
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    db = connector_class()
+    yield BlockingConnector(db, loop)
+    db.close()
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.fixture
+def get_sync_db():
+    return DatabaseConnector()
+
+
+@pytest.fixture
+def get_async_db():
+    yield from blocking(AsyncDatabaseConnector)
+
+
+@pytest.fixture
+def get_cached_db():
+    yield from blocking(CachedAsyncDatabaseConnector)
+
+
+@pytest.fixture(params=["sync", "async"])
+def get_db(request):
+    """Both connectors; the collection tests run against each of them."""
+    if request.param == "sync":
+        yield DatabaseConnector()
+    else:
+        yield from blocking(AsyncDatabaseConnector)
+
+
 @pytest.fixture
 def client():
     return TestClient(app)
@@ -19,7 +92,12 @@ def client():
 
 @pytest.fixture
 def db_service_dependency_override():
-    mock = MagicMock(spec=DatabaseConnector)
+    mock = MagicMock(spec=AsyncDatabaseConnector)
+    mock.count_user_documents.return_value = 0
 
     app.dependency_overrides[get_db_service] = lambda: mock
+    # the feed cache would outlive the mock; tests opt in to it
+    app.dependency_overrides[get_feed_cache] = lambda: None
+    app.dependency_overrides[get_write_behind] = lambda: None
+    app.dependency_overrides[get_event_bus] = lambda: None
     return mock
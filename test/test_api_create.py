@@ -2,8 +2,12 @@ from conftest import url
 from fastapi.encoders import jsonable_encoder
 from pymongo.errors import DuplicateKeyError
 
+from owntwitter.api.endpoints import get_event_bus, get_write_behind
+from owntwitter.app import app
 from owntwitter.models.exceptions import PostNotFoundException, UserNotFoundException
 from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.services.events import FEED_TOPIC, EventBus, comments_topic
+from owntwitter.services.write_behind import WriteBehindQueue
 
 
 def test_create_user(client, db_service_dependency_override):
@@ -87,3 +91,145 @@ def test_create_comment_post_not_found(client, db_service_dependency_override):
 
     r = client.post(url + f"/create/comment", json=comment_json)
     assert r.status_code == 404
+
+
+def test_create_comment_write_behind(client, db_service_dependency_override):
+    write_behind = WriteBehindQueue(db_service_dependency_override, max_pending=1)
+    app.dependency_overrides[get_write_behind] = lambda: write_behind
+    comment, other = CommentFactory.batch(2)
+
+    r = client.post(url + "/create/comment", json=jsonable_encoder(comment))
+    assert r.status_code == 202
+    assert write_behind.pending_comments(comment.post_id) == [jsonable_encoder(comment)]
+    db_service_dependency_override.check_references.assert_called_once_with(
+        comment.username, comment.post_id
+    )
+    db_service_dependency_override.create_new_comment.assert_not_called()
+
+    r = client.post(url + "/create/comment", json=jsonable_encoder(other))
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+
+
+def test_create_comment_write_behind_post_not_found(
+    client, db_service_dependency_override
+):
+    write_behind = WriteBehindQueue(db_service_dependency_override)
+    app.dependency_overrides[get_write_behind] = lambda: write_behind
+    db_service_dependency_override.check_references.side_effect = PostNotFoundException
+
+    r = client.post(
+        url + "/create/comment", json=jsonable_encoder(CommentFactory.build())
+    )
+    assert r.status_code == 404
+    assert write_behind.pending == 0
+
+
+def test_follow_user(client, db_service_dependency_override):
+    user, followee = UserFactory.batch(2)
+
+    r = client.post(url + f"/users/{user.username}/follow/{followee.username}")
+    assert r.status_code == 201
+
+
+def test_follow_user_not_found(client, db_service_dependency_override):
+    db_service_dependency_override.follow_user.side_effect = UserNotFoundException
+    user, followee = UserFactory.batch(2)
+
+    r = client.post(url + f"/users/{user.username}/follow/{followee.username}")
+    assert r.status_code == 404
+
+
+def test_follow_user_self(client, db_service_dependency_override):
+    user = UserFactory.build()
+
+    r = client.post(url + f"/users/{user.username}/follow/{user.username}")
+    assert r.status_code == 400
+
+
+def test_bulk_create_posts(client, db_service_dependency_override):
+    db_service_dependency_override.bulk_insert_posts.return_value = 3
+    posts = PostFactory.batch(3)
+
+    r = client.post(url + "/bulk/posts", json=jsonable_encoder(posts))
+
+    assert r.status_code == 201
+    assert r.json() == {"inserted": 3}
+    db_service_dependency_override.bulk_insert_posts.assert_called_once_with(posts)
+    db_service_dependency_override.check_all_references.assert_called_once_with(
+        {p.username for p in posts}
+    )
+
+
+def test_bulk_create_posts_user_not_found(client, db_service_dependency_override):
+    db_service_dependency_override.check_all_references.side_effect = (
+        UserNotFoundException
+    )
+
+    r = client.post(url + "/bulk/posts", json=jsonable_encoder(PostFactory.batch(2)))
+
+    assert r.status_code == 404
+    db_service_dependency_override.bulk_insert_posts.assert_not_called()
+
+
+def test_bulk_create_comments_post_not_found(client, db_service_dependency_override):
+    db_service_dependency_override.check_all_references.side_effect = (
+        PostNotFoundException
+    )
+    comments = CommentFactory.batch(2)
+
+    r = client.post(url + "/bulk/comments", json=jsonable_encoder(comments))
+
+    assert r.status_code == 404
+    db_service_dependency_override.check_all_references.assert_called_once_with(
+        {c.username for c in comments}, {c.post_id for c in comments}
+    )
+    db_service_dependency_override.bulk_insert_comments.assert_not_called()
+
+
+def test_bulk_create_posts_publishes_events(client, db_service_dependency_override):
+    db_service_dependency_override.bulk_insert_posts.return_value = 2
+    events = EventBus()
+    app.dependency_overrides[get_event_bus] = lambda: events
+    posts = PostFactory.batch(2)
+
+    with events.subscribe(FEED_TOPIC) as feed:
+        r = client.post(url + "/bulk/posts", json=jsonable_encoder(posts))
+
+        assert r.status_code == 201
+        assert posts[0].post_id.encode() in feed.get_nowait()
+        assert posts[1].post_id.encode() in feed.get_nowait()
+
+
+def test_bulk_create_comments_invalid(client, db_service_dependency_override):
+    comment = jsonable_encoder(CommentFactory.build())
+    del comment["post_id"]
+
+    r = client.post(url + "/bulk/comments", json=[comment])
+
+    assert r.status_code == 422
+    db_service_dependency_override.bulk_insert_comments.assert_not_called()
+
+
+def test_create_post_publishes_event(client, db_service_dependency_override):
+    events = EventBus()
+    app.dependency_overrides[get_event_bus] = lambda: events
+    post = PostFactory.build()
+
+    with events.subscribe(FEED_TOPIC) as feed:
+        r = client.post(url + "/create/post", json=jsonable_encoder(post))
+
+        assert r.status_code == 201
+        assert jsonable_encoder(post)["_id"].encode() in feed.get_nowait()
+
+
+def test_create_comment_publishes_event(client, db_service_dependency_override):
+    events = EventBus()
+    app.dependency_overrides[get_event_bus] = lambda: events
+    comment = CommentFactory.build()
+
+    with events.subscribe(comments_topic(comment.post_id)) as comments:
+        r = client.post(url + "/create/comment", json=jsonable_encoder(comment))
+
+        assert r.status_code == 201
+        assert comment.comment_id.encode() in comments.get_nowait()
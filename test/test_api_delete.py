@@ -1,11 +1,23 @@
+from unittest.mock import AsyncMock
+
 from conftest import url
 
+from owntwitter.api.endpoints import get_feed_cache, get_write_behind
+from owntwitter.app import app
 from owntwitter.models.exceptions import (
     CommentNotFoundException,
+    FollowNotFoundException,
     PostNotFoundException,
     UserNotFoundException,
 )
-from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.models.factories import (
+    CommentFactory,
+    JobFactory,
+    PostFactory,
+    UserFactory,
+)
+from owntwitter.services.feed_cache import FeedCache
+from owntwitter.services.write_behind import WriteBehindQueue
 
 
 def test_delete_user(client, db_service_dependency_override):
@@ -15,6 +27,48 @@ def test_delete_user(client, db_service_dependency_override):
     assert r.status_code == 203
 
 
+def test_delete_user_discards_pending_writes(client, db_service_dependency_override):
+    write_behind = WriteBehindQueue(db_service_dependency_override)
+    app.dependency_overrides[get_write_behind] = lambda: write_behind
+    comment = CommentFactory.build()
+    write_behind.add_comment(comment)
+    write_behind.add_like(comment.post_id, comment.username)
+
+    r = client.post(url + f"/delete/user/{comment.username}")
+    assert r.status_code == 203
+    assert write_behind.pending == 0
+
+
+def test_delete_user_in_background(client, db_service_dependency_override):
+    user = UserFactory.build()
+    job = JobFactory.build()
+    db_service_dependency_override.count_user_documents.return_value = 10**6
+    db_service_dependency_override.create_job.return_value = job
+
+    r = client.post(url + f"/delete/user/{user.username}")
+
+    assert r.status_code == 202
+    assert r.json()["_id"] == job.job_id
+    db_service_dependency_override.run_job.assert_called_once_with(
+        job.job_id, db_service_dependency_override.delete_user, user.username
+    )
+
+
+def test_delete_user_refreshes_feed_cache(client, db_service_dependency_override):
+    feed_cache = AsyncMock(spec=FeedCache)
+    app.dependency_overrides[get_feed_cache] = lambda: feed_cache
+    user = UserFactory.build()
+
+    assert client.post(url + f"/delete/user/{user.username}").status_code == 203
+    feed_cache.refresh.assert_awaited_once()
+
+    # in the background, after the job
+    db_service_dependency_override.count_user_documents.return_value = 10**6
+    db_service_dependency_override.create_job.return_value = JobFactory.build()
+    assert client.post(url + f"/delete/user/{user.username}").status_code == 202
+    assert feed_cache.refresh.await_count == 2
+
+
 def test_delete_user_not_found(client, db_service_dependency_override):
     user = UserFactory.build()
 
@@ -81,3 +135,18 @@ def test_delete_comment_post_not_found(client, db_service_dependency_override):
 
     r = client.post(url + f"/delete/comment/{comment.comment_id}")
     assert r.status_code == 404
+
+
+def test_unfollow_user(client, db_service_dependency_override):
+    user, followee = UserFactory.batch(2)
+
+    r = client.post(url + f"/users/{user.username}/unfollow/{followee.username}")
+    assert r.status_code == 203
+
+
+def test_unfollow_user_not_following(client, db_service_dependency_override):
+    db_service_dependency_override.unfollow_user.side_effect = FollowNotFoundException
+    user, followee = UserFactory.batch(2)
+
+    r = client.post(url + f"/users/{user.username}/unfollow/{followee.username}")
+    assert r.status_code == 404
@@ -1,12 +1,38 @@
-from conftest import url
+import json
 
-from owntwitter.models.exceptions import PostNotFoundException, UserNotFoundException
-from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from conftest import url
+from fastapi.encoders import jsonable_encoder
+
+from owntwitter.api.endpoints import get_event_bus, get_feed_cache, get_write_behind
+from owntwitter.app import app
+from owntwitter.models.exceptions import (
+    InvalidCursorException,
+    JobNotFoundException,
+    PostNotFoundException,
+    UserNotFoundException,
+)
+from owntwitter.models.factories import (
+    CommentFactory,
+    JobFactory,
+    LikeFactory,
+    PostFactory,
+    UserFactory,
+)
+from owntwitter.models.models import PrivateUser, PublicUser
+from owntwitter.services.events import EventBus
+from owntwitter.services.feed_cache import FeedCache, InMemoryCacheBackend
+from owntwitter.services.pagination import encode_cursor, encode_rank_cursor
+from owntwitter.services.write_behind import WriteBehindQueue
+
+
+def documents(models):
+    # listing reads return the stored documents to the endpoints
+    return [jsonable_encoder(model) for model in models]
 
 
 def test_feed_endpoint(client, db_service_dependency_override):
-    db_service_dependency_override.read_recent_posts.return_value = PostFactory.batch(
-        20
+    db_service_dependency_override.read_recent_posts.return_value = documents(
+        PostFactory.batch(20)
     )
 
     r = client.get(url + "/feed")
@@ -15,6 +41,99 @@ def test_feed_endpoint(client, db_service_dependency_override):
     assert len(r.json()) == 20
 
 
+def test_feed_served_from_cache(client, db_service_dependency_override):
+    db_service_dependency_override.read_recent_posts.return_value = documents(
+        PostFactory.batch(20)
+    )
+    feed_cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+    app.dependency_overrides[get_feed_cache] = lambda: feed_cache
+
+    first = client.get(url + "/feed")
+    second = client.get(url + "/feed")
+
+    assert db_service_dependency_override.read_recent_posts.call_count == 1
+    assert first.json() == second.json()
+    assert len(second.json()) == 20
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+
+
+def test_feed_cache_refreshed_on_new_post(client, db_service_dependency_override):
+    db_service_dependency_override.read_recent_posts.return_value = []
+    feed_cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+    app.dependency_overrides[get_feed_cache] = lambda: feed_cache
+
+    assert client.get(url + "/feed").json() == []
+
+    post = PostFactory.build()
+    db_service_dependency_override.read_recent_posts.return_value = documents([post])
+    client.post(url + "/create/post", json=jsonable_encoder(post))
+
+    assert client.get(url + "/feed").json() == [jsonable_encoder(post)]
+
+
+def test_feed_not_modified(client, db_service_dependency_override):
+    db_service_dependency_override.read_recent_posts.return_value = documents(
+        PostFactory.batch(5)
+    )
+    feed_cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+    app.dependency_overrides[get_feed_cache] = lambda: feed_cache
+
+    first = client.get(url + "/feed")
+    etag = first.headers["ETag"]
+
+    r = client.get(url + "/feed", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["ETag"] == etag
+
+    r = client.get(url + "/feed", headers={"If-None-Match": '"stale"'})
+    assert r.status_code == 200
+    assert r.json() == first.json()
+
+
+def test_feed_next_cursor(client, db_service_dependency_override):
+    posts = PostFactory.batch(5)
+    db_service_dependency_override.read_recent_posts.return_value = documents(posts)
+
+    r = client.get(url + "/feed", params={"limit": 5})
+
+    assert r.status_code == 200
+    assert r.headers["X-Next-Cursor"] == encode_cursor(
+        posts[-1].timestamp, posts[-1].post_id
+    )
+    db_service_dependency_override.read_recent_posts.assert_called_with(
+        5, after=None, raw=True
+    )
+
+
+def test_feed_last_page(client, db_service_dependency_override):
+    db_service_dependency_override.read_recent_posts.return_value = documents(
+        PostFactory.batch(3)
+    )
+
+    r = client.get(url + "/feed", params={"limit": 5, "after": "cursor"})
+
+    assert r.status_code == 200
+    assert "X-Next-Cursor" not in r.headers
+    db_service_dependency_override.read_recent_posts.assert_called_with(
+        5, after="cursor", raw=True
+    )
+
+
+def test_feed_invalid_cursor(client, db_service_dependency_override):
+    db_service_dependency_override.read_recent_posts.side_effect = (
+        InvalidCursorException
+    )
+
+    r = client.get(url + "/feed", params={"after": "garbage"})
+    assert r.status_code == 400
+
+
+def test_feed_limit_too_large(client, db_service_dependency_override):
+    r = client.get(url + "/feed", params={"limit": 1000})
+    assert r.status_code == 422
+
+
 def test_get_post(client, db_service_dependency_override):
     post = PostFactory.build()
     db_service_dependency_override.read_post.return_value = post
@@ -35,10 +154,14 @@ def test_get_post_not_in_db(client, db_service_dependency_override):
 
 def test_get_user(client, db_service_dependency_override):
     user = UserFactory.build()
-    db_service_dependency_override.read_user.return_value = user
+    db_service_dependency_override.read_user.return_value = PrivateUser(**user.dict())
 
     r = client.get(url + f"/users/{user.username}")
     assert r.status_code == 200
+    assert "password" not in r.json()
+    db_service_dependency_override.read_user.assert_called_once_with(
+        user.username, view=PrivateUser
+    )
 
 
 def test_get_user_not_in_db(client, db_service_dependency_override):
@@ -56,7 +179,7 @@ def test_get_user_posts(client, db_service_dependency_override):
     for p in posts:
         p.username = user.username
 
-    db_service_dependency_override.read_posts_of_user.return_value = posts
+    db_service_dependency_override.read_posts_of_user.return_value = documents(posts)
 
     r = client.get(url + f"/users/{user.username}/posts")
     assert r.status_code == 200
@@ -80,11 +203,35 @@ def test_get_comments_of_post(client, db_service_dependency_override):
     for c in comments:
         c.post_id = post.post_id
 
-    db_service_dependency_override.read_comments_of_post.return_value = comments
+    db_service_dependency_override.read_comments_of_post.return_value = documents(
+        comments
+    )
 
-    r = client.get(url + f"/posts/{post.post_id}/comments")
+    r = client.get(url + f"/posts/{post.post_id}/comments", params={"limit": 10})
     assert r.status_code == 200
     assert len(r.json()) == 10
+    assert r.headers["X-Next-Cursor"] == encode_cursor(
+        comments[-1].timestamp, comments[-1].comment_id
+    )
+
+
+def test_get_comments_of_post_with_pending(client, db_service_dependency_override):
+    post = PostFactory.build()
+    comments = sorted(
+        CommentFactory.batch(3), key=lambda c: (c.timestamp, c.comment_id)
+    )
+    for c in comments:
+        c.post_id = post.post_id
+    db_service_dependency_override.read_comments_of_post.return_value = documents(
+        comments[:2]
+    )
+    write_behind = WriteBehindQueue(db_service_dependency_override)
+    write_behind.add_comment(comments[2])
+    app.dependency_overrides[get_write_behind] = lambda: write_behind
+
+    r = client.get(url + f"/posts/{post.post_id}/comments")
+
+    assert [c["_id"] for c in r.json()] == [c.comment_id for c in comments]
 
 
 def test_get_comments_of_post_not_found(client, db_service_dependency_override):
@@ -99,30 +246,216 @@ def test_get_comments_of_post_not_found(client, db_service_dependency_override):
 
 def test_get_users_of_likes(client, db_service_dependency_override):
     post = PostFactory.build()
-    liked_usernames = [u.username for u in UserFactory.batch(10)]
-    post.likes = liked_usernames
+    likes = LikeFactory.batch(10)
 
-    db_service_dependency_override.read_post.return_value = post
-    db_service_dependency_override.read_user.return_value = UserFactory.build()
+    db_service_dependency_override.read_likes_of_post.return_value = likes
+    db_service_dependency_override.read_users.return_value = UserFactory.batch(10)
 
-    r = client.get(url + f"/posts/{post.post_id}/likes")
+    r = client.get(url + f"/posts/{post.post_id}/likes", params={"limit": 10})
     assert r.status_code == 200
     assert len(r.json()) == 10
+    assert set(r.json()[0]) == {"_id"}
+    assert r.headers["X-Next-Cursor"] == encode_cursor(
+        likes[-1].timestamp, likes[-1].like_id
+    )
 
 
 def test_get_users_of_likes_post_not_found(client, db_service_dependency_override):
     post = PostFactory.build()
-    db_service_dependency_override.read_post.side_effect = PostNotFoundException
+    db_service_dependency_override.read_likes_of_post.side_effect = (
+        PostNotFoundException
+    )
 
     r = client.get(url + f"/posts/{post.post_id}/likes")
     assert r.status_code == 404
     assert r.json()["detail"] == "Post not found"
 
 
-def test_get_users_of_likes_user_not_found(client, db_service_dependency_override):
+def test_get_users_of_likes_deleted_user(client, db_service_dependency_override):
     post = PostFactory.build()
-    db_service_dependency_override.read_post.side_effect = UserNotFoundException
+    likes = LikeFactory.batch(3)
+    db_service_dependency_override.read_likes_of_post.return_value = likes
+    db_service_dependency_override.read_users.return_value = UserFactory.batch(2)
 
     r = client.get(url + f"/posts/{post.post_id}/likes")
+    assert r.status_code == 200
+    assert len(r.json()) == 2
+    db_service_dependency_override.read_users.assert_called_once_with(
+        [like.username for like in likes], view=PublicUser
+    )
+
+
+def test_get_user_timeline(client, db_service_dependency_override):
+    user = UserFactory.build()
+    db_service_dependency_override.read_timeline.return_value = PostFactory.batch(20)
+
+    r = client.get(url + f"/users/{user.username}/timeline")
+    assert r.status_code == 200
+    assert len(r.json()) == 20
+    assert "X-Next-Cursor" in r.headers
+
+
+def test_get_user_timeline_user_not_found(client, db_service_dependency_override):
+    user = UserFactory.build()
+    db_service_dependency_override.read_timeline.side_effect = UserNotFoundException
+
+    r = client.get(url + f"/users/{user.username}/timeline")
+    assert r.status_code == 404
+
+
+def test_get_job(client, db_service_dependency_override):
+    job = JobFactory.build()
+    db_service_dependency_override.read_job.return_value = job
+
+    r = client.get(url + f"/jobs/{job.job_id}")
+    assert r.status_code == 200
+    assert r.json()["status"] == job.status
+
+
+def test_get_job_not_found(client, db_service_dependency_override):
+    db_service_dependency_override.read_job.side_effect = JobNotFoundException
+
+    r = client.get(url + "/jobs/unknown")
+    assert r.status_code == 404
+
+
+def test_search_posts(client, db_service_dependency_override):
+    posts = documents(PostFactory.batch(2))
+    for post, score in zip(posts, (2.0, 1.5)):
+        post["score"] = score
+    db_service_dependency_override.search_posts.return_value = posts
+
+    r = client.get(url + "/search", params={"q": "#tag words", "limit": 2})
+
+    assert r.status_code == 200
+    assert [p["_id"] for p in r.json()] == [p["_id"] for p in posts]
+    assert "score" not in r.json()[0]
+    assert r.headers["X-Next-Cursor"] == encode_rank_cursor(1.5, posts[1]["_id"])
+    db_service_dependency_override.search_posts.assert_called_with(
+        "#tag words", limit=2, after=None, raw=True
+    )
+
+
+def test_search_comments(client, db_service_dependency_override):
+    db_service_dependency_override.search_comments.return_value = documents(
+        CommentFactory.batch(3)
+    )
+
+    r = client.get(url + "/search", params={"q": "@user", "scope": "comments"})
+
+    assert r.status_code == 200
+    assert len(r.json()) == 3
+    assert "X-Next-Cursor" not in r.headers
+
+
+def test_search_invalid_query(client, db_service_dependency_override):
+    assert client.get(url + "/search").status_code == 422
+    assert client.get(url + "/search", params={"q": "x" * 201}).status_code == 422
+
+    db_service_dependency_override.search_posts.side_effect = InvalidCursorException
+    r = client.get(url + "/search", params={"q": "words", "after": "garbage"})
+    assert r.status_code == 400
+
+
+def batches(*pages):
+    async def generate(*args, **kwargs):
+        for page in pages:
+            yield page
+
+    return generate
+
+
+def test_export_user(client, db_service_dependency_override):
+    user = UserFactory.build()
+    posts = documents(PostFactory.batch(3))
+    comments = documents(CommentFactory.batch(2))
+    db_service_dependency_override.read_user.return_value = PrivateUser(**user.dict())
+    db_service_dependency_override.export_posts_of_user.side_effect = batches(
+        posts[:2], posts[2:]
+    )
+    db_service_dependency_override.export_comments_of_posts.side_effect = batches(
+        comments
+    )
+
+    r = client.get(url + f"/export/users/{user.username}")
+
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in r.text.splitlines()]
+    assert [record["type"] for record in records] == [
+        "user",
+        "post",
+        "post",
+        "comment",
+        "comment",
+        "post",
+        "comment",
+        "comment",
+    ]
+    assert "password" not in records[0]
+    assert records[1]["_id"] == posts[0]["_id"]
+
+
+def test_export_user_gzip(client, db_service_dependency_override):
+    user = UserFactory.build()
+    posts = documents(PostFactory.batch(3))
+    db_service_dependency_override.export_posts_of_user.side_effect = batches(posts)
+
+    r = client.get(url + f"/export/users/{user.username}/posts", params={"gzip": True})
+
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert [json.loads(line)["_id"] for line in r.text.splitlines()] == [
+        p["_id"] for p in posts
+    ]
+
+
+def test_export_not_found(client, db_service_dependency_override):
+    db_service_dependency_override.read_user.side_effect = UserNotFoundException
+    db_service_dependency_override.check_user_exists.side_effect = UserNotFoundException
+    db_service_dependency_override.check_post_exists.side_effect = PostNotFoundException
+
+    assert client.get(url + "/export/users/unknown").status_code == 404
+    assert client.get(url + "/export/users/unknown/posts").status_code == 404
+    assert client.get(url + "/export/posts/unknown/comments").status_code == 404
+
+
+def test_get_post_detail(client, db_service_dependency_override):
+    post = PostFactory.build()
+    comments = documents(CommentFactory.batch(3))
+    db_service_dependency_override.read_post_detail.return_value = {
+        **jsonable_encoder(post),
+        "comments": comments,
+    }
+
+    r = client.get(url + f"/posts/{post.post_id}/detail", params={"comments_limit": 3})
+
+    assert r.status_code == 200
+    assert r.json()["post"] == jsonable_encoder(post)
+    assert [c["_id"] for c in r.json()["comments"]] == [c["_id"] for c in comments]
+    assert r.headers["X-Next-Cursor"] == encode_cursor(
+        comments[-1]["timestamp"], comments[-1]["_id"]
+    )
+    db_service_dependency_override.read_post_detail.assert_called_once_with(
+        post.post_id, comments_limit=3, raw=True
+    )
+
+
+def test_get_post_detail_not_found(client, db_service_dependency_override):
+    db_service_dependency_override.read_post_detail.side_effect = PostNotFoundException
+
+    r = client.get(url + "/posts/unknown/detail")
+    assert r.status_code == 404
+
+
+def test_stream_comments_post_not_found(client, db_service_dependency_override):
+    app.dependency_overrides[get_event_bus] = lambda: EventBus()
+    db_service_dependency_override.check_post_exists.side_effect = PostNotFoundException
+
+    r = client.get(url + "/stream/posts/unknown/comments")
+    assert r.status_code == 404
+
+
+def test_stream_disabled(client, db_service_dependency_override):
+    r = client.get(url + "/stream/feed")
     assert r.status_code == 404
-    assert r.json()["detail"] == "User not found"
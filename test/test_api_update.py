@@ -1,12 +1,18 @@
+from unittest.mock import AsyncMock
+
 from conftest import url
 from fastapi.encoders import jsonable_encoder
 
+from owntwitter.api.endpoints import get_feed_cache, get_write_behind
+from owntwitter.app import app
 from owntwitter.models.exceptions import (
     CommentNotFoundException,
     PostNotFoundException,
     UserNotFoundException,
 )
 from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.services.feed_cache import FeedCache
+from owntwitter.services.write_behind import WriteBehindQueue
 
 
 def test_update_user(client, db_service_dependency_override):
@@ -35,6 +41,16 @@ def test_update_post(client, db_service_dependency_override):
     assert r.status_code == 202
 
 
+def test_update_post_refreshes_feed_cache(client, db_service_dependency_override):
+    feed_cache = AsyncMock(spec=FeedCache)
+    app.dependency_overrides[get_feed_cache] = lambda: feed_cache
+    post = PostFactory.build()
+
+    r = client.put(url + "/update/post", json=jsonable_encoder(post))
+    assert r.status_code == 202
+    feed_cache.refresh.assert_awaited_once()
+
+
 def test_update_post_user_not_found(client, db_service_dependency_override):
     post = PostFactory.build()
     post_json = jsonable_encoder(post)
@@ -91,3 +107,63 @@ def test_update_comment_not_found(client, db_service_dependency_override):
 
     r = client.put(url + f"/update/comment", json=comment_json)
     assert r.status_code == 404
+
+
+def test_like_post(client, db_service_dependency_override):
+    post = PostFactory.build()
+    user = UserFactory.build()
+
+    r = client.post(
+        url + f"/posts/{post.post_id}/like", params={"username": user.username}
+    )
+    assert r.status_code == 202
+    db_service_dependency_override.like_post.assert_called_with(
+        post.post_id, user.username
+    )
+
+
+def test_like_post_write_behind(client, db_service_dependency_override):
+    write_behind = WriteBehindQueue(db_service_dependency_override)
+    app.dependency_overrides[get_write_behind] = lambda: write_behind
+    post = PostFactory.build()
+    user = UserFactory.build()
+
+    r = client.post(
+        url + f"/posts/{post.post_id}/like", params={"username": user.username}
+    )
+    assert r.status_code == 202
+    assert write_behind.has_like(post.post_id, user.username)
+    db_service_dependency_override.like_post.assert_not_called()
+
+    # a pending like is written before it is removed
+    r = client.post(
+        url + f"/posts/{post.post_id}/unlike", params={"username": user.username}
+    )
+    assert r.status_code == 202
+    assert write_behind.pending == 0
+    db_service_dependency_override.bulk_insert_likes.assert_called_once()
+    db_service_dependency_override.unlike_post.assert_called_with(
+        post.post_id, user.username
+    )
+
+
+def test_like_post_not_found(client, db_service_dependency_override):
+    post = PostFactory.build()
+    user = UserFactory.build()
+
+    db_service_dependency_override.like_post.side_effect = PostNotFoundException
+
+    r = client.post(
+        url + f"/posts/{post.post_id}/like", params={"username": user.username}
+    )
+    assert r.status_code == 404
+
+
+def test_unlike_post(client, db_service_dependency_override):
+    post = PostFactory.build()
+    user = UserFactory.build()
+
+    r = client.post(
+        url + f"/posts/{post.post_id}/unlike", params={"username": user.username}
+    )
+    assert r.status_code == 202
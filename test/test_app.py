@@ -0,0 +1,28 @@
+from unittest.mock import MagicMock
+
+from starlette.testclient import TestClient
+
+from owntwitter.api.endpoints import get_db_service
+from owntwitter.app import app
+from owntwitter.services.async_db import AsyncDatabaseConnector
+
+
+def test_db_connector_shared_across_requests():
+    with TestClient(app):
+        db = app.state.db
+        assert isinstance(db, AsyncDatabaseConnector)
+
+        request = MagicMock()
+        request.app = app
+        assert get_db_service(request) is db
+        assert get_db_service(request) is db
+
+
+def test_metrics_endpoint():
+    with TestClient(app) as client:
+        client.get("/api/feed")
+        r = client.get("/metrics")
+
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert "# TYPE mongo_command_duration_seconds histogram" in r.text
@@ -0,0 +1,74 @@
+from owntwitter.models.factories import (
+    CommentFactory,
+    LikeFactory,
+    PostFactory,
+    UserFactory,
+)
+
+
+def test_bulk_insert_users(get_db):
+    users = UserFactory.batch(25)
+
+    assert get_db.bulk_insert_users(users, batch_size=10) == 25
+    assert get_db.read_users([u.username for u in users]) == users
+
+
+def test_bulk_insert_skips_duplicates(get_db):
+    users = UserFactory.batch(5)
+    get_db.create_new_user(users[2])
+
+    assert get_db.bulk_insert_users(users, batch_size=2) == 4
+    assert get_db.bulk_insert_users(users) == 0
+
+
+def test_bulk_insert_posts_fills_timelines(get_db):
+    author, follower = UserFactory.batch(2)
+    get_db.bulk_insert_users([author, follower])
+    get_db.follow_user(follower.username, author.username)
+
+    posts = PostFactory.batch(5)
+    for p in posts:
+        p.username = author.username
+
+    assert get_db.bulk_insert_posts(iter(posts), batch_size=2) == 5
+    assert len(get_db.read_posts_of_user(author.username)) == 5
+    assert len(get_db.read_timeline(author.username)) == 5
+    assert len(get_db.read_timeline(follower.username)) == 5
+
+
+def test_bulk_insert_comments_counts_comments(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    posts = PostFactory.batch(2)
+    for p in posts:
+        p.username = user.username
+        p.number_of_comments = 0
+    get_db.bulk_insert_posts(posts)
+
+    comments = CommentFactory.batch(7)
+    for idx, c in enumerate(comments):
+        c.username = user.username
+        c.post_id = posts[idx % 2].post_id
+
+    assert get_db.bulk_insert_comments(comments, batch_size=3) == 7
+    # duplicates are neither inserted nor counted
+    assert get_db.bulk_insert_comments(comments[:2]) == 0
+
+    assert get_db.read_post(posts[0].post_id).number_of_comments == 4
+    assert get_db.read_post(posts[1].post_id).number_of_comments == 3
+
+
+def test_bulk_insert_likes_counts_likes(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    post = PostFactory.build()
+    post.username = user.username
+    get_db.create_new_post(post)
+
+    likes = LikeFactory.batch(3)
+    for like in likes:
+        like.post_id = post.post_id
+
+    assert get_db.bulk_insert_likes(likes) == 3
+    assert get_db.bulk_insert_likes(likes) == 0
+    assert get_db.read_post(post.post_id).like_count == post.like_count + 3
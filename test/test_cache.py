@@ -0,0 +1,132 @@
+import pytest
+
+from owntwitter.models.exceptions import PostNotFoundException, UserNotFoundException
+from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.services.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hit_and_miss():
+    cache = TTLCache(max_size=10, ttl=5)
+
+    assert cache.get("key") is None
+    cache.put("key", "value")
+    assert cache.get("key") == "value"
+
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5, clock=clock)
+    cache.put("key", "value")
+
+    clock.now = 4
+    assert cache.get("key") == "value"
+
+    clock.now = 6
+    assert cache.get("key") is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=5)
+    cache.put("first", 1)
+    cache.put("second", 2)
+
+    cache.get("first")
+    cache.put("third", 3)
+
+    assert cache.get("second") is None
+    assert cache.get("first") == 1
+    assert cache.get("third") == 3
+    assert cache.evictions == 1
+
+
+def test_cache_invalidate():
+    cache = TTLCache(max_size=10, ttl=5)
+    cache.put("key", "value")
+
+    cache.invalidate("key")
+    assert cache.get("key") is None
+
+
+def test_cache_skips_values_read_before_invalidation():
+    cache = TTLCache(max_size=10, ttl=5)
+
+    generation = cache.generation
+    cache.invalidate("key")  # a write finished while the value was being read
+    cache.put("key", "outdated", generation)
+
+    assert cache.get("key") is None
+
+
+def create_post(db):
+    user = UserFactory.build()
+    db.create_new_user(user)
+    post = PostFactory.build(username=user.username, like_count=0)
+    post.number_of_comments = 0
+    db.create_new_post(post)
+    return user, post
+
+
+def test_cached_connector_serves_reads_from_cache(get_cached_db):
+    user, post = create_post(get_cached_db)
+    get_cached_db.read_post(post.post_id)
+    get_cached_db.read_user(user.username)
+
+    # writes of other workers are only seen once the entries expire
+    get_cached_db._posts.update_one({"_id": post.post_id}, {"$set": {"content": "x"}})
+    assert get_cached_db.read_post(post.post_id).content == post.content
+    assert get_cached_db.cache_stats()["posts"]["hits"] == 1
+
+
+def test_cached_connector_invalidates_updated_documents(get_cached_db):
+    user, post = create_post(get_cached_db)
+    get_cached_db.read_post(post.post_id)
+    get_cached_db.read_user(user.username)
+
+    get_cached_db.update_post(post.copy(update={"content": "edited"}))
+    get_cached_db.update_user(user.copy(update={"email": "new@example.com"}))
+
+    assert get_cached_db.read_post(post.post_id).content == "edited"
+    assert get_cached_db.read_user(user.username).email == "new@example.com"
+
+
+def test_cached_connector_invalidates_counters(get_cached_db):
+    user, post = create_post(get_cached_db)
+    comment = CommentFactory.build(post_id=post.post_id, username=user.username)
+    get_cached_db.read_post(post.post_id)
+
+    get_cached_db.like_post(post.post_id, user.username)
+    get_cached_db.create_new_comment(comment)
+    assert get_cached_db.read_post(post.post_id).like_count == 1
+    assert get_cached_db.read_post(post.post_id).number_of_comments == 1
+
+    get_cached_db.unlike_post(post.post_id, user.username)
+    get_cached_db.delete_comment(comment.comment_id)
+    assert get_cached_db.read_post(post.post_id).like_count == 0
+    assert get_cached_db.read_post(post.post_id).number_of_comments == 0
+
+    get_cached_db.bulk_insert_comments([comment])
+    assert get_cached_db.read_post(post.post_id).number_of_comments == 1
+
+
+def test_cached_connector_invalidates_deleted_documents(get_cached_db):
+    user, post = create_post(get_cached_db)
+    get_cached_db.read_post(post.post_id)
+    get_cached_db.read_user(user.username)
+
+    get_cached_db.delete_post(post.post_id)
+    with pytest.raises(PostNotFoundException):
+        get_cached_db.read_post(post.post_id)
+
+    get_cached_db.delete_user(user.username)
+    with pytest.raises(UserNotFoundException):
+        get_cached_db.read_user(user.username)
@@ -10,12 +10,7 @@ from owntwitter.models.exceptions import (
 )
 from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
 from owntwitter.models.models import Comment
-from owntwitter.services.db import DatabaseConnector
-
-
-@pytest.fixture
-def get_db():
-    return DatabaseConnector()
+from owntwitter.services.pagination import encode_cursor
 
 
 def test_create_comment(get_db):
@@ -63,6 +58,19 @@ def test_create_comment_no_user_and_post(get_db):
         get_db.create_new_comment(comment)
 
 
+def test_create_comment_post_not_found(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    comment = CommentFactory.build()
+    comment.username = user.username
+
+    with pytest.raises(PostNotFoundException):
+        get_db.create_new_comment(comment)
+    with pytest.raises(CommentNotFoundException):
+        get_db.read_comment(comment.comment_id)
+
+
 def test_read_comment(get_db):
     user = UserFactory.build()
     post = PostFactory.build()
@@ -101,6 +109,9 @@ def test_read_comments_of_post(get_db):
         c.post_id = post.post_id
         get_db.create_new_comment(c)
 
+    # comment sections are ordered oldest first
+    comments.sort(key=lambda c: (c.timestamp, c.comment_id))
+
     response_list = get_db.read_comments_of_post(post.post_id)
     assert comments == response_list
 
@@ -126,10 +137,43 @@ def test_read_comments_of_user(get_db):
         c.post_id = post.post_id
         get_db.create_new_comment(c)
 
+    # comment sections are ordered oldest first
+    comments.sort(key=lambda c: (c.timestamp, c.comment_id))
+
     response_list = get_db.read_comments_of_post(post.post_id)
     assert comments == response_list
 
 
+def test_read_comments_of_post_paginated(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    post = PostFactory.build()
+    post.username = user.username
+    get_db.create_new_post(post)
+
+    comments = CommentFactory.batch(25)
+    for c in comments:
+        c.username = user.username
+        c.post_id = post.post_id
+        # identical timestamps are ordered by comment_id
+        c.timestamp = comments[0].timestamp
+        get_db.create_new_comment(c)
+    comments.sort(key=lambda c: c.comment_id)
+
+    pages = []
+    after = None
+    while True:
+        page = get_db.read_comments_of_post(post.post_id, limit=10, after=after)
+        pages.append(page)
+        if len(page) < 10:
+            break
+        after = encode_cursor(page[-1].timestamp, page[-1].comment_id)
+
+    assert [len(p) for p in pages] == [10, 10, 5]
+    assert [c for p in pages for c in p] == comments
+
+
 def test_read_comments_of_user_not_found(get_db):
     user = UserFactory.build()
 
@@ -220,3 +264,50 @@ def test_delete_comment_not_in_db(get_db):
 
     with pytest.raises(CommentNotFoundException):
         get_db.delete_comment(comment.comment_id)
+
+
+def test_comment_counter(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    post = PostFactory.build()
+    post.username = user.username
+    post.number_of_comments = 0
+    get_db.create_new_post(post)
+
+    comments = CommentFactory.batch(3)
+    for c in comments:
+        c.username = user.username
+        c.post_id = post.post_id
+        get_db.create_new_comment(c)
+
+    assert get_db.read_post(post.post_id).number_of_comments == 3
+
+    get_db.delete_comment(comments[0].comment_id)
+    assert get_db.read_post(post.post_id).number_of_comments == 2
+
+
+def test_reconcile_counters(get_sync_db):
+    user = UserFactory.build()
+    get_sync_db.create_new_user(user)
+
+    post = PostFactory.build()
+    post.username = user.username
+    get_sync_db.create_new_post(post)
+
+    comments = CommentFactory.batch(3)
+    for c in comments:
+        c.username = user.username
+        c.post_id = post.post_id
+        get_sync_db.create_new_comment(c)
+
+    # simulate drift
+    get_sync_db._posts.update_one(
+        {"_id": post.post_id}, {"$set": {"number_of_comments": 42, "like_count": 7}}
+    )
+
+    corrected = get_sync_db.reconcile_counters()
+
+    assert corrected["number_of_comments"] >= 1
+    assert get_sync_db.read_post(post.post_id).number_of_comments == 3
+    assert get_sync_db.read_post(post.post_id).like_count == 0
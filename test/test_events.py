@@ -0,0 +1,166 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import OperationFailure
+
+from owntwitter.models.factories import CommentFactory, PostFactory
+from owntwitter.services.events import (
+    FEED_TOPIC,
+    ChangeStreamPublisher,
+    EventBus,
+    comments_topic,
+    event_stream,
+)
+
+
+def parse(message: bytes):
+    event, data = message.decode().strip().split("\n")
+    return event.removeprefix("event: "), orjson.loads(data.removeprefix("data: "))
+
+
+def test_publish_to_subscribers():
+    bus = EventBus()
+    post = jsonable_encoder(PostFactory.build())
+    comment = jsonable_encoder(CommentFactory.build())
+
+    with bus.subscribe(FEED_TOPIC) as feed, bus.subscribe(
+        comments_topic(comment["post_id"])
+    ) as comments:
+        bus.publish_document("posts", {**post, "hashtags": []})
+        bus.publish_document("comments", comment)
+
+        assert parse(feed.get_nowait()) == ("post", post)
+        assert parse(comments.get_nowait()) == ("comment", comment)
+        assert feed.empty() and comments.empty()
+
+    assert bus.subscribers(FEED_TOPIC) == 0
+
+
+def test_slow_subscriber_loses_oldest_events():
+    bus = EventBus(queue_size=2)
+    with bus.subscribe("topic") as queue:
+        for message in (b"1", b"2", b"3"):
+            bus.publish("topic", message)
+
+        assert [queue.get_nowait(), queue.get_nowait()] == [b"2", b"3"]
+
+
+def test_publish_write_only_without_change_stream():
+    bus = EventBus(from_writes=False)
+    with bus.subscribe(FEED_TOPIC) as feed:
+        bus.publish_write("posts", jsonable_encoder(PostFactory.build()))
+        assert feed.empty()
+
+
+def test_event_stream():
+    bus = EventBus()
+
+    async def run():
+        stream = event_stream(bus, "topic", keepalive=0.01)
+        messages = [await stream.__anext__()]
+        bus.publish("topic", b"event: post\ndata: {}\n\n")
+        messages.append(await stream.__anext__())
+        messages.append(await stream.__anext__())
+        await stream.aclose()
+        return messages
+
+    assert asyncio.run(run()) == [
+        b": subscribed\n\n",
+        b"event: post\ndata: {}\n\n",
+        b": keepalive\n\n",
+    ]
+    assert bus.subscribers("topic") == 0
+
+
+def test_change_stream_unavailable_falls_back_to_writes():
+    async def watch_inserts(resume_after, on_open):
+        raise OperationFailure("not a replica set", code=40573)
+        yield
+
+    db = MagicMock()
+    db.watch_inserts = watch_inserts
+    bus = EventBus()
+
+    async def run():
+        publisher = ChangeStreamPublisher(db, bus)
+        publisher.start()
+        await asyncio.sleep(0)
+        await publisher.close()
+
+    asyncio.run(run())
+    assert bus.from_writes
+
+
+def test_change_stream_publishes_writes_until_opened():
+    opened = asyncio.Event()
+
+    async def watch_inserts(resume_after, on_open):
+        await opened.wait()
+        on_open()
+        await asyncio.Event().wait()
+        yield
+
+    db = MagicMock()
+    db.watch_inserts = watch_inserts
+    bus = EventBus()
+
+    async def run():
+        publisher = ChangeStreamPublisher(db, bus)
+        publisher.start()
+        await asyncio.sleep(0)
+        assert bus.from_writes
+        opened.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert not bus.from_writes
+        await publisher.close()
+
+    asyncio.run(run())
+
+
+def test_change_stream_restarts_without_lost_resume_token():
+    calls = []
+
+    async def watch_inserts(resume_after, on_open):
+        calls.append(resume_after)
+        on_open()
+        if len(calls) == 1:
+            yield {"_id": "token", "ns": {"coll": "posts"}, "fullDocument": {}}
+            raise OperationFailure("history lost", code=286)
+        await asyncio.Event().wait()
+        yield
+
+    db = MagicMock()
+    db.watch_inserts = watch_inserts
+    bus = EventBus()
+
+    async def run():
+        publisher = ChangeStreamPublisher(db, bus, retry_seconds=0)
+        publisher.start()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        await publisher.close()
+
+    asyncio.run(run())
+    assert calls == [None, None]
+    assert not bus.from_writes
+
+
+def test_change_stream_close_logs_failures(caplog):
+    async def watch_inserts(resume_after, on_open):
+        raise ValueError("unexpected change")
+        yield
+
+    db = MagicMock()
+    db.watch_inserts = watch_inserts
+
+    async def run():
+        publisher = ChangeStreamPublisher(db, EventBus())
+        publisher.start()
+        await asyncio.sleep(0)
+        await publisher.close()
+
+    asyncio.run(run())
+    assert "change stream publisher failed" in caplog.text
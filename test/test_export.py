@@ -0,0 +1,58 @@
+import asyncio
+import gzip
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.services.export import gzip_stream, ndjson
+from owntwitter.services.serialization import COMMENT_FIELDS, POST_FIELDS
+
+
+def test_ndjson():
+    posts = [jsonable_encoder(p) for p in PostFactory.batch(3)]
+
+    lines = ndjson(posts, POST_FIELDS, "post").splitlines()
+
+    assert len(lines) == 3
+    record = orjson.loads(lines[0])
+    assert record.pop("type") == "post"
+    assert record == {name: posts[0][name] for name in POST_FIELDS}
+
+
+def test_gzip_stream():
+    async def chunks():
+        for idx in range(100):
+            yield f"line {idx}\n".encode()
+
+    async def compress():
+        return b"".join([chunk async for chunk in gzip_stream(chunks())])
+
+    compressed = asyncio.run(compress())
+    assert gzip.decompress(compressed) == b"".join(
+        f"line {idx}\n".encode() for idx in range(100)
+    )
+
+
+def test_export_posts_and_comments(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    posts = PostFactory.batch(5)
+    for post in posts:
+        post.username = user.username
+        get_db.create_new_post(post)
+
+    comment = CommentFactory.build()
+    comment.post_id = posts[0].post_id
+    comment.username = user.username
+    get_db.create_new_comment(comment)
+
+    batches = list(get_db.export_posts_of_user(user.username, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert {d["_id"] for batch in batches for d in batch} == {p.post_id for p in posts}
+    assert set(batches[0][0]) == set(POST_FIELDS)
+
+    post_ids = [p.post_id for p in posts]
+    batches = list(get_db.export_comments_of_posts(post_ids))
+    assert [[d["_id"] for d in batch] for batch in batches] == [[comment.comment_id]]
+    assert set(batches[0][0]) <= set(COMMENT_FIELDS)
@@ -0,0 +1,115 @@
+import asyncio
+
+from owntwitter.services.feed_cache import FeedCache, FeedPage, InMemoryCacheBackend
+
+
+class CountingLoader:
+    def __init__(self, page=FeedPage.create(b"[]", None), delay=0.01):
+        self.page = page
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.page
+
+
+def test_feed_page_round_trip():
+    page = FeedPage.create(b'[{"content": "a\\nb"}]', "cursor")
+
+    assert FeedPage.decode(page.encode()) == page
+    empty = FeedPage.create(b"[]", None)
+    assert FeedPage.decode(empty.encode()) == empty
+
+
+def test_feed_page_etag_follows_body():
+    assert FeedPage.create(b"[]", None).etag == FeedPage.create(b"[]", "c").etag
+    assert FeedPage.create(b"[]", None).etag != FeedPage.create(b"[{}]", None).etag
+
+
+def test_concurrent_misses_load_once():
+    cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+    load = CountingLoader()
+
+    async def run():
+        return await asyncio.gather(*(cache.get(load) for _ in range(50)))
+
+    pages = asyncio.run(run())
+
+    assert load.calls == 1
+    assert all(page == load.page for page in pages)
+
+
+def test_workers_sharing_a_backend_load_once():
+    backend = InMemoryCacheBackend()
+    workers = [FeedCache(backend, ttl=30, poll_interval=0.001) for _ in range(4)]
+    load = CountingLoader()
+
+    async def run():
+        await asyncio.gather(*(worker.get(load) for worker in workers))
+
+    asyncio.run(run())
+
+    assert load.calls == 1
+
+
+def test_hit_does_not_load():
+    cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+    load = CountingLoader()
+
+    async def run():
+        await cache.get(load)
+        await cache.get(load)
+
+    asyncio.run(run())
+
+    assert load.calls == 1
+
+
+def test_refresh_replaces_page():
+    cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+    new_page = FeedPage.create(b'[{"content": "new"}]', None)
+
+    async def run():
+        await cache.get(CountingLoader())
+        await cache.refresh(CountingLoader(new_page))
+        return await cache.get(CountingLoader())
+
+    assert asyncio.run(run()) == new_page
+
+
+def test_refresh_keeps_page_of_later_refresh():
+    backend = InMemoryCacheBackend()
+    first, second = FeedCache(backend, ttl=30), FeedCache(backend, ttl=30)
+    old_page = FeedPage.create(b'[{"content": "old"}]', None)
+    new_page = FeedPage.create(b'[{"content": "new"}]', None)
+
+    async def run():
+        # the first refresh loads before a later write, but finishes last
+        await asyncio.gather(
+            first.refresh(CountingLoader(old_page, delay=0.05)),
+            second.refresh(CountingLoader(new_page, delay=0.01)),
+        )
+        return await first.get(CountingLoader())
+
+    assert asyncio.run(run()) == new_page
+
+
+def test_failed_load_is_raised_to_waiters_and_retried():
+    cache = FeedCache(InMemoryCacheBackend(), ttl=30)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("mongo down")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get(fail) for _ in range(3)), return_exceptions=True
+        )
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+    load = CountingLoader()
+    asyncio.run(cache.get(load))
+    assert load.calls == 1
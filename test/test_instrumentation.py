@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from pymongo import monitoring
+
+from owntwitter.services.instrumentation import (
+    MAX_PENDING_EXPLAINS,
+    CommandInstrumentation,
+    QueryMetrics,
+    current_method,
+    instrumented,
+    query_shape,
+)
+
+CONNECTION = ("localhost", 27017)
+
+
+def run_command(listener, command, reply, milliseconds, request_id=1):
+    name = next(iter(command))
+    listener.started(
+        monitoring.CommandStartedEvent(command, "twitter", request_id, CONNECTION, 1)
+    )
+    listener.succeeded(
+        monitoring.CommandSucceededEvent(
+            timedelta(milliseconds=milliseconds),
+            reply,
+            name,
+            request_id,
+            CONNECTION,
+            1,
+        )
+    )
+
+
+def test_records_commands():
+    metrics = QueryMetrics()
+    listener = CommandInstrumentation(metrics, slow_query_ms=1000)
+
+    reply = {"cursor": {"firstBatch": [{"_id": "a"}, {"_id": "b"}]}, "ok": 1}
+    run_command(listener, {"find": "posts", "filter": {"_id": "a"}}, reply, 20)
+    run_command(listener, {"find": "posts", "filter": {"_id": "b"}}, reply, 40, 2)
+
+    stats = metrics.snapshot()[("", "find", "posts")]
+    assert stats.count == 2
+    assert stats.documents == 4
+    assert stats.bytes == 0  # opt-in
+    assert abs(stats.seconds - 0.06) < 1e-9
+
+    text = metrics.to_prometheus()
+    labels = 'method="",command="find",collection="posts"'
+    assert f'mongo_command_duration_seconds_bucket{{{labels},le="0.025"}} 1' in text
+    assert f'mongo_command_duration_seconds_bucket{{{labels},le="0.05"}} 2' in text
+    assert f"mongo_documents_returned_total{{{labels}}} 4" in text
+
+
+def test_records_reply_bytes():
+    metrics = QueryMetrics()
+    listener = CommandInstrumentation(metrics, slow_query_ms=1000, reply_bytes=True)
+
+    reply = {"cursor": {"firstBatch": [{"_id": "a"}]}, "ok": 1}
+    run_command(listener, {"find": "posts", "filter": {"_id": "a"}}, reply, 20)
+
+    assert metrics.snapshot()[("", "find", "posts")].bytes > 0
+
+
+def test_records_failures():
+    metrics = QueryMetrics()
+    listener = CommandInstrumentation(metrics, slow_query_ms=1000)
+
+    command = {"insert": "users", "documents": [{"_id": "a"}]}
+    listener.started(
+        monitoring.CommandStartedEvent(command, "twitter", 1, CONNECTION, 1)
+    )
+    listener.failed(
+        monitoring.CommandFailedEvent(
+            timedelta(milliseconds=1), {"code": 11000}, "insert", 1, CONNECTION, 1
+        )
+    )
+
+    assert metrics.snapshot()[("", "insert", "users")].failures == 1
+
+
+def test_logs_slow_queries(caplog):
+    listener = CommandInstrumentation(QueryMetrics(), slow_query_ms=100)
+    command = {"find": "comments", "filter": {"post_id": "secret"}}
+
+    with caplog.at_level(logging.WARNING):
+        run_command(listener, command, {"cursor": {"firstBatch": []}}, 50)
+        run_command(listener, command, {"cursor": {"firstBatch": []}}, 150, 2)
+
+    [record] = caplog.records
+    assert "comments" in record.getMessage()
+    assert "{'post_id': '?'}" in record.getMessage()
+    assert "secret" not in record.getMessage()
+
+
+class QueuedExecutor:
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, fn, *args):
+        self.queued.append((fn, args))
+
+    def run(self):
+        while self.queued:
+            fn, args = self.queued.pop(0)
+            fn(*args)
+
+
+def test_explains_each_query_shape_once(caplog):
+    listener = CommandInstrumentation(
+        QueryMetrics(), slow_query_ms=100, explain_host="localhost"
+    )
+    listener._explainer = QueuedExecutor()
+    listener._explain_client = MagicMock()
+    listener._explain_client.__getitem__().command.return_value = {
+        "queryPlanner": {"winningPlan": {"indexName": "post_id_1"}}
+    }
+    reply = {"cursor": {"firstBatch": []}}
+
+    with caplog.at_level(logging.WARNING):
+        for request_id, post_id in enumerate(["a", "b", "c"]):
+            command = {"find": "comments", "filter": {"post_id": post_id}}
+            run_command(listener, command, reply, 150, request_id)
+        # the same shape is queued once, and logged without its plan meanwhile
+        assert len(listener._explainer.queued) == 1
+        listener._explainer.run()
+
+        command = {"find": "comments", "filter": {"post_id": "d"}}
+        run_command(listener, command, reply, 150, 4)
+
+    assert listener._explain_client.__getitem__().command.call_count == 1
+    assert not listener._explainer.queued
+    assert [r.getMessage().endswith("plan=post_id_1") for r in caplog.records] == [
+        False,
+        False,
+        True,
+        True,
+    ]
+
+
+def test_bounds_pending_explains(caplog):
+    listener = CommandInstrumentation(
+        QueryMetrics(), slow_query_ms=100, explain_host="localhost"
+    )
+    listener._explainer = QueuedExecutor()
+
+    with caplog.at_level(logging.WARNING):
+        for request_id in range(MAX_PENDING_EXPLAINS + 2):
+            command = {"find": f"collection{request_id}", "filter": {}}
+            run_command(listener, command, {"cursor": {}}, 150, request_id)
+
+    assert len(listener._explainer.queued) == MAX_PENDING_EXPLAINS
+    assert len(caplog.records) == 2
+
+
+def test_query_shape():
+    query = {"$or": [{"timestamp": {"$lt": "t"}}, {"_id": {"$in": ["a", "b"]}}]}
+
+    assert query_shape(query) == {
+        "$or": [{"timestamp": {"$lt": "?"}}, {"_id": {"$in": "?"}}]
+    }
+
+
+def test_instrumented_attributes_outermost_method():
+    @instrumented
+    class Connector:
+        def read(self):
+            return current_method.get()
+
+        def update(self):
+            return self.read()
+
+        async def read_async(self):
+            return current_method.get()
+
+        async def export(self):
+            for _ in range(2):
+                yield current_method.get()
+
+        def _private(self):
+            return current_method.get()
+
+    connector = Connector()
+    assert connector.read() == "read"
+    assert connector.update() == "update"
+    assert asyncio.run(connector.read_async()) == "read_async"
+
+    async def consume():
+        # the consumer itself is not attributed to the generator
+        return [(item, current_method.get()) async for item in connector.export()]
+
+    assert asyncio.run(consume()) == [("export", None), ("export", None)]
+    assert connector._private() is None
+    assert current_method.get() is None
@@ -0,0 +1,163 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pymongo import DESCENDING
+
+from owntwitter.models.factories import CommentFactory, PostFactory
+from owntwitter.services.db import DatabaseConnector
+from owntwitter.services.migrations import MIGRATIONS, migrate
+
+
+@pytest.fixture
+def get_db():
+    return DatabaseConnector()
+
+
+def test_migrate_creates_indexes(get_db):
+    get_db.migrate()
+
+    post_indexes = get_db._posts.index_information()
+    comment_indexes = get_db._comments.index_information()
+
+    assert "username_1_timestamp_-1__id_-1" in post_indexes
+    assert "timestamp_-1__id_-1" in post_indexes
+    assert "post_id_1_timestamp_1__id_1" in comment_indexes
+    assert "username_1_timestamp_-1" in comment_indexes
+
+
+def test_migrate_idempotent(get_db):
+    get_db.migrate()
+
+    assert get_db.migrate() == []
+    assert get_db._db.migrations.count_documents({}) == len(MIGRATIONS)
+
+
+def test_migrate_drops_superseded_indexes_once(get_db):
+    get_db.migrate()
+    # a previous run was interrupted after dropping the first superseded index
+    get_db._db.migrations.delete_one({"_id": 2})
+    get_db._posts.create_index([("timestamp", DESCENDING)])
+
+    assert get_db.migrate() == [2]
+
+    assert "timestamp_-1" not in get_db._posts.index_information()
+    assert "username_1_timestamp_-1" not in get_db._posts.index_information()
+
+
+def test_explain_queries_use_indexes(get_db):
+    get_db.migrate()
+
+    report = get_db.explain_queries()
+
+    assert report["read_posts_of_user"] == ["username_1_timestamp_-1__id_-1"]
+    assert report["read_recent_posts"] == ["timestamp_-1__id_-1"]
+    assert report["read_comments_of_post"] == ["post_id_1_timestamp_1__id_1"]
+    assert report["read_comments_of_user"] == ["username_1_timestamp_-1"]
+    assert report["read_likes_of_post"] == ["post_id_1_timestamp_1__id_1"]
+    assert report["read_timeline"] == ["owner_1_timestamp_-1_post_id_-1"]
+
+
+def test_migrate_embedded_likes(get_db):
+    get_db._db.migrations.delete_one({"_id": 5})
+    post = PostFactory.build()
+    post_json = jsonable_encoder(post)
+    post_json["likes"] = ["first", "second"]
+    get_db._posts.insert_one(post_json)
+
+    assert get_db.migrate() == [5]
+
+    likes = get_db.read_likes_of_post(post.post_id)
+    assert sorted(like.username for like in likes) == ["first", "second"]
+    assert get_db.read_post(post.post_id).like_count == 2
+    assert "likes" not in get_db._posts.find_one({"_id": post.post_id})
+
+
+def test_migrate_tags_documents_without_content(get_db):
+    get_db.migrate()
+    get_db._db.migrations.delete_one({"_id": 6})
+    post, tagged = PostFactory.batch(2)
+    post.content = None
+    tagged.content = "#Mongo @alice"
+    comment = CommentFactory.build()
+    comment_json = jsonable_encoder(comment)
+    del comment_json["content"]
+    get_db._posts.insert_many([jsonable_encoder(post), jsonable_encoder(tagged)])
+    get_db._comments.insert_one(comment_json)
+
+    assert get_db.migrate() == [6]
+
+    for document in (
+        get_db._posts.find_one({"_id": post.post_id}),
+        get_db._comments.find_one({"_id": comment.comment_id}),
+    ):
+        assert document["hashtags"] == []
+        assert document["mentions"] == []
+    document = get_db._posts.find_one({"_id": tagged.post_id})
+    assert document["hashtags"] == ["mongo"]
+    assert document["mentions"] == ["alice"]
+
+
+def test_migrate_waits_for_lock(get_db):
+    get_db.migrate()
+    get_db._db.migrations.delete_one({"_id": 6})
+    get_db._db.migration_lock.insert_one(
+        {
+            "_id": "migrations",
+            "owner": "other worker",
+            "expires_at": datetime.utcnow() + timedelta(minutes=1),
+        }
+    )
+
+    applied = []
+    worker = threading.Thread(
+        target=lambda: applied.append(migrate(get_db._db, poll_seconds=0.01))
+    )
+    worker.start()
+    worker.join(0.2)
+    assert worker.is_alive() and not applied
+
+    get_db._db.migration_lock.delete_one({"_id": "migrations"})
+    worker.join(5)
+    assert applied == [[6]]
+    assert get_db._db.migration_lock.count_documents({}) == 0
+
+
+def test_migrate_takes_over_expired_lock(get_db):
+    get_db._db.migration_lock.insert_one(
+        {
+            "_id": "migrations",
+            "owner": "crashed worker",
+            "expires_at": datetime.utcnow() - timedelta(seconds=1),
+        }
+    )
+
+    migrate(get_db._db)
+    assert get_db._db.migrations.count_documents({}) == len(MIGRATIONS)
+    assert get_db._db.migration_lock.count_documents({}) == 0
+
+
+def test_migrate_embedded_likes_restartable(get_db):
+    get_db.migrate()
+    get_db._db.migrations.delete_one({"_id": 5})
+    post = PostFactory.build()
+    post_json = jsonable_encoder(post)
+    post_json["likes"] = ["first", "second"]
+    get_db._posts.insert_one(post_json)
+    # a previous run was interrupted after moving the first like
+    get_db._likes.insert_one(
+        {
+            "_id": "moved",
+            "post_id": post.post_id,
+            "username": "first",
+            "timestamp": post.timestamp,
+        }
+    )
+
+    assert get_db.migrate() == [5]
+
+    assert get_db._likes.count_documents({"post_id": post.post_id}) == 2
+    moved = get_db._likes.find_one({"post_id": post.post_id, "username": "first"})
+    assert moved["_id"] == "moved"
+    assert get_db.read_post(post.post_id).like_count == 2
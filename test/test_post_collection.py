@@ -1,16 +1,16 @@
 import datetime
 
 import pytest
+from fastapi.encoders import jsonable_encoder
 from pymongo.errors import DuplicateKeyError
 
-from owntwitter.models.exceptions import PostNotFoundException, UserNotFoundException
+from owntwitter.models.exceptions import (
+    InvalidCursorException,
+    PostNotFoundException,
+    UserNotFoundException,
+)
 from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
-from owntwitter.services.db import DatabaseConnector
-
-
-@pytest.fixture
-def get_db():
-    return DatabaseConnector()
+from owntwitter.services.pagination import encode_cursor
 
 
 def test_create_new_post(get_db):
@@ -55,10 +55,54 @@ def test_read_posts_of_user(get_db):
         p.username = user.username
         get_db.create_new_post(p)
 
+    # posts are ordered newest first
+    posts.sort(key=lambda p: (p.timestamp, p.post_id), reverse=True)
+
     post_list = get_db.read_posts_of_user(user.username)
     assert post_list == posts
 
 
+def test_read_posts_of_user_raw(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    posts = PostFactory.batch(3)
+
+    for p in posts:
+        p.username = user.username
+        get_db.create_new_post(p)
+
+    posts.sort(key=lambda p: (p.timestamp, p.post_id), reverse=True)
+
+    documents = get_db.read_posts_of_user(user.username, raw=True)
+    assert documents == [jsonable_encoder(p) for p in posts]
+
+
+def test_read_posts_of_user_paginated(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    posts = PostFactory.batch(15)
+
+    for p in posts:
+        p.username = user.username
+        get_db.create_new_post(p)
+    posts.sort(key=lambda p: (p.timestamp, p.post_id), reverse=True)
+
+    first_page = get_db.read_posts_of_user(user.username, limit=10)
+    after = encode_cursor(first_page[-1].timestamp, first_page[-1].post_id)
+    second_page = get_db.read_posts_of_user(user.username, limit=10, after=after)
+
+    assert first_page == posts[:10]
+    assert second_page == posts[10:]
+
+
+def test_read_posts_of_user_invalid_cursor(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    with pytest.raises(InvalidCursorException):
+        get_db.read_posts_of_user(user.username, limit=10, after="not-a-cursor")
+
+
 def test_read_posts_user_not_found(get_db):
     user = UserFactory.build()
     with pytest.raises(UserNotFoundException):
@@ -89,6 +133,30 @@ def test_read_post_not_found(get_db):
         get_db.read_post(post.post_id)
 
 
+def test_read_post_detail(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    post = PostFactory.build()
+    post.username = user.username
+    get_db.create_new_post(post)
+
+    comments = CommentFactory.batch(3)
+    for comment in comments:
+        comment.post_id = post.post_id
+        comment.username = user.username
+        get_db.create_new_comment(comment)
+
+    detail = get_db.read_post_detail(post.post_id, comments_limit=2)
+
+    assert detail.post.post_id == post.post_id
+    assert detail.post.number_of_comments == 3
+    oldest = sorted(comments, key=lambda c: (c.timestamp, c.comment_id))[:2]
+    assert [c.comment_id for c in detail.comments] == [c.comment_id for c in oldest]
+
+    with pytest.raises(PostNotFoundException):
+        get_db.read_post_detail("unknown")
+
+
 def test_read_recent_posts(get_db):
     user = UserFactory.build()
     get_db.create_new_user(user)
@@ -117,7 +185,33 @@ def test_update_post(get_db):
     response = get_db.update_post(new_post)
     assert response.acknowledged
     assert response.raw_result["updatedExisting"]
-    assert get_db.read_post(old_post.post_id) == new_post
+    assert get_db.read_post(old_post.post_id) == old_post.copy(
+        update={"content": new_post.content}
+    )
+
+
+def test_update_post_keeps_counters(get_db):
+    user, liker = UserFactory.batch(2)
+    get_db.create_new_user(user)
+    get_db.create_new_user(liker)
+
+    post = PostFactory.build(username=user.username, like_count=0)
+    post.number_of_comments = 0
+    get_db.create_new_post(post)
+    get_db.like_post(post.post_id, liker.username)
+    get_db.create_new_comment(
+        CommentFactory.build(post_id=post.post_id, username=liker.username)
+    )
+
+    # a stale client copy of the post still carries the old counters
+    edited = post.copy(update={"content": "edited #tag"})
+    get_db.update_post(edited)
+
+    stored = get_db.read_post(post.post_id)
+    assert stored.content == "edited #tag"
+    assert stored.like_count == 1
+    assert stored.number_of_comments == 1
+    assert get_db._posts.find_one({"_id": post.post_id})["hashtags"] == ["tag"]
 
 
 def test_update_post_not_found(get_db):
@@ -174,3 +268,92 @@ def test_delete_post_trigger(get_db):
 
     with pytest.raises(PostNotFoundException):
         get_db.read_comments_of_post(post.post_id)
+
+
+def test_like_post(get_db):
+    user, liker = UserFactory.batch(2)
+    get_db.create_new_user(user)
+    get_db.create_new_user(liker)
+
+    post = PostFactory.build()
+    post.username = user.username
+    post.like_count = 0
+    get_db.create_new_post(post)
+
+    get_db.like_post(post.post_id, liker.username)
+    get_db.like_post(post.post_id, liker.username)  # liking twice is a no-op
+
+    likes = get_db.read_likes_of_post(post.post_id)
+    assert [like.username for like in likes] == [liker.username]
+    assert get_db.read_post(post.post_id).like_count == 1
+
+    get_db.unlike_post(post.post_id, liker.username)
+    get_db.unlike_post(post.post_id, liker.username)
+
+    assert get_db.read_likes_of_post(post.post_id) == []
+    assert get_db.read_post(post.post_id).like_count == 0
+
+
+def test_read_likes_of_post_paginated(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    post = PostFactory.build()
+    post.username = user.username
+    get_db.create_new_post(post)
+
+    likers = UserFactory.batch(15)
+    for liker in likers:
+        get_db.create_new_user(liker)
+        get_db.like_post(post.post_id, liker.username)
+
+    first_page = get_db.read_likes_of_post(post.post_id, limit=10)
+    after = encode_cursor(first_page[-1].timestamp, first_page[-1].like_id)
+    second_page = get_db.read_likes_of_post(post.post_id, limit=10, after=after)
+
+    usernames = [like.username for like in first_page + second_page]
+    assert sorted(usernames) == sorted(u.username for u in likers)
+
+
+def test_like_post_not_found(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+    post = PostFactory.build()
+
+    with pytest.raises(PostNotFoundException):
+        get_db.like_post(post.post_id, user.username)
+    # the like is rolled back
+    assert get_db._likes.count_documents({"post_id": post.post_id}) == 0
+
+
+def test_check_post_exists(get_async_db):
+    user = UserFactory.build()
+    get_async_db.create_new_user(user)
+    post = PostFactory.build(username=user.username)
+    get_async_db.create_new_post(post)
+
+    get_async_db.check_post_exists(post.post_id)
+    with pytest.raises(PostNotFoundException):
+        get_async_db.check_post_exists("unknown")
+
+
+def test_recount_post_counters(get_async_db):
+    user = UserFactory.build()
+    get_async_db.create_new_user(user)
+    post, empty = PostFactory.batch(2)
+    for p in (post, empty):
+        p.username = user.username
+        get_async_db.create_new_post(p)
+    comment = CommentFactory.build(post_id=post.post_id, username=user.username)
+    get_async_db.create_new_comment(comment)
+    get_async_db.like_post(post.post_id, user.username)
+    get_async_db._posts.update_many(
+        {}, {"$set": {"number_of_comments": 42, "like_count": 7}}
+    )
+
+    get_async_db.recount_post_counters([post.post_id, empty.post_id])
+
+    assert get_async_db.read_post(post.post_id).number_of_comments == 1
+    assert get_async_db.read_post(post.post_id).like_count == 1
+    assert get_async_db.read_post(empty.post_id).number_of_comments == 0
+    assert get_async_db.read_post(empty.post_id).like_count == 0
@@ -0,0 +1,75 @@
+import threading
+import time
+
+from conftest import url
+
+from owntwitter import app as app_module
+from owntwitter.models.factories import PostFactory
+from owntwitter.services.profiling import (
+    RequestTimings,
+    SamplingProfiler,
+    current_timings,
+    timed,
+    write_folded_stacks,
+)
+
+
+def test_timed_adds_to_current_request():
+    @timed("validation")
+    def build():
+        time.sleep(0.01)
+
+    build()  # outside of a request nothing is recorded
+
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        build()
+    finally:
+        current_timings.reset(token)
+
+    assert timings.seconds["validation"] >= 0.01
+    assert timings.seconds["db"] == 0
+
+
+def test_sampling_profiler(tmp_path):
+    def busy_loop():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.001)
+    profiler.start()
+    busy_loop()
+    stacks = profiler.stop()
+
+    assert any("busy_loop" in stack for stack in stacks)
+
+    path = write_folded_stacks(stacks, str(tmp_path), "test")
+    line = path.read_text().splitlines()[0]
+    assert int(line.rsplit(" ", 1)[1]) >= 1
+
+
+def test_server_timing_header(client, db_service_dependency_override):
+    db_service_dependency_override.read_post.return_value = PostFactory.build()
+
+    r = client.get(url + "/posts/some-id")
+
+    phases = [part.split(";")[0] for part in r.headers["Server-Timing"].split(", ")]
+    assert phases == ["db", "validation", "serialization", "total"]
+
+
+def test_profile_on_header(
+    client, db_service_dependency_override, monkeypatch, tmp_path
+):
+    db_service_dependency_override.read_post.return_value = PostFactory.build()
+    monkeypatch.setattr(app_module.settings, "profile_header_enabled", True)
+    monkeypatch.setattr(app_module.settings, "profile_dir", str(tmp_path))
+
+    client.get(url + "/posts/some-id")
+    assert not list(tmp_path.iterdir())
+
+    client.get(url + "/posts/some-id", headers={"X-Profile": "1"})
+    [profile] = tmp_path.iterdir()
+    assert "-api_posts_{post_id}-" in profile.name
+    assert profile.suffix == ".folded"
@@ -0,0 +1,96 @@
+import pytest
+
+from owntwitter.models.exceptions import InvalidCursorException
+from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
+from owntwitter.services.pagination import decode_rank_cursor, encode_rank_cursor
+from owntwitter.services.search import content_tags, parse_query
+
+
+def create_posts(db, contents):
+    user = UserFactory.build()
+    db.create_new_user(user)
+
+    posts = []
+    for content in contents:
+        post = PostFactory.build()
+        post.username = user.username
+        post.content = content
+        db.create_new_post(post)
+        posts.append(post)
+    return posts
+
+
+def test_content_tags():
+    tags = content_tags("#Python and #python with @alice, cc @bob #mongo_db")
+
+    assert tags == {"hashtags": ["mongo_db", "python"], "mentions": ["alice", "bob"]}
+
+
+def test_parse_query():
+    query = parse_query("#Python  fast @alice json")
+
+    assert query.hashtags == ["python"]
+    assert query.mentions == ["alice"]
+    assert query.text == "fast json"
+
+
+def test_rank_cursor_round_trip():
+    assert decode_rank_cursor(encode_rank_cursor(1.5, "id")) == (1.5, "id")
+
+    with pytest.raises(InvalidCursorException):
+        decode_rank_cursor("garbage")
+
+
+def test_posts_are_tagged(get_db):
+    (post,) = create_posts(get_db, ["hello #World @someone"])
+
+    document = get_db._posts.find_one({"_id": post.post_id})
+    assert document["hashtags"] == ["world"]
+    assert document["mentions"] == ["someone"]
+
+
+def test_search_posts_by_hashtag(get_db):
+    posts = create_posts(get_db, [f"post {i} #searchtag" for i in range(5)])
+    create_posts(get_db, ["no tags here"])
+
+    found = get_db.search_posts("#SearchTag", limit=3)
+    assert [p.post_id for p in found] == [
+        p.post_id for p in sorted(posts, key=lambda p: p.timestamp, reverse=True)
+    ][:3]
+
+    documents = get_db.search_posts("#searchtag", limit=3, raw=True)
+    assert [d["_id"] for d in documents] == [p.post_id for p in found]
+
+
+def test_search_comments_by_mention(get_db):
+    (post,) = create_posts(get_db, ["a post"])
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    comment = CommentFactory.build()
+    comment.post_id = post.post_id
+    comment.username = user.username
+    comment.content = f"thanks @{post.username}"
+    get_db.create_new_comment(comment)
+
+    found = get_db.search_comments(f"@{post.username}")
+    assert [c.comment_id for c in found] == [comment.comment_id]
+
+
+def test_search_empty_query(get_db):
+    assert get_db.search_posts("   ") == []
+
+
+def test_search_posts_by_text(get_db):
+    posts = create_posts(
+        get_db, ["indexes make mongo fast", "mongo", "unrelated words only"]
+    )
+
+    found = get_db.search_posts("mongo fast")
+    assert [p.post_id for p in found] == [posts[0].post_id, posts[1].post_id]
+
+    # next page after the best match
+    documents = get_db.search_posts("mongo fast", limit=1, raw=True)
+    cursor = encode_rank_cursor(documents[0]["score"], documents[0]["_id"])
+    found = get_db.search_posts("mongo fast", after=cursor)
+    assert [p.post_id for p in found] == [posts[1].post_id]
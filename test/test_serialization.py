@@ -0,0 +1,60 @@
+import json
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from owntwitter.models.factories import CommentFactory, PostFactory
+from owntwitter.models.models import Comment, Post
+from owntwitter.services.pagination import encode_cursor
+from owntwitter.services.serialization import (
+    COMMENT_FIELDS,
+    POST_FIELDS,
+    document_cursor,
+    documents_to_json,
+    projection,
+)
+
+
+def test_documents_to_json_matches_response_model():
+    posts = PostFactory.batch(5)
+    documents = [jsonable_encoder(p) for p in posts]
+
+    expected = jsonable_encoder(parse_obj_as(List[Post], posts))
+    assert json.loads(documents_to_json(documents, POST_FIELDS)) == expected
+
+    comments = CommentFactory.batch(5)
+    documents = [jsonable_encoder(c) for c in comments]
+
+    expected = jsonable_encoder(parse_obj_as(List[Comment], comments))
+    assert json.loads(documents_to_json(documents, COMMENT_FIELDS)) == expected
+
+
+def test_documents_to_json_fills_defaults_and_drops_extra_fields():
+    document = jsonable_encoder(PostFactory.build())
+    del document["like_count"]
+    document["likes"] = ["someone"]
+
+    [post] = json.loads(documents_to_json([document], POST_FIELDS))
+
+    assert post["like_count"] == 0
+    assert "likes" not in post
+
+
+def test_projection():
+    assert projection(COMMENT_FIELDS) == {
+        "_id": 1,
+        "post_id": 1,
+        "username": 1,
+        "timestamp": 1,
+        "content": 1,
+    }
+
+
+def test_document_cursor():
+    documents = [jsonable_encoder(p) for p in PostFactory.batch(3)]
+
+    assert document_cursor(documents, 4) is None
+    assert document_cursor(documents, 3) == encode_cursor(
+        documents[-1]["timestamp"], documents[-1]["_id"]
+    )
@@ -0,0 +1,106 @@
+import pytest
+
+from owntwitter.models.exceptions import FollowNotFoundException, UserNotFoundException
+from owntwitter.models.factories import PostFactory, UserFactory
+from owntwitter.models.settings import Settings
+from owntwitter.services.db import DatabaseConnector
+from owntwitter.services.pagination import encode_cursor
+
+
+def create_users(db, count):
+    users = UserFactory.batch(count)
+    for u in users:
+        db.create_new_user(u)
+    return users
+
+
+def create_posts(db, user, count):
+    posts = PostFactory.batch(count)
+    for p in posts:
+        p.username = user.username
+        db.create_new_post(p)
+    return posts
+
+
+def newest_first(posts):
+    return sorted(posts, key=lambda p: (p.timestamp, p.post_id), reverse=True)
+
+
+def test_timeline_contains_own_and_followed_posts(get_db):
+    reader, author, stranger = create_users(get_db, 3)
+    get_db.follow_user(reader.username, author.username)
+
+    own_posts = create_posts(get_db, reader, 3)
+    followed_posts = create_posts(get_db, author, 5)
+    create_posts(get_db, stranger, 5)
+
+    timeline = get_db.read_timeline(reader.username, limit=20)
+    assert timeline == newest_first(own_posts + followed_posts)
+
+
+def test_follow_backfills_recent_posts(get_db):
+    reader, author = create_users(get_db, 2)
+    posts = create_posts(get_db, author, 5)
+
+    get_db.follow_user(reader.username, author.username)
+    get_db.follow_user(reader.username, author.username)  # idempotent
+
+    assert get_db.read_timeline(reader.username) == newest_first(posts)
+
+
+def test_follow_user_not_found(get_db):
+    reader = create_users(get_db, 1)[0]
+
+    with pytest.raises(UserNotFoundException):
+        get_db.follow_user(reader.username, UserFactory.build().username)
+
+
+def test_unfollow_removes_posts(get_db):
+    reader, author = create_users(get_db, 2)
+    get_db.follow_user(reader.username, author.username)
+    create_posts(get_db, author, 5)
+
+    get_db.unfollow_user(reader.username, author.username)
+
+    assert get_db.read_timeline(reader.username) == []
+    with pytest.raises(FollowNotFoundException):
+        get_db.unfollow_user(reader.username, author.username)
+
+
+def test_timeline_of_heavily_followed_account_merged_on_read():
+    db = DatabaseConnector(Settings(timeline_fan_out_limit=1))
+    first_reader, second_reader, author = create_users(db, 3)
+
+    db.follow_user(first_reader.username, author.username)
+    db.follow_user(second_reader.username, author.username)
+    posts = create_posts(db, author, 5)
+
+    # no entries are fanned out to the followers of the author
+    assert db._timelines.count_documents({"post_id": posts[0].post_id}) == 1
+
+    assert db.read_timeline(first_reader.username) == newest_first(posts)
+    assert db.read_timeline(second_reader.username) == newest_first(posts)
+
+
+def test_timeline_paginated(get_db):
+    reader, author = create_users(get_db, 2)
+    get_db.follow_user(reader.username, author.username)
+    posts = newest_first(create_posts(get_db, author, 15))
+
+    first_page = get_db.read_timeline(reader.username, limit=10)
+    after = encode_cursor(first_page[-1].timestamp, first_page[-1].post_id)
+    second_page = get_db.read_timeline(reader.username, limit=10, after=after)
+
+    assert first_page == posts[:10]
+    assert second_page == posts[10:]
+
+
+def test_deleted_post_removed_from_timeline(get_db):
+    reader, author = create_users(get_db, 2)
+    get_db.follow_user(reader.username, author.username)
+    posts = create_posts(get_db, author, 2)
+
+    get_db.delete_post(posts[0].post_id)
+
+    assert get_db.read_timeline(reader.username) == [posts[1]]
+    assert get_db._timelines.count_documents({"post_id": posts[0].post_id}) == 0
@@ -1,14 +1,9 @@
 import pytest as pytest
 from pymongo.errors import DuplicateKeyError
 
-from owntwitter.models.exceptions import UserNotFoundException
+from owntwitter.models.exceptions import PostNotFoundException, UserNotFoundException
 from owntwitter.models.factories import CommentFactory, PostFactory, UserFactory
-from owntwitter.services.db import DatabaseConnector
-
-
-@pytest.fixture
-def get_db():
-    return DatabaseConnector()
+from owntwitter.models.models import PrivateUser, PublicUser
 
 
 def test_create_new_user(get_db):
@@ -40,6 +35,30 @@ def test_read_user(get_db):
         assert response_user == u
 
 
+def test_read_users(get_db):
+    users = UserFactory.batch(5)
+    [get_db.create_new_user(u) for u in users]
+    deleted = UserFactory.build()
+
+    usernames = [u.username for u in reversed(users)]
+    response_users = get_db.read_users(
+        usernames[:2] + [deleted.username] + usernames[2:]
+    )
+    assert response_users == list(reversed(users))
+
+
+def test_read_user_views(get_db):
+    user = UserFactory.build()
+    get_db.create_new_user(user)
+
+    private = get_db.read_user(user.username, view=PrivateUser)
+    assert private == PrivateUser(username=user.username, email=user.email)
+
+    [public] = get_db.read_users([user.username], view=PublicUser)
+    assert public == PublicUser(username=user.username)
+    assert not hasattr(public, "password")
+
+
 def test_read_user_not_fount(get_db):
     user = UserFactory.build()
     with pytest.raises(UserNotFoundException):
@@ -105,3 +124,81 @@ def test_delete_user_trigger(get_db):
 
     with pytest.raises(UserNotFoundException):
         get_db.read_user(user.username)
+
+
+def test_delete_user_cascade(get_db):
+    user, other = UserFactory.batch(2)
+    get_db.create_new_user(user)
+    get_db.create_new_user(other)
+
+    own_post = PostFactory.build()
+    own_post.username = user.username
+    get_db.create_new_post(own_post)
+
+    other_post = PostFactory.build()
+    other_post.username = other.username
+    get_db.create_new_post(other_post)
+
+    # comments of the user on another post and of another user on the own post
+    comments = CommentFactory.batch(4)
+    for c in comments[:2]:
+        c.username = user.username
+        c.post_id = other_post.post_id
+    for c in comments[2:]:
+        c.username = other.username
+        c.post_id = own_post.post_id
+    [get_db.create_new_comment(c) for c in comments]
+    get_db._posts.update_one(
+        {"_id": other_post.post_id}, {"$set": {"number_of_comments": 5}}
+    )
+
+    get_db.delete_user(user.username)
+
+    with pytest.raises(PostNotFoundException):
+        get_db.read_post(own_post.post_id)
+    assert get_db.read_comments_of_user(user.username) == []
+    assert get_db.read_comments_of_user(other.username) == []
+    assert get_db.read_post(other_post.post_id).number_of_comments == 3
+
+
+def test_count_user_documents(get_async_db):
+    user, commenter = UserFactory.batch(2)
+    get_async_db.create_new_user(user)
+    get_async_db.create_new_user(commenter)
+    post = PostFactory.build(username=user.username, like_count=0)
+    post.number_of_comments = 0
+    get_async_db.create_new_post(post)
+    for comment in CommentFactory.batch(2):
+        comment.post_id = post.post_id
+        comment.username = commenter.username
+        get_async_db.create_new_comment(comment)
+    get_async_db.like_post(post.post_id, commenter.username)
+
+    # the post and the comments and the like on it
+    assert get_async_db.count_user_documents(user.username) == 4
+    assert get_async_db.count_user_documents(commenter.username) == 3
+
+    with pytest.raises(UserNotFoundException):
+        get_async_db.count_user_documents("unknown")
+
+
+def test_check_user_exists(get_async_db):
+    user = UserFactory.build()
+    get_async_db.create_new_user(user)
+
+    get_async_db.check_user_exists(user.username)
+    with pytest.raises(UserNotFoundException):
+        get_async_db.check_user_exists("unknown")
+
+
+def test_check_all_references(get_async_db):
+    user = UserFactory.build()
+    get_async_db.create_new_user(user)
+    post = PostFactory.build(username=user.username)
+    get_async_db.create_new_post(post)
+
+    get_async_db.check_all_references({user.username}, {post.post_id})
+    with pytest.raises(UserNotFoundException):
+        get_async_db.check_all_references({user.username, "unknown"})
+    with pytest.raises(PostNotFoundException):
+        get_async_db.check_all_references({user.username}, {post.post_id, "unknown"})
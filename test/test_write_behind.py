@@ -0,0 +1,168 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from owntwitter.models.exceptions import WriteBehindQueueFullException
+from owntwitter.models.factories import CommentFactory
+from owntwitter.services.pagination import encode_cursor
+from owntwitter.services.write_behind import WriteBehindQueue, merge_pending
+
+
+def fake_db():
+    db = AsyncMock()
+    db.bulk_insert_comments.return_value = 0
+    db.bulk_insert_likes.return_value = 0
+    return db
+
+
+def test_flush_writes_pending_comments_and_likes():
+    db = fake_db()
+    queue = WriteBehindQueue(db)
+    comments = CommentFactory.batch(3)
+    for comment in comments:
+        queue.add_comment(comment)
+    queue.add_like("post", "user")
+    queue.add_like("post", "user")  # repeated likes are written once
+
+    assert queue.pending == 4
+    asyncio.run(queue.flush())
+
+    assert queue.pending == 0
+    assert db.bulk_insert_comments.call_args.args[0] == comments
+    (likes, _), _ = db.bulk_insert_likes.call_args
+    assert [(like.post_id, like.username) for like in likes] == [("post", "user")]
+
+
+def test_failed_flush_keeps_writes_pending():
+    db = fake_db()
+    db.bulk_insert_comments.side_effect = ConnectionError
+    queue = WriteBehindQueue(db)
+    queue.add_comment(CommentFactory.build())
+
+    asyncio.run(queue.flush())
+    assert queue.pending == 1
+
+
+def test_flush_after_failure_recounts_counters():
+    db = fake_db()
+    # the comments were written, but their counters were not incremented
+    db.bulk_insert_likes.side_effect = [ConnectionError, 0]
+    queue = WriteBehindQueue(db)
+    comment = CommentFactory.build()
+    queue.add_comment(comment)
+    queue.add_like("post", "user")
+
+    asyncio.run(queue.flush())
+    db.recount_post_counters.assert_not_called()
+
+    asyncio.run(queue.flush())
+    assert queue.pending == 0
+    db.recount_post_counters.assert_awaited_once_with(sorted([comment.post_id, "post"]))
+
+    asyncio.run(queue.flush())
+    db.recount_post_counters.assert_awaited_once()
+
+
+def test_failed_flushes_back_off(caplog):
+    db = fake_db()
+    db.bulk_insert_comments.side_effect = [ConnectionError] * 3 + [0]
+    queue = WriteBehindQueue(db, flush_interval=0.05, max_backoff=0.3)
+    queue.add_comment(CommentFactory.build())
+
+    backoffs = []
+    for _ in range(3):
+        asyncio.run(queue.flush())
+        backoffs.append(queue._backoff())
+    assert backoffs == [0.1, 0.2, 0.3]
+    assert len(caplog.records) == 1
+
+    asyncio.run(queue.flush())
+    assert queue.pending == 0
+    assert queue._backoff() == 0.05
+    assert "after 3 failed attempts" in caplog.text
+
+
+def test_backpressure():
+    queue = WriteBehindQueue(fake_db(), max_pending=2)
+    queue.add_comment(CommentFactory.build())
+    queue.add_like("post", "user")
+
+    with pytest.raises(WriteBehindQueueFullException):
+        queue.add_comment(CommentFactory.build())
+
+
+def test_full_batch_is_flushed_before_the_interval():
+    db = fake_db()
+
+    async def run():
+        queue = WriteBehindQueue(db, batch_size=2, flush_interval=60)
+        queue.start()
+        queue.add_like("post", "first")
+        queue.add_like("post", "second")
+        await asyncio.sleep(0.01)
+        pending = queue.pending
+        await queue.close()
+        return pending
+
+    assert asyncio.run(run()) == 0
+    db.bulk_insert_likes.assert_awaited_once()
+
+
+def test_close_flushes_pending_writes():
+    db = fake_db()
+
+    async def run():
+        queue = WriteBehindQueue(db, flush_interval=60)
+        queue.start()
+        queue.add_comment(CommentFactory.build())
+        await queue.close()
+        return queue.pending
+
+    assert asyncio.run(run()) == 0
+    db.bulk_insert_comments.assert_awaited_once()
+
+
+def test_discard_post():
+    queue = WriteBehindQueue(fake_db())
+    comment = CommentFactory.build()
+    queue.add_comment(comment)
+    queue.add_like(comment.post_id, "user")
+
+    queue.discard_post(comment.post_id)
+    assert queue.pending == 0
+    assert queue.pending_comments(comment.post_id) == []
+
+
+def test_discard_user():
+    queue = WriteBehindQueue(fake_db())
+    comment, other = CommentFactory.batch(2)
+    other.post_id = comment.post_id
+    for c in (comment, other):
+        queue.add_comment(c)
+    queue.add_like(comment.post_id, comment.username)
+    queue.add_like(comment.post_id, other.username)
+
+    queue.discard_user(comment.username)
+    assert queue.pending == 2
+    assert not queue.has_comment(comment.comment_id)
+    assert not queue.has_like(comment.post_id, comment.username)
+    assert queue.has_like(comment.post_id, other.username)
+
+    queue.discard_user(other.username)
+    assert queue.pending == 0
+    assert queue.pending_comments(comment.post_id) == []
+
+
+def test_merge_pending():
+    comments = sorted(
+        (jsonable_encoder(c) for c in CommentFactory.batch(6)),
+        key=lambda c: (c["timestamp"], c["_id"]),
+    )
+    stored, pending = comments[:2] + comments[4:5], comments[2:4] + comments[5:]
+
+    assert merge_pending(stored, pending + stored[:1], None, 4) == comments[:4]
+
+    after = encode_cursor(comments[3]["timestamp"], comments[3]["_id"])
+    assert merge_pending(stored[2:], pending, after, 4) == comments[4:]